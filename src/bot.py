@@ -2,12 +2,15 @@ import discord
 from discord.ext import commands
 
 from src.config.config import discord_token
-from src.portfolios.database.connection import get_portfolio_connection
+from src.portfolios.database.connection import ConnectionPool
 from src.portfolios.database.schema import create_database_schema
-from src.portfolios.portfolio import setup_portfolio_commands, start_portfolio_tasks
+from src.portfolios.database.writer import PortfolioWriter
+from src.portfolios.portfolio import setup_portfolio_commands, setup_maintenance_tasks
+from src.portfolios.scheduler import setup_portfolio_scheduler
 
-from src.discord.commands import setup_watchlist_commands, setup_chart_commands
-from src.discord.tasks import setup_watchlist_tasks
+from src.discord.commands import setup_watchlist_commands, setup_chart_commands, setup_news_commands
+from src.discord.tasks import setup_watchlist_tasks, setup_news_tasks
+from src.discord.dispatcher import setup_dispatcher
 
 
 intents = discord.Intents.default()
@@ -32,24 +35,33 @@ async def on_ready():
         if not task.is_running():
             task.start()
             print(f'Started {task_name} task.')
-            
-    start_portfolio_tasks(bot, portfolio_db)
 
 setup_watchlist_commands(bot)
 setup_chart_commands(bot)
 
-portfolio_db = get_portfolio_connection()
-create_database_schema(portfolio_db)
-setup_portfolio_commands(bot, portfolio_db)
+portfolio_pool = ConnectionPool()
+with portfolio_pool.write() as conn:
+    create_database_schema(conn)
+
+portfolio_writer = PortfolioWriter(portfolio_pool)
+portfolio_writer.start()
+setup_portfolio_commands(bot, portfolio_pool, portfolio_writer)
+setup_news_commands(bot, portfolio_pool)
+setup_dispatcher(bot)
 
 task_dict = setup_watchlist_tasks(bot)
+task_dict.update(setup_maintenance_tasks(portfolio_pool))
+task_dict.update(setup_news_tasks(portfolio_pool))
+
+task_dict.update(setup_portfolio_scheduler(bot, portfolio_pool, portfolio_writer))
 
 @bot.event
 async def on_close():
     """
-    Stop the bot and close the portfolio database connection.
+    Stop the bot, flush queued portfolio writes and close the portfolio database connections.
     """
-    portfolio_db.close()
+    portfolio_writer.stop()
+    portfolio_pool.close()
     bot.loop.stop()
 
 bot.run(discord_token)
\ No newline at end of file
@@ -255,3 +255,158 @@ def create_bollinger_bands(symbol, period='1mo', interval='1d', window=20, num_o
         print(f'Error creating graph for {symbol}: {e}')
         plt.close('all')
         return None
+
+def create_performance_graph(portfolio_name, snapshots, range_label, resolution):
+    """
+    Create a line chart of a portfolio's total value over time and return a PNG buffer.
+
+    Args:
+        portfolio_name (str): Portfolio name for the title.
+        snapshots (list): (bucket, value) rows ordered by bucket, bucket formatted '%Y-%m-%d %H:%M'.
+        range_label (str): Range shown in the title (e.g. '1mo').
+        resolution (str): Snapshot resolution the rows were read from (e.g. '1h').
+
+    Returns:
+        io.BytesIO or None: PNG image buffer if successful, otherwise None.
+    """
+    try:
+        if not snapshots:
+            return None
+
+        df = pd.DataFrame(snapshots, columns=['Date', 'Value'])
+        df['Date'] = pd.to_datetime(df['Date'])
+
+        plt.figure(figsize=(10, 6))
+        sns.set_style('whitegrid')
+
+        color = 'green' if df['Value'].iloc[-1] >= df['Value'].iloc[0] else 'red'
+        sns.lineplot(data=df, x=range(len(df)), y='Value', linewidth=1.5, color=color)
+
+        total_days = (df['Date'].iloc[-1] - df['Date'].iloc[0]).days
+
+        if total_days <= 1:
+            date_format = '%H:%M'
+        elif total_days <= 7:
+            date_format = '%m/%d %H:%M'
+        elif total_days <= 365:
+            date_format = '%b %d'
+        else:
+            date_format = '%b %Y'
+
+        num_ticks = min(10, len(df))
+        tick_positions = [int(i * (len(df) - 1) / (num_ticks - 1)) for i in range(num_ticks)] if num_ticks > 1 else [0]
+        tick_labels = [df['Date'].iloc[i].strftime(date_format) for i in tick_positions]
+
+        plt.xticks(tick_positions, tick_labels, fontsize=9, rotation=45)
+        plt.yticks(fontsize=9)
+
+        plt.title(f'{portfolio_name} Portfolio Value - Last {range_label} ({resolution})', fontsize=17, fontweight='bold')
+        plt.xlabel('Date', fontsize=11)
+        plt.ylabel('Total Value ($)', fontsize=11)
+        plt.tight_layout()
+
+        # Buffer
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+        buf.seek(0)
+        plt.close('all')
+
+        return buf
+
+    except Exception as e:
+        print(f'Error creating performance graph for {portfolio_name}: {e}')
+        plt.close('all')
+        return None
+
+def create_correlation_heatmap(portfolio_name, symbols, matrix):
+    """
+    Render a correlation matrix of portfolio holdings as a heatmap and return a PNG buffer.
+
+    Args:
+        portfolio_name (str): Portfolio name for the title.
+        symbols (list): Symbols in matrix row/column order.
+        matrix (numpy.ndarray): Square correlation matrix.
+
+    Returns:
+        io.BytesIO or None: PNG image buffer if successful, otherwise None.
+    """
+    try:
+        size = max(6, min(0.6 * len(symbols) + 3, 20))
+        plt.figure(figsize=(size, size * 0.85))
+
+        sns.heatmap(
+            pd.DataFrame(matrix, index=symbols, columns=symbols),
+            annot=len(symbols) <= 15,
+            fmt='.2f',
+            cmap='RdYlGn',
+            vmin=-1,
+            vmax=1,
+            square=True,
+            linewidths=0.5,
+            cbar_kws={'label': 'Correlation'}
+        )
+
+        plt.title(f'{portfolio_name} Holdings Correlation (Daily Returns)', fontsize=15, fontweight='bold')
+        plt.xticks(fontsize=9, rotation=45)
+        plt.yticks(fontsize=9, rotation=0)
+        plt.tight_layout()
+
+        # Buffer
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+        buf.seek(0)
+        plt.close('all')
+
+        return buf
+
+    except Exception as e:
+        print(f'Error creating correlation heatmap for {portfolio_name}: {e}')
+        plt.close('all')
+        return None
+
+def create_equity_curve_graph(symbol, strategy, dates, equity, benchmark):
+    """
+    Plot a backtest equity curve against buying and holding the symbol and return a PNG buffer.
+
+    Args:
+        symbol (str): Backtested symbol.
+        strategy (str): Strategy name for the title.
+        dates (pandas.DatetimeIndex): Bar dates.
+        equity (numpy.ndarray): Strategy portfolio value per bar.
+        benchmark (numpy.ndarray): Buy-and-hold portfolio value per bar.
+
+    Returns:
+        io.BytesIO or None: PNG image buffer if successful, otherwise None.
+    """
+    try:
+        if len(dates) < 2:
+            return None
+
+        df = pd.DataFrame({'Strategy': equity, 'Buy & Hold': benchmark}, index=pd.DatetimeIndex(dates).tz_localize(None))
+
+        plt.figure(figsize=(10, 6))
+        sns.set_style('whitegrid')
+
+        sns.lineplot(data=df, dashes=False, linewidth=1.5, palette=['tab:blue', 'gray'])
+
+        plt.xticks(fontsize=9, rotation=45)
+        plt.yticks(fontsize=9)
+
+        plt.title(f'{symbol} Backtest: {strategy}', fontsize=17, fontweight='bold')
+        plt.xlabel('Date', fontsize=11)
+        plt.ylabel('Portfolio Value ($)', fontsize=11)
+        plt.legend(fontsize=10)
+        plt.tight_layout()
+
+        # Buffer
+        buf = io.BytesIO()
+        plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+        buf.seek(0)
+        plt.close('all')
+
+        return buf
+
+    except Exception as e:
+        print(f'Error creating equity curve for {symbol}: {e}')
+        plt.close('all')
+        return None
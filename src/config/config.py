@@ -11,6 +11,7 @@ discord_token = os.getenv("DISCORD_TOKEN")
 CHANNEL_ID = int(os.getenv('CHANNEL_ID'))
 STOCK_FILE = 'src/config/watchlist.json'
 PORTFOLIO_FILE = 'src/config/portfolio.json'
+SEEN_NEWS_FILE = 'src/config/seen_news.json'
 TIMEZONE = pytz.timezone('US/Eastern')
 TIME_NOW = dt.datetime.now(TIMEZONE)
 
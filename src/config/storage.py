@@ -1,5 +1,5 @@
 import json
-from src.config.config import STOCK_FILE, PORTFOLIO_FILE
+from src.config.config import STOCK_FILE, PORTFOLIO_FILE, SEEN_NEWS_FILE
 
 # --- file management for stocks ---
 def load_stocks():
@@ -33,7 +33,10 @@ STOCK_SYMBOLS = load_stocks()
 
 
 def load_portfolio():
-    """Load portfolio for portfolio specific tasks from a stored file."""
+    """
+    Load the portfolio registered for tasks in the stored file.
+    Only used to migrate it into the registered_portfolios table, which replaces this file.
+    """
     try:
         with open(PORTFOLIO_FILE, 'r') as f:
             data = json.load(f)
@@ -54,3 +57,27 @@ def save_portfolio(portfolio_name):
     """
     with open(PORTFOLIO_FILE, 'w') as f:
         json.dump({'registered_portfolio': portfolio_name}, f, indent=2)
+
+
+def load_seen_news():
+    """
+    Load the URLs of news articles that were already posted, oldest first.
+
+    Returns:
+        list: List of article URL strings, empty if the file does not exist.
+    """
+    try:
+        with open(SEEN_NEWS_FILE, 'r') as f:
+            return json.load(f).get('urls', [])
+    except FileNotFoundError:
+        return []
+
+def save_seen_news(urls):
+    """
+    Persist the URLs of posted news articles, oldest first.
+
+    Args:
+        urls (list): List of article URL strings to save to disk.
+    """
+    with open(SEEN_NEWS_FILE, 'w') as f:
+        json.dump({'urls': urls}, f)
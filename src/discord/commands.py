@@ -2,9 +2,14 @@ import yfinance as yf
 import discord
 from discord.ext import commands
 
+import asyncio
+
 from src.config.storage import STOCK_SYMBOLS, save_stocks
 from src.stock_data import get_batch_prices
 from src.charts import create_stock_graph, create_candlestick_graph, create_bollinger_bands
+from src.news import get_news_update
+from src.portfolios.database.news import index_articles, search_news
+from src.discord.pagination import LazyPaginator
 
 # --- Watchlist Commands ---
 def setup_watchlist_commands(bot):
@@ -82,30 +87,36 @@ def setup_watchlist_commands(bot):
         """
         Command: !watchlist
 
-        Sends an embed containing the current prices of all symbols in the watchlist.
+        Sends the current prices of the symbols in the watchlist, a page at a time.
+        Only the shown page's prices are fetched, the next page is fetched in the background.
         If the watchlist is empty, prompts the user to add symbols.
         """
         if not STOCK_SYMBOLS:
             await ctx.send(f'Watchlist is empty. Please use !add <symbol> to add stocks.')
             return
 
-        stock_data = get_batch_prices(STOCK_SYMBOLS)
+        async def render_page(symbols, page, pages):
+            stock_data = await asyncio.to_thread(get_batch_prices, symbols)
 
-        if stock_data:
             embed = discord.Embed(
                 title='Watchlist Prices',
                 color=discord.Color.blue()
                 )
-    
-            for symbol, price in stock_data.items():
+
+            for symbol in symbols:
+                price = stock_data.get(symbol)
                 embed.add_field(
                     name=symbol,
-                    value=f'${price:.2f}'
+                    value=f'${price:.2f}' if price else 'Price unavailable'
                 )
 
-            await ctx.send(embed=embed)
-        else:
+            return embed
+
+        try:
+            await LazyPaginator(ctx.author.id, STOCK_SYMBOLS, render_page).send(ctx)
+        except Exception as e:
             await ctx.send(f"Watching:\n {', '.join(sorted(STOCK_SYMBOLS))}.\n Could not get stock prices/data.")
+            print(f'Error getting watchlist prices:\n{e}')
 
 # --- Visual Commands ---
 def setup_chart_commands(bot):
@@ -193,4 +204,53 @@ def setup_chart_commands(bot):
             '1m', '2m', '5m', '15m', '30m', '60m', '90m', '1h',
             '1d', '5d', '1wk', '1mo', '3mo'
         ]
-        await ctx.send(f'Valid intervals are: {", ".join(intervals)}')
\ No newline at end of file
+        await ctx.send(f'Valid intervals are: {", ".join(intervals)}')
+
+# --- News Commands ---
+def setup_news_commands(bot, pool):
+
+    @bot.command()
+    async def news(ctx, *words):
+        """
+        Command: !news <query|symbol>
+
+        Searches the local news index, which the news refresh task keeps up to date for watched
+        and held symbols. A symbol missing from the index is fetched from Google News once and indexed.
+        """
+        if not words:
+            await ctx.send('Please provide a search query or stock symbol.')
+            return
+
+        text = ' '.join(words)
+
+        try:
+            results = await asyncio.to_thread(pool.run_read, search_news, text)
+
+            if not results and len(words) == 1 and words[0].isalpha() and len(words[0]) <= 5:
+                symbol = words[0].upper()
+                articles = await asyncio.to_thread(get_news_update, symbol, '')
+                await asyncio.to_thread(pool.run_write, index_articles, symbol, articles)
+                results = await asyncio.to_thread(pool.run_read, search_news, text)
+
+        except Exception as e:
+            await ctx.send(f'Error searching news for {text}.')
+            print(f'Error searching news for {text}: {e}')
+            return
+
+        if not results:
+            await ctx.send(f'No recent news found for {text}.')
+            return
+
+        embed = discord.Embed(
+            title=f'News: {text}',
+            color=discord.Color.blue()
+        )
+
+        for title, description, url, publisher, published_at, symbols in results:
+            embed.add_field(
+                name=title[:256],
+                value=f"{(description or '')[:300]}\n{publisher or 'Unknown'} - {published_at[:16]}\n[Read more]({url})"[:1024],
+                inline=False
+            )
+
+        await ctx.send(embed=embed)
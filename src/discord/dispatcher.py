@@ -0,0 +1,263 @@
+# Command dispatcher for the bot.
+# Every ! command passes through a global before_invoke hook that admits it into one of a fixed
+# number of run slots. Commands wait for a slot in a priority queue ordered by their class
+# (trades before quotes before charts before news), so a burst of charts cannot delay a trade.
+# Per-user and per-channel limits cap how many commands one source can have running or queued,
+# and once the queue is full new low-priority commands get a busy reply instead of waiting.
+# Trades are exempt from both, so a trade is never turned away.
+
+import time
+import heapq
+import asyncio
+import itertools
+import traceback
+
+import discord
+from discord.ext import commands
+
+from src.discord.outbox import outbox
+
+# priority classes, lower runs first
+PRIORITY_CLASSES = {
+    'trade': 0,
+    'quote': 1,
+    'chart': 2,
+    'news': 3,
+}
+
+COMMAND_CLASSES = {
+    'buy': 'trade',
+    'sell': 'trade',
+    'order': 'trade',
+    'cancel': 'trade',
+    'chart': 'chart',
+    'bollinger': 'chart',
+    'performance': 'chart',
+    'risk': 'chart',
+    'var': 'chart',
+    'correlation': 'chart',
+    'backtest': 'chart',
+    'leaderboard': 'chart',
+    'import': 'chart',
+    'news': 'news',
+}
+# commands not listed above are quick lookups
+DEFAULT_CLASS = 'quote'
+
+# commands running at once
+MAX_RUNNING = 4
+# run slots only trades may take, so a trade never waits behind slow commands
+RESERVED_TRADE_SLOTS = 1
+# waiting commands before new non-trade commands are turned away
+MAX_QUEUED = 20
+# commands one user or one channel may have running or queued. The bot serves a single channel,
+# so the channel limit covers every run slot and the whole queue. Trades are never turned away
+USER_LIMIT = 2
+CHANNEL_LIMIT = MAX_RUNNING + MAX_QUEUED
+
+class DispatcherBusy(commands.CommandError):
+    """Raised from the before_invoke hook when a command is turned away."""
+
+class CommandDispatcher:
+    """Priority admission of commands into a fixed number of run slots."""
+
+    def __init__(self, max_running=MAX_RUNNING, max_queued=MAX_QUEUED, user_limit=USER_LIMIT, channel_limit=CHANNEL_LIMIT):
+        self._max_running = max_running
+        self._max_queued = max_queued
+        self._user_limit = user_limit
+        self._channel_limit = channel_limit
+
+        self._running = 0
+        # (priority, sequence, priority class, future) of commands waiting for a slot
+        self._queue = []
+        self._sequence = itertools.count()
+        self._users = {}
+        self._channels = {}
+
+        self.metrics = {
+            command_class: {'admitted': 0, 'queued': 0, 'rejected': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for command_class in PRIORITY_CLASSES
+        }
+
+    def command_class(self, ctx):
+        return COMMAND_CLASSES.get(ctx.command.qualified_name if ctx.command else None, DEFAULT_CLASS)
+
+    def _has_slot(self, command_class):
+        reserved = 0 if command_class == 'trade' else RESERVED_TRADE_SLOTS
+        return self._running < self._max_running - reserved
+
+    def _waiting(self):
+        return sum(1 for entry in self._queue if not entry[3].done())
+
+    def _count(self, counts, key, delta):
+        counts[key] = counts.get(key, 0) + delta
+        if counts[key] <= 0:
+            del counts[key]
+
+    async def admit(self, ctx):
+        """before_invoke hook: wait for a run slot, or reply busy and raise DispatcherBusy."""
+        command_class = self.command_class(ctx)
+        metrics = self.metrics[command_class]
+        user = ctx.author.id
+        channel = ctx.channel.id
+
+        # trades still count against the limits but are never turned away by them
+        trade = command_class == 'trade'
+
+        if not trade and self._users.get(user, 0) >= self._user_limit:
+            metrics['rejected'] += 1
+            await ctx.send(f'{ctx.author.mention} you already have {self._user_limit} commands running, please wait for them to finish.')
+            raise DispatcherBusy('user limit')
+
+        if not trade and self._channels.get(channel, 0) >= self._channel_limit:
+            metrics['rejected'] += 1
+            await ctx.send('This channel has too many commands running, please try again shortly.')
+            raise DispatcherBusy('channel limit')
+
+        requested = time.perf_counter()
+        priority = PRIORITY_CLASSES[command_class]
+        # run now only if a slot is free and nothing of the same or higher priority is waiting
+        ahead = any(entry[0] <= priority and not entry[3].done() for entry in self._queue)
+
+        if self._has_slot(command_class) and not ahead:
+            self._running += 1
+        else:
+            waiting = self._waiting()
+            if not trade and waiting >= self._max_queued:
+                metrics['rejected'] += 1
+                await ctx.send(f'The bot is busy ({waiting} commands queued), please try !{ctx.invoked_with} again shortly.')
+                raise DispatcherBusy('queue full')
+
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._queue, (priority, next(self._sequence), command_class, future))
+            metrics['queued'] += 1
+
+            # queued commands count against the user and channel limits too
+            self._count(self._users, user, 1)
+            self._count(self._channels, channel, 1)
+            try:
+                await ctx.send(f'Queued !{ctx.invoked_with} ({waiting + 1} commands waiting).')
+                # a finishing command hands its slot over before resolving the future
+                await future
+            except BaseException:
+                self._count(self._users, user, -1)
+                self._count(self._channels, channel, -1)
+                if future.done() and not future.cancelled():
+                    self._release_slot()
+                else:
+                    future.cancel()
+                raise
+
+            self._count(self._users, user, -1)
+            self._count(self._channels, channel, -1)
+
+        wait = time.perf_counter() - requested
+        metrics['admitted'] += 1
+        metrics['wait_total'] += wait
+        metrics['wait_max'] = max(metrics['wait_max'], wait)
+
+        self._count(self._users, user, 1)
+        self._count(self._channels, channel, 1)
+        ctx.dispatcher_admitted = True
+
+    def _release_slot(self):
+        self._running -= 1
+
+        # hand free slots to the highest priority waiters that may use them. If the first waiter
+        # may not take the reserved slot, no waiter behind it may either
+        while self._queue:
+            _, _, command_class, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+
+            if not self._has_slot(command_class):
+                break
+
+            heapq.heappop(self._queue)
+            self._running += 1
+            future.set_result(None)
+
+    async def release(self, ctx):
+        """after_invoke hook: free the command's run slot."""
+        if not getattr(ctx, 'dispatcher_admitted', False):
+            return
+
+        ctx.dispatcher_admitted = False
+        self._count(self._users, ctx.author.id, -1)
+        self._count(self._channels, ctx.channel.id, -1)
+        self._release_slot()
+
+    def get_metrics(self):
+        """Queue state and per-class admission counts and average/max wait in milliseconds."""
+        return {
+            'running': self._running,
+            'queued': self._waiting(),
+            'classes': {
+                command_class: {
+                    'admitted': metrics['admitted'],
+                    'queued': metrics['queued'],
+                    'rejected': metrics['rejected'],
+                    'wait_avg_ms': metrics['wait_total'] / metrics['admitted'] * 1000 if metrics['admitted'] else 0.0,
+                    'wait_max_ms': metrics['wait_max'] * 1000,
+                }
+                for command_class, metrics in self.metrics.items()
+            },
+        }
+
+def setup_dispatcher(bot):
+    """
+    Install the command dispatcher on the bot and add the !queue metrics command.
+
+    :return: the CommandDispatcher
+    """
+    dispatcher = CommandDispatcher()
+
+    bot.before_invoke(dispatcher.admit)
+    bot.after_invoke(dispatcher.release)
+
+    @bot.listen()
+    async def on_command_error(ctx, error):
+        """Turned away commands were already answered. Other errors are printed like the default handler does."""
+        if isinstance(error, DispatcherBusy):
+            return
+
+        print(f'Ignoring exception in command {ctx.command}:')
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    @bot.command()
+    async def queue(ctx):
+        """
+        Command: !queue
+
+        Sends the dispatcher's running and queued commands, the queue wait time per priority class
+        and the outbound message queue's counts.
+        """
+        metrics = dispatcher.get_metrics()
+        outbox_metrics = outbox.get_metrics()
+
+        embed = discord.Embed(
+            title='Command Queue',
+            description=f"Running: {metrics['running']}\nQueued: {metrics['queued']}",
+            color=discord.Color.blue()
+        )
+
+        for command_class, class_metrics in metrics['classes'].items():
+            embed.add_field(
+                name=command_class.capitalize(),
+                value=(
+                    f"Admitted: {class_metrics['admitted']} ({class_metrics['queued']} queued)\n"
+                    f"Busy: {class_metrics['rejected']}\n"
+                    f"Wait: {class_metrics['wait_avg_ms']:.0f}ms avg, {class_metrics['wait_max_ms']:.0f}ms max"
+                ),
+                inline=True
+            )
+
+        embed.set_footer(text=(
+            f"Outbox: {outbox_metrics['sent']} sent, {outbox_metrics['queued']} queued, "
+            f"{outbox_metrics['coalesced']} alerts merged, {outbox_metrics['failed']} failed"
+        ))
+
+        await ctx.send(embed=embed)
+
+    return dispatcher
@@ -0,0 +1,236 @@
+# Outbound message queue for the bot's scheduled messages.
+# Tasks post embeds here instead of calling channel.send. One sender task sends them in priority
+# order, keeping each route (channel) under its Discord rate limit with a token bucket, so a burst
+# of alerts queues here instead of being delayed by Discord's 429 handling.
+# Alerts bound for the same channel within COALESCE_WINDOW seconds are merged into paginated
+# embeds of at most 25 fields, so the portfolio alerts of one scheduler tick go out as few messages.
+# The watchlist task runs on its own loop, so its alerts only join them when posted within the window.
+
+import time
+import heapq
+import asyncio
+import inspect
+import itertools
+
+import discord
+
+# send priorities, lower goes first
+PRIORITY_FILL = 0
+PRIORITY_ALERT = 1
+PRIORITY_REPORT = 2
+PRIORITY_NEWS = 3
+
+# seconds alerts for one channel are collected before they are merged and sent
+COALESCE_WINDOW = 2.0
+# Discord message route limit, messages per channel per period
+ROUTE_CAPACITY = 5
+ROUTE_PERIOD = 5.0
+# Discord embed limits
+MAX_FIELDS = 25
+MAX_EMBED_CHARS = 6000
+MAX_FIELD_NAME = 256
+
+class RouteBucket:
+    """Token bucket of one rate-limited route."""
+
+    def __init__(self, capacity=ROUTE_CAPACITY, period=ROUTE_PERIOD):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token if one is available. Returns True if it was taken."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def ready_in(self, now):
+        """Seconds until the next token is available."""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+def paginate_alerts(alerts, timestamp=None):
+    """
+    Merge alert embeds into pages that respect Discord's field and size limits.
+
+    :param alerts: list of (label, embed) with label naming the alert's source, e.g. a portfolio
+    :return: list of embeds
+    """
+    if len(alerts) == 1:
+        return [alerts[0][1]]
+
+    fields = []
+    for label, embed in alerts:
+        if embed.description:
+            fields.append((label[:MAX_FIELD_NAME], embed.description[:1024]))
+
+        for field in embed.fields:
+            fields.append((f'{label}: {field.name}'[:MAX_FIELD_NAME], field.value))
+
+    # group fields into pages under both the field count and total size limits, leaving room for the title
+    pages = [[]]
+    size = 0
+    for name, value in fields:
+        field_size = len(name) + len(value)
+        if len(pages[-1]) >= MAX_FIELDS or size + field_size > MAX_EMBED_CHARS - 256:
+            pages.append([])
+            size = 0
+        pages[-1].append((name, value))
+        size += field_size
+
+    embeds = []
+    for page_number, page in enumerate(pages, start=1):
+        title = f'ALERT: Big Price Movements ({len(alerts)} alerts)'
+        if len(pages) > 1:
+            title += f' [{page_number}/{len(pages)}]'
+
+        embed = discord.Embed(title=title, color=discord.Color.red(), timestamp=timestamp)
+        for name, value in page:
+            embed.add_field(name=name, value=value, inline=True)
+
+        embeds.append(embed)
+
+    return embeds
+
+class Outbox:
+    """Priority send queue with per-route rate limiting and alert coalescing."""
+
+    def __init__(self, coalesce_window=COALESCE_WINDOW):
+        self._coalesce_window = coalesce_window
+        # (priority, sequence, channel, content, embed, on_sent) waiting to be sent
+        self._queue = []
+        self._sequence = itertools.count()
+        # channel id -> [deadline, channel, priority, [(label, embed)]] of alerts being collected
+        self._pending = {}
+        self._buckets = {}
+        self._wakeup = None
+        self._task = None
+
+        self.stats = {
+            'posted': 0,
+            'coalesced': 0,
+            'sent': 0,
+            'failed': 0,
+            'throttled': 0,
+        }
+
+    def _start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def post(self, channel, content=None, embed=None, priority=PRIORITY_REPORT, coalesce=False, label=None, on_sent=None):
+        """
+        Queue a message. Must be called from the event loop.
+
+        :param coalesce: merge the embed with other coalesced embeds posted to the channel within the window
+        :param label: source shown on the embed's fields when it is merged, defaults to its title
+        :param on_sent: called without arguments once the message was sent, and awaited if it returns an
+                        awaitable. Not called for coalesced embeds
+        """
+        self._start()
+        self.stats['posted'] += 1
+
+        if coalesce and embed is not None:
+            pending = self._pending.get(channel.id)
+            if pending is None:
+                pending = self._pending[channel.id] = [time.monotonic() + self._coalesce_window, channel, priority, []]
+
+            pending[2] = min(pending[2], priority)
+            pending[3].append((label or embed.title or '', embed))
+        else:
+            heapq.heappush(self._queue, (priority, next(self._sequence), channel, content, embed, on_sent))
+
+        self._wakeup.set()
+
+    def _flush_pending(self, now):
+        """Merge the alerts of every channel whose window closed and queue the pages. Returns seconds to the next window close."""
+        next_due = None
+
+        for channel_id, (deadline, channel, priority, alerts) in list(self._pending.items()):
+            if deadline > now:
+                next_due = min(next_due or deadline - now, deadline - now)
+                continue
+
+            del self._pending[channel_id]
+            pages = paginate_alerts(alerts, alerts[0][1].timestamp)
+            self.stats['coalesced'] += len(alerts) - len(pages)
+
+            for embed in pages:
+                heapq.heappush(self._queue, (priority, next(self._sequence), channel, None, embed, None))
+
+        return next_due
+
+    def _next_message(self, now):
+        """Pop the highest priority message whose route has a token. Returns (message, seconds to wait if none)."""
+        skipped = []
+        message = None
+        wait = None
+
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            bucket = self._buckets.setdefault(entry[2].id, RouteBucket())
+
+            if bucket.take(now):
+                message = entry
+                break
+
+            skipped.append(entry)
+            ready_in = bucket.ready_in(now)
+            wait = ready_in if wait is None else min(wait, ready_in)
+
+        if skipped:
+            self.stats['throttled'] += 1
+        for entry in skipped:
+            heapq.heappush(self._queue, entry)
+
+        return message, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            next_due = self._flush_pending(now)
+            message, wait = self._next_message(now)
+
+            if message is None:
+                timeouts = [t for t in (next_due, wait) if t is not None]
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(timeouts) if timeouts else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, channel, content, embed, on_sent = message
+            try:
+                await channel.send(content=content, embed=embed)
+                self.stats['sent'] += 1
+            except Exception as e:
+                self.stats['failed'] += 1
+                print(f'OUTBOX: Error sending message to channel {channel.id}: {e}')
+                continue
+
+            if on_sent is not None:
+                try:
+                    result = on_sent()
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    print(f'OUTBOX: Error in on_sent callback: {e}')
+
+    def get_metrics(self):
+        """Send counts and the number of messages queued or being collected."""
+        return {
+            **self.stats,
+            'queued': len(self._queue),
+            'collecting': sum(len(pending[3]) for pending in self._pending.values()),
+        }
+
+outbox = Outbox()
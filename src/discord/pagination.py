@@ -0,0 +1,146 @@
+# Paginated embeds with button navigation for long lists (watchlist, holdings).
+# Only the visible page is rendered, so a command answers after fetching one page of prices
+# no matter how long the list is. The following pages are rendered in the background while
+# the first is read, so paging forward is usually instant.
+
+import asyncio
+
+import discord
+
+# list items shown per page, well under Discord's 25 field limit
+PAGE_SIZE = 15
+# pages rendered ahead of the one being shown
+PREFETCH_PAGES = 1
+# seconds of inactivity before the buttons are disabled
+VIEW_TIMEOUT = 300
+
+class LazyPaginator(discord.ui.View):
+    """
+    Embed pages over a list of items, each page rendered on demand by
+    `await render_page(page_items, page_number, page_count)` returning a discord.Embed.
+    """
+
+    def __init__(self, author_id, items, render_page, page_size=PAGE_SIZE, prefetch=PREFETCH_PAGES, describe=None, timeout=VIEW_TIMEOUT):
+        """
+        :param author_id: only this user can turn the pages
+        :param describe: optional function returning the description shown on every page, called on each redraw
+        """
+        super().__init__(timeout=timeout)
+        self._author_id = author_id
+        self._items = list(items)
+        self._render_page = render_page
+        self._page_size = page_size
+        self._prefetch = prefetch
+        self._describe = describe
+        # page number -> task rendering it
+        self._pages = {}
+        self._background = set()
+        self._sent = asyncio.Event()
+
+        self.page = 0
+        self.message = None
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self._items) // self._page_size))
+
+    def _load(self, page):
+        task = self._pages.get(page)
+        if task is None:
+            page_items = self._items[page * self._page_size:(page + 1) * self._page_size]
+            task = self._pages[page] = asyncio.create_task(self._render_page(page_items, page, self.page_count))
+
+        return task
+
+    def _prefetch_after(self, page):
+        for ahead in range(page + 1, min(page + 1 + self._prefetch, self.page_count)):
+            self._load(ahead)
+
+    async def _embed(self, page):
+        try:
+            embed = await self._load(page)
+        except Exception:
+            # render the page again next time instead of keeping the failure
+            self._pages.pop(page, None)
+            raise
+
+        if self._describe:
+            embed.description = self._describe()
+        if self.page_count > 1:
+            embed.set_footer(text=f'Page {page + 1}/{self.page_count}')
+
+        return embed
+
+    def _update_buttons(self):
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.page_count - 1
+
+    async def send(self, ctx):
+        """Render the first page, send it with the navigation buttons and start prefetching."""
+        try:
+            embed = await self._embed(0)
+            self._prefetch_after(0)
+            self._update_buttons()
+
+            self.message = await ctx.send(embed=embed, view=self if self.page_count > 1 else None)
+        finally:
+            self._sent.set()
+
+    def run_in_background(self, coro):
+        """Run a coroutine tied to the paginator, e.g. one that computes the description and redraws. It is cancelled on timeout."""
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def redraw(self):
+        """Edit the sent message with the current page again, e.g. after the description changed."""
+        await self._sent.wait()
+        if self.message is None:
+            return
+
+        embed = await self._embed(self.page)
+        await self.message.edit(embed=embed, view=self if self.page_count > 1 else None)
+
+    async def _show(self, interaction, page):
+        self.page = max(0, min(page, self.page_count - 1))
+        self._update_buttons()
+
+        task = self._load(self.page)
+        if task.done():
+            await interaction.response.edit_message(embed=await self._embed(self.page), view=self)
+        else:
+            # the page is still being fetched, acknowledge the click within Discord's 3 seconds first
+            await interaction.response.defer()
+            await interaction.edit_original_response(embed=await self._embed(self.page), view=self)
+
+        self._prefetch_after(self.page)
+
+    async def interaction_check(self, interaction):
+        if interaction.user.id != self._author_id:
+            await interaction.response.send_message('Only the user who ran the command can turn its pages.', ephemeral=True)
+            return False
+
+        return True
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        await self._show(interaction, self.page - 1)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction, button):
+        await self._show(interaction, self.page + 1)
+
+    async def on_timeout(self):
+        for task in [*self._pages.values(), *self._background]:
+            task.cancel()
+
+        if self.message is None:
+            return
+
+        self.previous_page.disabled = True
+        self.next_page.disabled = True
+        try:
+            await self.message.edit(view=self)
+        except discord.HTTPException:
+            pass
@@ -9,6 +9,9 @@ import asyncio
 
 from src.config.utils import is_weekend, stock_changes
 from src.stock_data import check_price_changes
+from src.news import news_service
+from src.discord.outbox import outbox, PRIORITY_ALERT
+from src.portfolios.database.news import get_held_symbols, refresh_news_index
 
 def setup_watchlist_tasks(bot):
 
@@ -55,10 +58,38 @@ def setup_watchlist_tasks(bot):
                     value=f"${stock['current_price']:.2f}\n{sign}{stock['percentage_change']:.2f}%", 
                     inline=True
                     )
-            await channel.send(embed=embed)
+            outbox.post(channel, embed=embed, priority=PRIORITY_ALERT, coalesce=True, label='Watchlist')
         else:
             print("WATCHLIST: Big price changes not found.")
 
     return {
         'watchlist_changes': watchlist_changes,
-    }
\ No newline at end of file
+    }
+
+def setup_news_tasks(pool):
+    """
+    Setup the task that keeps the local news index fresh.
+
+    :param pool: connection pool for the portfolio database, which holds the news index
+    """
+
+    @tasks.loop(minutes=30)
+    async def news_refresh():
+        """
+        Periodic task that fetches news for every watched and held symbol into the local
+        index searched by !news, and prunes expired articles.
+        """
+        try:
+            held = await asyncio.to_thread(pool.run_read, get_held_symbols)
+            symbols = sorted(set(STOCK_SYMBOLS) | set(held))
+
+            news = await asyncio.to_thread(news_service.fetch_symbols, symbols, batched=True) if symbols else {}
+            written, pruned = await asyncio.to_thread(pool.run_write, refresh_news_index, news)
+
+            print(f'[{datetime.now()}] NEWS: Indexed {written} articles for {len(symbols)} symbols, pruned {pruned}.')
+        except Exception as e:
+            print(f'NEWS: Error refreshing news index: {e}')
+
+    return {
+        'news_refresh': news_refresh,
+    }
@@ -1,7 +1,52 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 from gnews import GNews
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
+from src.config.storage import load_seen_news, save_seen_news
+from src.stock_data import get_company_names
+
+# seconds a search result is reused before Google News is searched again
+NEWS_CACHE_TTL = 15 * 60
+# searches run at once when fetching news for many symbols
+NEWS_WORKERS = 8
+# posted article URLs remembered so they are never posted twice, oldest are forgotten first
+SEEN_NEWS_LIMIT = 5000
+# headline word sets of recently posted articles, so a later copy of a posted story under a new URL is recognized
+POSTED_STORIES_LIMIT = 2000
+
+# longest search query sent to Google News, batched queries add symbols until the next would exceed it
+MAX_QUERY_LENGTH = 100
+# most results GNews returns for one search
+MAX_RESULTS = 100
+# words dropped from company names before matching them in article text
+COMPANY_SUFFIXES = {'inc', 'corp', 'corporation', 'company', 'co', 'ltd', 'plc', 'holdings', 'group', 'the', 'class'}
+# leading words too common to stand for a company on their own, e.g. 'General' of 'General Motors'
+GENERIC_NAME_WORDS = {
+    'american', 'bank', 'first', 'general', 'global', 'international', 'national', 'new', 'united',
+    'southern', 'northern', 'western', 'eastern', 'public', 'federal', 'capital', 'life', 'energy',
+}
+
+# MinHash signature length, split into LSH bands of equal rows. With 8 bands of 4 rows, articles
+# whose word sets are more than ~60% similar share at least one band with high probability
+MINHASH_PERMUTATIONS = 32
+LSH_BANDS = 8
+# word set Jaccard similarity at or above which two articles are treated as the same story
+DUPLICATE_SIMILARITY = 0.6
+
+_MERSENNE_PRIME = (1 << 31) - 1
+# random permutations (a * x + b) mod p of 32-bit word hashes, a * x + b stays below 2^64
+_rng = np.random.default_rng(20240101)
+_PERMUTATION_A = _rng.integers(1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_PERMUTATION_B = _rng.integers(0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
 def format_news_time(published_at: str) -> str:
     """
     Formats a news article's published time into a human-readable relative time string.
@@ -32,15 +77,154 @@ def get_news_update(symbol: str, query=None, period='1d', num_articles=5):
     Args:
         symbol (str): The stock symbol to fetch news for.
         num_articles (int): The number of news articles to retrieve.
+
+    Searches go through the shared news service, so repeated lookups within
+    NEWS_CACHE_TTL are answered from its cache.
     """
-    g_news = GNews(
-        language='en',
-        period=period,
-        max_results=num_articles
-    )
-    news = g_news.get_news(query + symbol + ' stock')
+    return news_service.search((query or '') + symbol + ' stock', period, num_articles)
+
+class NewsService:
+    """
+    Google News searches shared by the bot's news features.
+
+    Searches run on a bounded thread pool with one reused GNews client per (period, max results),
+    and their results are cached per (query, period) for NEWS_CACHE_TTL seconds.
+    URLs of posted articles are kept in a bounded, persistent seen-set so they are not posted again,
+    and their headline word sets in a bounded in-memory list for near-duplicate detection across runs.
+    """
+
+    def __init__(self, max_workers=NEWS_WORKERS, ttl=NEWS_CACHE_TTL, seen_limit=SEEN_NEWS_LIMIT, stories_limit=POSTED_STORIES_LIMIT):
+        self._max_workers = max_workers
+        self._ttl = ttl
+        self._seen_limit = seen_limit
+        self._executor = None
+        self._clients = {}
+        # (query, period, num_articles) -> (fetched_at, articles)
+        self._cache = {}
+        # posted URLs in posting order, loaded from disk on first use
+        self._seen = None
+        self._posted_stories = deque(maxlen=stories_limit)
+        self._lock = threading.Lock()
+
+    def _client(self, period, num_articles):
+        with self._lock:
+            client = self._clients.get((period, num_articles))
+            if client is None:
+                client = GNews(language='en', period=period, max_results=num_articles)
+                self._clients[(period, num_articles)] = client
+
+        return client
+
+    def search(self, query, period='1d', num_articles=5):
+        """Search Google News, answering from the cache while the last result for the query is fresh."""
+        key = (query, period, num_articles)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._cache.get(key)
+        if cached and now - cached[0] < self._ttl:
+            return cached[1]
+
+        articles = self._client(period, num_articles).get_news(query) or []
+
+        with self._lock:
+            # forget expired searches so the cache stays bounded by the queries of the last TTL
+            for stale in [k for k, (fetched_at, _) in self._cache.items() if now - fetched_at >= self._ttl]:
+                del self._cache[stale]
+            self._cache[key] = (now, articles)
+
+        return articles
+
+    def fetch_symbols(self, symbols, query='', period='1d', num_articles=5, batched=False):
+        """
+        Search the news of several symbols concurrently.
+
+        :param batched: combine symbols into OR-queries under MAX_QUERY_LENGTH and attribute the
+                        results back to symbols by ticker and company name, which needs several
+                        times fewer searches than one search per symbol. Symbols a batch attributes
+                        nothing to are searched on their own
+        :return: dict of symbol to its list of articles, symbols whose search failed are left out
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='news')
+
+        if not batched:
+            futures = {
+                (symbol,): self._executor.submit(get_news_update, symbol, query, period, num_articles)
+                for symbol in symbols
+            }
+        else:
+            futures = {
+                tuple(batch): self._executor.submit(
+                    self.search, batch_query(batch, query or ''), period, min(num_articles * len(batch), MAX_RESULTS)
+                )
+                for batch in batch_symbols(symbols, query or '')
+            }
+            names = get_company_names(symbols)
+
+        news = {}
+        unattributed = []
+        for batch, future in futures.items():
+            try:
+                articles = future.result()
+            except Exception as e:
+                print(f"Error fetching news for {', '.join(batch)}: {e}")
+                continue
 
-    return news
+            if len(batch) == 1:
+                news[batch[0]] = articles
+                continue
+
+            for symbol, symbol_articles in attribute_articles(articles, batch, names).items():
+                if symbol_articles:
+                    news[symbol] = symbol_articles[:num_articles]
+                else:
+                    unattributed.append(symbol)
+
+        if unattributed:
+            news.update(self.fetch_symbols(unattributed, query, period, num_articles))
+
+        return news
+
+    def _load_seen(self):
+        if self._seen is None:
+            self._seen = OrderedDict.fromkeys(load_seen_news())
+
+        return self._seen
+
+    def unseen(self, articles):
+        """Filter out articles that were already posted."""
+        with self._lock:
+            seen = self._load_seen()
+            return [article for article in articles if article.get('url') not in seen]
+
+    def mark_seen(self, articles):
+        """Remember articles as posted and persist the seen-set."""
+        with self._lock:
+            seen = self._load_seen()
+
+            for article in articles:
+                url = article.get('url')
+                if url:
+                    seen[url] = None
+                    seen.move_to_end(url)
+
+                words = article_words(article)
+                if words:
+                    self._posted_stories.append(words)
+
+            while len(seen) > self._seen_limit:
+                seen.popitem(last=False)
+
+            save_seen_news(list(seen))
+
+    def posted_stories(self):
+        """Headline word sets of the most recently posted articles, oldest first."""
+        with self._lock:
+            return list(self._posted_stories)
+
+news_service = NewsService()
 
 def single_format(news) -> str:
     """
@@ -60,6 +244,194 @@ def single_format(news) -> str:
 
         return "\n\n".join(formatted_news)
 
+def batch_symbols(symbols, query='', max_length=MAX_QUERY_LENGTH) -> list:
+    """
+    Splits symbols into groups whose combined OR-query stays within the query length limit.
+
+    :param symbols: A list of stock symbols.
+    :param query: Text prepended to every query.
+    :return: A list of symbol lists, in the order of the symbols.
+    """
+    batches = []
+    batch = []
+
+    for symbol in symbols:
+        if batch and len(batch_query(batch + [symbol], query)) > max_length:
+            batches.append(batch)
+            batch = []
+        batch.append(symbol)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+def batch_query(symbols, query='') -> str:
+    """
+    Returns the Google News query of a batch of symbols, e.g. 'AAPL stock' or '(AAPL OR MSFT) stock'.
+    """
+    if len(symbols) == 1:
+        return f'{query}{symbols[0]} stock'
+
+    return f"{query}({' OR '.join(symbols)}) stock"
+
+def company_pattern(name):
+    """
+    Returns a case-insensitive regex that matches a company name in text, or None if nothing
+    distinctive is left once suffixes like 'Inc.' and share classes are dropped.
+    Headlines usually shorten names, so a distinctive first word also matches on its own,
+    e.g. 'Ford' for 'Ford Motor Company'.
+    """
+    name = re.sub(r'\(.*?\)', ' ', name)
+    words = [word for word in re.findall(r"[\w&'-]+", name) if word.lower().strip('.') not in COMPANY_SUFFIXES]
+    core = ' '.join(words)
+
+    if len(core) < 3:
+        return None
+
+    names = [core]
+    if len(words) > 1 and len(words[0]) >= 4 and words[0].lower() not in GENERIC_NAME_WORDS:
+        names.append(words[0])
+
+    return re.compile(rf"(?<!\w)(?:{'|'.join(re.escape(name) for name in names)})(?!\w)", re.IGNORECASE)
+
+def attribute_articles(articles, symbols, names) -> dict:
+    """
+    Attributes the articles of a batched query back to the symbols they are about.
+
+    An article belongs to every symbol whose ticker appears in its title or description as an
+    uppercase word, or whose company name (or its distinctive first word) appears in any case.
+    Single-letter tickers are too ambiguous to match and are only attributed by company name.
+
+    :param articles: A list of news article dictionaries.
+    :param symbols: The symbols of the batch.
+    :param names: A dict of symbol to company name.
+    :return: A dict of symbol to its list of articles, in the order they were returned.
+    """
+    patterns = {}
+    for symbol in symbols:
+        pattern = company_pattern(names[symbol]) if symbol in names else None
+        ticker = re.compile(rf'(?<![\w.]){re.escape(symbol)}(?!\w)') if len(symbol) > 1 else None
+        patterns[symbol] = (ticker, pattern)
+
+    attributed = {symbol: [] for symbol in symbols}
+
+    for article in articles:
+        text = f"{article.get('title', '')} {article.get('description', '')}"
+
+        for symbol, (ticker, pattern) in patterns.items():
+            if (ticker and ticker.search(text)) or (pattern and pattern.search(text)):
+                attributed[symbol].append(article)
+
+    return attributed
+
+def article_words(article) -> frozenset:
+    """
+    Returns the set of lowercase words of an article's headline, which is what near-duplicate
+    detection compares. The ' - Publisher' suffix Google News appends to titles is dropped.
+    """
+    title = article.get('title') or ''
+    publisher = article.get('publisher')
+    if isinstance(publisher, dict):
+        publisher = publisher.get('title')
+
+    if publisher and title.endswith(f' - {publisher}'):
+        title = title[:-len(publisher) - 3]
+
+    return frozenset(re.findall(r'\w+', title.lower()))
+
+def minhash(words) -> np.ndarray:
+    """
+    Returns the MinHash signature of a word set.
+
+    :param words: A non-empty set of words.
+    :return: An array of MINHASH_PERMUTATIONS minimum hash values.
+    """
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), 'little') for word in words),
+        dtype=np.uint64, count=len(words)
+    )
+
+    return ((np.outer(hashes, _PERMUTATION_A) + _PERMUTATION_B) % np.uint64(_MERSENNE_PRIME)).min(axis=0)
+
+class NearDuplicateIndex:
+    """
+    Banded LSH index of article word sets that groups near-duplicate articles into clusters.
+
+    Each article is only compared with the articles sharing one of its signature bands,
+    so adding an article costs about the size of its buckets instead of the whole index.
+    """
+
+    def __init__(self, bands=LSH_BANDS, similarity=DUPLICATE_SIMILARITY):
+        self._bands = bands
+        self._similarity = similarity
+        # (band, band values) -> keys of the articles in the bucket
+        self._buckets = {}
+        self._words = {}
+        # union-find parent of each key, a cluster is identified by its root key
+        self._parents = {}
+        # insertion position of each key, the oldest key of a cluster is kept as its root
+        self._order = {}
+
+    def _root(self, key):
+        while self._parents[key] != key:
+            self._parents[key] = self._parents[self._parents[key]]
+            key = self._parents[key]
+
+        return key
+
+    def add(self, key, words):
+        """
+        Adds an article's word set to the index.
+
+        :param key: Any hashable key identifying the article.
+        :param words: The article's word set, see article_words.
+        :return: The key of the first article of the cluster it joined, or its own key.
+        """
+        self._parents[key] = key
+        self._words[key] = words
+        self._order[key] = len(self._order)
+        if not words:
+            return key
+
+        signature = minhash(words)
+        candidates = set()
+
+        for band, rows in enumerate(np.array_split(signature, self._bands)):
+            bucket = self._buckets.setdefault((band, rows.tobytes()), [])
+            candidates.update(bucket)
+            bucket.append(key)
+
+        for candidate in candidates:
+            other = self._words[candidate]
+            if len(words & other) / len(words | other) >= self._similarity:
+                root, new_root = sorted((self._root(candidate), self._root(key)), key=self._order.get)
+                self._parents[new_root] = root
+
+        return self._root(key)
+
+    def cluster(self, key):
+        """Returns the cluster key of an article in the index."""
+        return self._root(key)
+
+def cluster_articles(articles) -> list:
+    """
+    Groups near-duplicate articles, e.g. one story syndicated by several publishers, in one pass.
+
+    :param articles: A list of news article dictionaries.
+    :return: A list of clusters (lists of articles), ordered by their first article.
+    """
+    index = NearDuplicateIndex()
+    for i, article in enumerate(articles):
+        index.add(i, article_words(article))
+
+    # cluster roots are their first article, so clusters come out in article order
+    clusters = {}
+    for i, article in enumerate(articles):
+        clusters.setdefault(index.cluster(i), []).append(article)
+
+    return list(clusters.values())
+
 def embed_format(news) -> dict:
     """
     Returns a formatted embed dict for Discord.
@@ -0,0 +1,158 @@
+# Vectorized portfolio risk analytics.
+# Holding price histories are aligned into one (days x symbols) NumPy matrix so every metric
+# is a handful of array operations instead of per-symbol loops.
+
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from src.config.config import TIMEZONE
+from src.portfolios.database.procedures import get_portfolio_id, get_holdings
+
+TRADING_DAYS = 252
+BENCHMARK_SYMBOL = 'SPY'
+
+# (portfolio_id, holdings) -> (expires_at, metrics)
+_risk_cache = {}
+
+def next_bar_close(now=None):
+    """Return the next daily bar close (4:00 PM Eastern on a weekday) after `now`."""
+    now = now or dt.datetime.now(TIMEZONE)
+    close = now.replace(hour=16, minute=0, second=0, microsecond=0)
+
+    if now >= close:
+        close += dt.timedelta(days=1)
+    while close.weekday() >= 5:
+        close += dt.timedelta(days=1)
+
+    return close
+
+def load_price_matrix(symbols, period='1y', interval='1d'):
+    """
+    Download closing prices and align them on common dates.
+
+    :return: (dates, symbols, prices) where prices is a float array of shape (days, symbols).
+             Symbols without data are dropped.
+    """
+    data = yf.download(symbols, period=period, interval=interval, group_by='ticker', progress=False, auto_adjust=True)
+
+    closes = {}
+    for symbol in symbols:
+        if isinstance(data.columns, pd.MultiIndex):
+            if symbol not in data.columns.get_level_values(0):
+                continue
+            series = data[symbol]['Close']
+        else:
+            series = data['Close']
+
+        if series.notna().any():
+            closes[symbol] = series
+
+    frame = pd.DataFrame(closes).ffill().dropna()
+
+    return frame.index, list(frame.columns), frame.to_numpy(dtype=float)
+
+def max_drawdown(returns):
+    """Largest peak-to-trough fall of the equity curve built from a return series."""
+    equity = np.cumprod(1 + returns)
+    peaks = np.maximum.accumulate(np.concatenate(([1.0], equity)))[1:]
+
+    return float((equity / peaks - 1).min()) if equity.size else 0.0
+
+def compute_risk_metrics(prices, weights, benchmark_prices, risk_free_rate=0.0):
+    """
+    Compute portfolio risk metrics from aligned price histories.
+
+    :param prices: array (days, holdings) of closes
+    :param weights: array (holdings,) of value weights summing to 1
+    :param benchmark_prices: array (days,) of benchmark closes on the same dates
+    :param risk_free_rate: annual risk-free rate
+    :return: dict of metrics
+    """
+    returns = prices[1:] / prices[:-1] - 1
+    portfolio_returns = returns @ weights
+    benchmark_returns = benchmark_prices[1:] / benchmark_prices[:-1] - 1
+
+    excess = portfolio_returns - risk_free_rate / TRADING_DAYS
+    daily_vol = portfolio_returns.std(ddof=1)
+    downside_vol = np.sqrt(np.mean(np.minimum(excess, 0) ** 2))
+
+    # beta from one covariance matrix of portfolio and benchmark returns
+    cov = np.cov(portfolio_returns, benchmark_returns)
+    beta = cov[0, 1] / cov[1, 1] if cov[1, 1] else 0.0
+
+    annualize = np.sqrt(TRADING_DAYS)
+
+    return {
+        'days': int(returns.shape[0]),
+        'annual_return': float((1 + portfolio_returns).prod() ** (TRADING_DAYS / len(portfolio_returns)) - 1),
+        'annual_volatility': float(daily_vol * annualize),
+        'sharpe': float(excess.mean() / daily_vol * annualize) if daily_vol else 0.0,
+        'sortino': float(excess.mean() / downside_vol * annualize) if downside_vol else 0.0,
+        'max_drawdown': max_drawdown(portfolio_returns),
+        'beta': float(beta),
+        'holding_volatility': returns.std(axis=0, ddof=1) * annualize,
+    }
+
+def portfolio_risk(conn, name, period='1y', risk_free_rate=0.0):
+    """
+    Risk metrics of a portfolio's current holdings over their price history.
+
+    Results are cached per portfolio and holdings until the next daily bar closes.
+
+    :return: dict of metrics, or an error message string
+    """
+    portfolio_id = get_portfolio_id(conn, name)
+    if not portfolio_id:
+        return f"Portfolio '{name}' not found."
+
+    holdings = get_holdings(conn, portfolio_id)
+    if not holdings:
+        return f'No holdings for portfolio: {name}.'
+
+    now = dt.datetime.now(TIMEZONE)
+    cache_key = (portfolio_id, period, tuple(sorted((symbol, shares) for symbol, _, shares, _ in holdings)))
+
+    cached = _risk_cache.get(cache_key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    shares_by_symbol = {symbol: shares for symbol, _, shares, _ in holdings}
+    dates, symbols, prices = load_price_matrix(list(dict.fromkeys([*shares_by_symbol, BENCHMARK_SYMBOL])), period=period)
+
+    if BENCHMARK_SYMBOL not in symbols or len(dates) < 3:
+        return f'Not enough price history to compute risk for portfolio: {name}.'
+
+    benchmark_index = symbols.index(BENCHMARK_SYMBOL)
+    benchmark_prices = prices[:, benchmark_index]
+
+    # SPY may also be held, keep its holding column separate from the benchmark column
+    holding_columns = [i for i, symbol in enumerate(symbols) if symbol in shares_by_symbol and i != benchmark_index]
+    if BENCHMARK_SYMBOL in shares_by_symbol:
+        holding_columns.append(benchmark_index)
+
+    holding_symbols = [symbols[i] for i in holding_columns]
+    holding_prices = prices[:, holding_columns]
+
+    shares = np.array([shares_by_symbol[symbol] for symbol in holding_symbols], dtype=float)
+    values = holding_prices[-1] * shares
+    weights = values / values.sum()
+
+    metrics = compute_risk_metrics(holding_prices, weights, benchmark_prices, risk_free_rate)
+    metrics['name'] = name
+    metrics['start'] = dates[0].strftime('%Y-%m-%d')
+    metrics['end'] = dates[-1].strftime('%Y-%m-%d')
+    metrics['holdings'] = [
+        {'symbol': symbol, 'weight': float(weight), 'volatility': float(vol)}
+        for symbol, weight, vol in zip(holding_symbols, weights, metrics.pop('holding_volatility'))
+    ]
+
+    # drop expired entries, including ones for holdings that have since changed
+    for key in [key for key, (expires_at, _) in _risk_cache.items() if expires_at <= now]:
+        del _risk_cache[key]
+
+    _risk_cache[cache_key] = (next_bar_close(now), metrics)
+
+    return metrics
@@ -0,0 +1,178 @@
+# Backtesting engine that replays OHLCV bars against the portfolio model.
+# Trades are written with record_trade into an in-memory SQLite ledger that uses the same
+# schema as portfolios.db, so fills, holdings and balances follow the live buy/sell rules.
+#
+# Strategies are vectorized: they map the close series to a target weight per bar in one pass.
+# The replay jumps between trade bars with vectorized scans and only touches the ledger on trades.
+
+import time
+import sqlite3 as sq
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from src.portfolios.database.schema import create_database_schema
+from src.portfolios.database.procedures import create_portfolio, get_portfolio_id, get_portfolio_balance, get_holdings, record_trade
+from src.portfolios.analytics import max_drawdown
+
+BACKTEST_PORTFOLIO = 'backtest'
+
+def sma_crossover(closes, fast=20, slow=50):
+    """Fully invested while the fast SMA is above the slow SMA, flat otherwise."""
+    closes = pd.Series(closes)
+    fast_sma = closes.rolling(fast).mean()
+    slow_sma = closes.rolling(slow).mean()
+
+    return (fast_sma > slow_sma).to_numpy(dtype=float)
+
+def threshold_rebalance(closes, target=0.5):
+    """Hold a constant target weight. Pair with a rebalance band so trades only happen on drift."""
+    return np.full(len(closes), target, dtype=float)
+
+# name -> (signal function, rebalance band)
+STRATEGIES = {
+    'sma': (sma_crossover, 0.0),
+    'rebalance': (threshold_rebalance, 0.05),
+}
+
+def load_bars(symbol, period='2y', interval='1d'):
+    """Load OHLCV bars for a symbol, oldest first."""
+    hist = yf.Ticker(symbol).history(period=period, interval=interval, auto_adjust=True)
+
+    return hist[['Open', 'High', 'Low', 'Close', 'Volume']].dropna()
+
+def create_ledger(initial_cash):
+    """Create an in-memory portfolio ledger with the live schema. Returns (conn, portfolio_id)."""
+    conn = sq.connect(':memory:')
+    create_database_schema(conn, verbose=False)
+    create_portfolio(conn, BACKTEST_PORTFOLIO, initial_cash)
+
+    return conn, get_portfolio_id(conn, BACKTEST_PORTFOLIO)
+
+# bars scanned per vectorized search for the next trade
+SCAN_WINDOW = 1024
+
+def _next_trade_bar(start, closes, targets, signal_changed, band, cash, shares):
+    """
+    Find the first bar at or after `start` where the strategy needs a trade: its signal
+    changed, or the held weight drifted more than `band` from the target.
+    Returns len(closes) if no bar qualifies.
+    """
+    n = len(closes)
+
+    for window_start in range(start, n, SCAN_WINDOW):
+        window = slice(window_start, min(window_start + SCAN_WINDOW, n))
+        needs_trade = signal_changed[window]
+
+        if band:
+            values = cash + shares * closes[window]
+            weights = np.divide(shares * closes[window], values, out=np.zeros_like(values), where=values != 0)
+            needs_trade = needs_trade | (np.abs(weights - targets[window]) > band)
+
+        hits = np.flatnonzero(needs_trade)
+        if hits.size:
+            return window_start + int(hits[0])
+
+    return n
+
+def run_backtest(symbol, bars, strategy, initial_cash=10000.0, rebalance_band=None, strategy_args=None):
+    """
+    Replay bars through a strategy into an in-memory ledger.
+
+    :param bars: DataFrame of OHLCV bars indexed by time
+    :param strategy: name in STRATEGIES or a function closes -> target weight per bar
+    :param rebalance_band: only trade when the held weight drifts more than this from the target
+    :return: dict of results including the equity curve
+    """
+    if isinstance(strategy, str):
+        strategy, default_band = STRATEGIES[strategy]
+    else:
+        default_band = 0.0
+    band = default_band if rebalance_band is None else rebalance_band
+
+    closes = bars['Close'].to_numpy(dtype=float)
+    timestamps = bars.index.strftime('%Y-%m-%d %H:%M')
+    n = len(closes)
+
+    start = time.perf_counter()
+
+    targets = np.nan_to_num(strategy(closes, **(strategy_args or {})))
+    signal_changed = np.concatenate(([True], targets[1:] != targets[:-1]))
+
+    conn, portfolio_id = create_ledger(initial_cash)
+
+    cash = float(initial_cash)
+    shares = 0
+    trade_bars = []
+    cash_after = [cash]
+    shares_after = [shares]
+
+    i = _next_trade_bar(0, closes, targets, signal_changed, band, cash, shares)
+    while i < n:
+        price = closes[i]
+        delta = int(targets[i] * (cash + shares * price) // price) - shares
+
+        if delta:
+            operation = 'BUY' if delta > 0 else 'SELL'
+            total_price = abs(delta) * price
+
+            cash = record_trade(conn, portfolio_id, symbol, 'Backtest', operation, abs(delta), price, total_price, timestamps[i])
+            shares += delta
+
+            trade_bars.append(i)
+            cash_after.append(cash)
+            shares_after.append(shares)
+
+        i = _next_trade_bar(i + 1, closes, targets, signal_changed, band, cash, shares)
+
+    conn.commit()
+
+    # positions only change on trade bars, so the equity curve is one vectorized pass
+    position = np.searchsorted(np.array(trade_bars, dtype=int), np.arange(n), side='right')
+    equity = np.array(cash_after)[position] + np.array(shares_after)[position] * closes
+    trades = len(trade_bars)
+
+    seconds = time.perf_counter() - start
+
+    ledger_balance = get_portfolio_balance(conn, portfolio_id)
+    ledger_holdings = get_holdings(conn, portfolio_id)
+    conn.close()
+
+    returns = np.diff(equity) / equity[:-1] if len(equity) > 1 else np.array([])
+
+    return {
+        'symbol': symbol,
+        'strategy': getattr(strategy, '__name__', str(strategy)),
+        'bars': len(closes),
+        'trades': trades,
+        'initial_cash': initial_cash,
+        'final_value': float(equity[-1]) if len(equity) else initial_cash,
+        'total_return': float(equity[-1] / initial_cash - 1) if len(equity) else 0.0,
+        'buy_and_hold_return': float(closes[-1] / closes[0] - 1) if len(closes) else 0.0,
+        'max_drawdown': max_drawdown(returns),
+        'ledger_balance': ledger_balance,
+        'ledger_holdings': ledger_holdings,
+        'seconds': seconds,
+        'bars_per_second': len(closes) / seconds if seconds else 0.0,
+        'dates': bars.index,
+        'equity': equity,
+        'benchmark': initial_cash * closes / closes[0] if len(closes) else equity,
+    }
+
+def backtest(symbol, strategy='sma', period='2y', interval='1d', initial_cash=10000.0):
+    """
+    Load bars for a symbol and backtest a named strategy.
+
+    :return: dict of results, or an error message string
+    """
+    symbol = symbol.upper()
+
+    if strategy not in STRATEGIES:
+        return f"Unknown strategy {strategy}. Valid strategies are: {', '.join(STRATEGIES)}"
+
+    bars = load_bars(symbol, period, interval)
+    if len(bars) < 2:
+        return f'Not enough bar history for {symbol} over {period}.'
+
+    return run_backtest(symbol, bars, strategy, initial_cash)
@@ -0,0 +1,205 @@
+# Incrementally maintained covariance/correlation of holding returns.
+# Each tracker keeps running sums of the daily log-return vector and of its outer product,
+# so a new bar updates the matrix in O(n^2) without re-reading price history.
+
+import threading
+import datetime as dt
+from collections import OrderedDict
+
+import numpy as np
+
+from src.config.config import TIMEZONE
+from src.portfolios.analytics import load_price_matrix, next_bar_close
+from src.portfolios.database.procedures import get_portfolio_id, get_holdings
+
+# symbol sets whose trackers are kept. Every holdings change makes a new symbol set,
+# so the least recently used trackers are dropped beyond this
+MAX_TRACKERS = 64
+
+class CorrelationTracker:
+    """Running covariance of daily log returns for a fixed, ordered set of symbols."""
+
+    def __init__(self, symbols):
+        self.symbols = list(symbols)
+        n = len(self.symbols)
+
+        self.count = 0
+        self.sums = np.zeros(n)
+        self.cross = np.zeros((n, n))
+        self.last_prices = None
+        self.last_date = None
+        # no new bar can close before this time, so updates are skipped until then
+        self.next_update = None
+
+    def add_returns(self, returns):
+        """Fold a (days, symbols) block of returns into the running sums."""
+        returns = np.atleast_2d(returns)
+
+        self.count += returns.shape[0]
+        self.sums += returns.sum(axis=0)
+        self.cross += returns.T @ returns
+
+    def add_bar(self, date, prices):
+        """Fold one new daily bar of closes into the running sums."""
+        prices = np.asarray(prices, dtype=float)
+
+        if self.last_prices is not None:
+            returns = np.log(prices / self.last_prices)
+
+            self.count += 1
+            self.sums += returns
+            self.cross += np.outer(returns, returns)
+
+        self.last_prices = prices
+        self.last_date = date
+
+    def seed(self, dates, prices):
+        """
+        Initialize from an aligned (days, symbols) price history.
+        The newest bar may still be open, so it is left out until a later bar arrives.
+        """
+        closed = prices[:-1]
+
+        self.add_returns(np.diff(np.log(closed), axis=0))
+        self.last_prices = closed[-1]
+        self.last_date = dates[-2]
+
+    def mean(self):
+        return self.sums / self.count if self.count else np.zeros(len(self.symbols))
+
+    def covariance(self):
+        """Sample covariance matrix of daily log returns."""
+        if self.count < 2:
+            return np.zeros((len(self.symbols), len(self.symbols)))
+
+        return (self.cross - np.outer(self.sums, self.sums) / self.count) / (self.count - 1)
+
+    def correlation(self):
+        """Correlation matrix of daily log returns."""
+        cov = self.covariance()
+        std = np.sqrt(np.diag(cov))
+        scale = np.outer(std, std)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(scale > 0, cov / scale, 0.0)
+        np.fill_diagonal(corr, 1.0)
+
+        return corr
+
+class CorrelationService:
+    """
+    Shares one tracker per symbol set between commands.
+
+    The first request for a symbol set seeds its tracker from a year of history. Later requests
+    only fetch the last few bars and fold in the ones newer than the tracker's last bar.
+    Price fetches only hold their symbol set's lock, so a slow fetch does not block other symbol sets,
+    and the least recently used trackers are dropped once holdings changes have left too many behind.
+    """
+
+    def __init__(self, history_period='1y', update_period='5d', max_trackers=MAX_TRACKERS):
+        self._history_period = history_period
+        self._update_period = update_period
+        self._max_trackers = max_trackers
+        # symbol set -> [lock, tracker or None until seeded], least recently used first
+        self._trackers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._trackers.get(key)
+            if entry is None:
+                entry = self._trackers[key] = [threading.Lock(), None]
+            self._trackers.move_to_end(key)
+
+            while len(self._trackers) > self._max_trackers:
+                self._trackers.popitem(last=False)
+
+            return entry
+
+    def get_tracker(self, symbols):
+        """Get an up to date tracker for the symbols, or None if there is not enough price history."""
+        key = tuple(sorted(set(symbols)))
+        entry = self._entry(key)
+
+        with entry[0]:
+            tracker = entry[1]
+
+            # a tracker idle for longer than the update period cannot be brought up to date bar by bar
+            if tracker is not None and not self._update(tracker):
+                tracker = None
+
+            if tracker is None:
+                tracker = self._seed(list(key))
+                if tracker is None:
+                    return None
+
+                entry[1] = tracker
+
+            return tracker
+
+    def _seed(self, symbols):
+        """Build a tracker from the full history, or None if there is not enough of it."""
+        dates, columns, prices = load_price_matrix(symbols, period=self._history_period)
+        if len(dates) < 3:
+            return None
+
+        tracker = CorrelationTracker(columns)
+        tracker.seed(dates, prices)
+        tracker.next_update = next_bar_close()
+
+        return tracker
+
+    def _update(self, tracker):
+        """
+        Fold in bars newer than the tracker's last bar.
+
+        :return: False if the tracker's last bar is older than the fetched bars, so the first new
+                 return would span several days and the tracker has to be seeded again
+        """
+        now = dt.datetime.now(TIMEZONE)
+        if tracker.next_update and now < tracker.next_update:
+            return True
+
+        tracker.next_update = next_bar_close(now)
+
+        dates, columns, prices = load_price_matrix(tracker.symbols, period=self._update_period)
+        if columns != tracker.symbols:
+            return True
+
+        if tracker.last_date not in dates:
+            return False
+
+        new_bars = [(date, row) for date, row in zip(dates, prices) if date > tracker.last_date]
+
+        # the newest bar may still be open
+        for date, row in new_bars[:-1]:
+            tracker.add_bar(date, row)
+
+        return True
+
+    def forget(self, symbols):
+        """Drop the tracker of a symbol set, e.g. after the holdings changed."""
+        with self._lock:
+            self._trackers.pop(tuple(sorted(set(symbols))), None)
+
+correlation_service = CorrelationService()
+
+def portfolio_correlation(conn, name):
+    """
+    Correlation matrix of a portfolio's current holdings.
+
+    :return: (symbols, correlation matrix), or an error message string
+    """
+    portfolio_id = get_portfolio_id(conn, name)
+    if not portfolio_id:
+        return f"Portfolio '{name}' not found."
+
+    holdings = get_holdings(conn, portfolio_id)
+    if len(holdings) < 2:
+        return f'Portfolio {name} needs at least two holdings for a correlation matrix.'
+
+    tracker = correlation_service.get_tracker([row[0] for row in holdings])
+    if tracker is None:
+        return f'Not enough price history to correlate holdings of portfolio: {name}.'
+
+    return tracker.symbols, tracker.correlation()
@@ -1,17 +1,148 @@
 import os
+import time
+import threading
 import sqlite3 as sq
+from contextlib import contextmanager
 
 DB_DIR = 'src/portfolios/database'
 PORTFOLIO_DB_DIR = os.path.join(DB_DIR, 'portfolios.db')
 
 os.makedirs(DB_DIR, exist_ok=True)
 
+# page cache size in KiB (negative values are KiB for PRAGMA cache_size)
+CACHE_SIZE_KIB = 16384
+
+def configure_connection(conn):
+    """Apply journal and cache tuning to a database connection."""
+    cur = conn.cursor()
+    # WAL lets readers proceed while a trade is being written; NORMAL only fsyncs at checkpoints in WAL mode
+    cur.execute('PRAGMA journal_mode = WAL')
+    cur.execute('PRAGMA synchronous = NORMAL')
+    cur.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+    cur.execute('PRAGMA temp_store = MEMORY')
+    cur.close()
+
+    return conn
+
 def get_portfolio_connection():
     """Get connetion to database."""
     conn = sq.connect(PORTFOLIO_DB_DIR)
+    configure_connection(conn)
     
     return conn
 
+class ConnectionPool:
+    """
+    SQLite access split into per-thread read-only connections and one serialized writer.
+
+    Readers never block each other or the writer (WAL), so read queries can run on any
+    worker thread. All writes go through the single writer connection behind a lock.
+    """
+
+    def __init__(self, path=PORTFOLIO_DB_DIR):
+        self._path = path
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+
+        self.metrics = {
+            'readers_open': 0,
+            'read_checkouts': 0,
+            'write_checkouts': 0,
+            'write_wait_total': 0.0,
+            'write_wait_max': 0.0,
+            'write_hold_total': 0.0,
+        }
+
+    def _open_reader(self):
+        conn = sq.connect(f'file:{self._path}?mode=ro', uri=True, check_same_thread=False)
+        cur = conn.cursor()
+        cur.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+        cur.execute('PRAGMA query_only = ON')
+        cur.close()
+
+        with self._readers_lock:
+            self._readers.append(conn)
+            self.metrics['readers_open'] = len(self._readers)
+
+        return conn
+
+    @contextmanager
+    def read(self):
+        """Check out the read-only connection of the calling thread."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._open_reader()
+            self._local.conn = conn
+
+        self.metrics['read_checkouts'] += 1
+        yield conn
+
+    @contextmanager
+    def write(self):
+        """Check out the writer connection, waiting for any other writer to finish."""
+        requested = time.perf_counter()
+
+        with self._writer_lock:
+            acquired = time.perf_counter()
+            wait = acquired - requested
+
+            self.metrics['write_checkouts'] += 1
+            self.metrics['write_wait_total'] += wait
+            self.metrics['write_wait_max'] = max(self.metrics['write_wait_max'], wait)
+
+            if self._writer is None:
+                self._writer = configure_connection(sq.connect(self._path, check_same_thread=False))
+
+            try:
+                yield self._writer
+            finally:
+                self.metrics['write_hold_total'] += time.perf_counter() - acquired
+
+    def run_read(self, func, *args, **kwargs):
+        """Call func(conn, *args, **kwargs) with the calling thread's read connection."""
+        with self.read() as conn:
+            return func(conn, *args, **kwargs)
+
+    def run_write(self, func, *args, **kwargs):
+        """Call func(conn, *args, **kwargs) with the writer connection and commit the result."""
+        with self.write() as conn:
+            try:
+                result = func(conn, *args, **kwargs)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+
+    def get_metrics(self):
+        """Checkout counts and average/max writer wait time in milliseconds."""
+        checkouts = self.metrics['write_checkouts']
+
+        return {
+            'readers_open': self.metrics['readers_open'],
+            'read_checkouts': self.metrics['read_checkouts'],
+            'write_checkouts': checkouts,
+            'write_wait_avg_ms': self.metrics['write_wait_total'] / checkouts * 1000 if checkouts else 0.0,
+            'write_wait_max_ms': self.metrics['write_wait_max'] * 1000,
+            'write_hold_avg_ms': self.metrics['write_hold_total'] / checkouts * 1000 if checkouts else 0.0,
+        }
+
+    def close(self):
+        """Close every reader connection and the writer connection."""
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+            self.metrics['readers_open'] = 0
+
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
 def initialize_database():
     """Initialize the database with schema and return a connection."""
     from src.portfolios.database.schema import create_database_schema
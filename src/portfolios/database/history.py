@@ -0,0 +1,263 @@
+# Point-in-time portfolio state.
+# Every STATE_SNAPSHOT_INTERVAL transactions the holdings and balance of a portfolio are copied into
+# state_snapshots, keyed by the (timestamp, transaction_id) position of the last transaction applied.
+# A past state is the nearest snapshot at or before the date plus a replay of the few transactions after it.
+#
+# Snapshots do not store lots: under FIFO the open lots of a symbol are always its newest buys,
+# so they are read back from the transaction log only for symbols the replay sells.
+
+from collections import deque
+
+# transactions between state snapshots, bounds the replay of any point-in-time query
+STATE_SNAPSHOT_INTERVAL = 250
+
+def _apply_transaction(positions, balance, timestamp, transaction_id, symbol, sector, operation, shares, price_per_share, total_price):
+    """
+    Apply one transaction to a {symbol: [sector, shares, cost_basis, realized_pnl, lots]} dict, where lots
+    is a FIFO deque of open [timestamp, transaction_id, shares, price_per_share] lots, or None if they are
+    not needed (positions loaded from a snapshot that are never sold).
+    Sells consume the oldest lots first. Returns the new balance.
+    """
+    position = positions.get(symbol)
+    if position is None:
+        position = positions[symbol] = [sector, 0, 0.0, 0.0, deque()]
+
+    if operation == 'BUY':
+        position[1] += shares
+        position[2] += shares * price_per_share
+        if position[4] is not None:
+            position[4].append([timestamp, transaction_id, shares, price_per_share])
+        return balance - total_price
+
+    lots = position[4]
+    remaining = shares
+    cost_removed = 0.0
+
+    while remaining > 0 and lots:
+        lot = lots[0]
+        used = min(lot[2], remaining)
+
+        cost_removed += used * lot[3]
+        remaining -= used
+        lot[2] -= used
+
+        if lot[2] <= 0:
+            lots.popleft()
+
+    position[1] -= shares
+    position[2] -= cost_removed
+    # shares sold beyond the open lots have no cost basis to realize against
+    position[3] += (shares - remaining) * price_per_share - cost_removed
+    return balance + total_price
+
+def _write_snapshot(cur, portfolio_id, timestamp, transaction_id, balance, positions):
+    cur.execute('''
+                INSERT OR REPLACE INTO state_snapshots (portfolio_id, timestamp, transaction_id, balance)
+                VALUES (?, ?, ?, ?)
+                ''', (portfolio_id, timestamp, transaction_id, balance)
+    )
+    cur.executemany('''
+                    INSERT OR REPLACE INTO state_snapshot_holdings
+                    (portfolio_id, timestamp, transaction_id, symbol, sector, shares, cost_basis, realized_pnl)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', [(portfolio_id, timestamp, transaction_id, symbol, sector, shares, cost_basis, realized_pnl)
+                          for symbol, (sector, shares, cost_basis, realized_pnl, _) in positions.items()]
+    )
+
+def _latest_snapshot(cur, portfolio_id, until=None):
+    """Key and balance of the newest snapshot at or before `until` (or overall), as (timestamp, transaction_id, balance)."""
+    if until is None:
+        cur.execute('''
+                    SELECT timestamp, transaction_id, balance FROM state_snapshots
+                    WHERE portfolio_id = ?
+                    ORDER BY timestamp DESC, transaction_id DESC LIMIT 1
+                    ''', (portfolio_id,)
+        )
+    else:
+        cur.execute('''
+                    SELECT timestamp, transaction_id, balance FROM state_snapshots
+                    WHERE portfolio_id = ? AND timestamp <= ?
+                    ORDER BY timestamp DESC, transaction_id DESC LIMIT 1
+                    ''', (portfolio_id, until)
+        )
+
+    return cur.fetchone()
+
+def _load_positions(cur, query, params):
+    """Load a positions dict (see _apply_transaction) from a holdings query, with lots not loaded yet."""
+    cur.execute(query, params)
+
+    return {
+        symbol: [sector, shares, cost_basis, realized_pnl, None]
+        for symbol, sector, shares, cost_basis, realized_pnl in cur.fetchall()
+    }
+
+def _open_lots(cur, portfolio_id, symbol, shares, timestamp, transaction_id):
+    """
+    Derive the open FIFO lots of a symbol holding `shares` as of a (timestamp, transaction_id) position.
+    FIFO always leaves the newest buys open, so walk buys backwards until they cover the shares.
+    """
+    cur.execute('''
+                SELECT timestamp, transaction_id, shares, price_per_share FROM transactions
+                WHERE portfolio_id = ? AND symbol = ? AND operation = 'BUY' AND (timestamp, transaction_id) <= (?, ?)
+                ORDER BY timestamp DESC, transaction_id DESC
+                ''', (portfolio_id, symbol, timestamp, transaction_id)
+    )
+
+    lots = deque()
+    needed = shares
+    for lot_timestamp, lot_transaction_id, lot_shares, price_per_share in cur:
+        if needed <= 0:
+            break
+
+        lots.appendleft([lot_timestamp, lot_transaction_id, min(lot_shares, needed), price_per_share])
+        needed -= lot_shares
+
+    return lots
+
+def maybe_snapshot_state(conn, portfolio_id, timestamp, transaction_id):
+    """
+    Snapshot the current holdings and balance of a portfolio if STATE_SNAPSHOT_INTERVAL
+    transactions were applied since its last snapshot, without committing.
+
+    Only called right after a trade is applied to the holdings table, so the table is the
+    state as of that trade. Skipped if a later-dated transaction already exists (e.g. imported),
+    since the table then includes trades after this position.
+
+    :return: True if a snapshot was written
+    """
+    cur = conn.cursor()
+
+    cur.execute('''
+                SELECT 1 FROM transactions
+                WHERE portfolio_id = ? AND (timestamp, transaction_id) > (?, ?)
+                LIMIT 1
+                ''', (portfolio_id, timestamp, transaction_id)
+    )
+    if cur.fetchone():
+        return False
+
+    last = _latest_snapshot(cur, portfolio_id)
+    since = last[:2] if last else ('', 0)
+
+    cur.execute('''
+                SELECT COUNT(*) FROM transactions
+                WHERE portfolio_id = ? AND (timestamp, transaction_id) > (?, ?)
+                ''', (portfolio_id, *since)
+    )
+    if cur.fetchone()[0] < STATE_SNAPSHOT_INTERVAL:
+        return False
+
+    positions = _load_positions(cur, '''
+                                SELECT symbol, sector, shares, cost_basis, realized_pnl FROM holdings
+                                WHERE portfolio_id = ?
+                                ''', (portfolio_id,)
+    )
+
+    cur.execute('''
+                SELECT current_balance FROM portfolios WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    balance = cur.fetchone()[0]
+
+    _write_snapshot(cur, portfolio_id, timestamp, transaction_id, balance, positions)
+
+    return True
+
+def rebuild_state_snapshots(conn, portfolio_id, commit=True):
+    """
+    Rebuild every state snapshot of a portfolio by replaying its transaction log in time order.
+    Needed after transactions are inserted out of time order, e.g. by a bulk import.
+
+    :return: number of snapshots written
+    """
+    cur = conn.cursor()
+    cur.execute('DELETE FROM state_snapshots WHERE portfolio_id = ?', (portfolio_id,))
+    cur.execute('DELETE FROM state_snapshot_holdings WHERE portfolio_id = ?', (portfolio_id,))
+
+    cur.execute('''
+                SELECT initial_balance FROM portfolios WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    balance = cur.fetchone()[0]
+
+    replay = conn.cursor()
+    replay.execute('''
+                   SELECT timestamp, transaction_id, symbol, sector, operation, shares, price_per_share, total_price
+                   FROM transactions
+                   WHERE portfolio_id = ?
+                   ORDER BY timestamp, transaction_id
+                   ''', (portfolio_id,)
+    )
+
+    positions = {}
+    written = 0
+    for applied, trade in enumerate(replay, start=1):
+        balance = _apply_transaction(positions, balance, *trade)
+        timestamp, transaction_id = trade[:2]
+
+        if applied % STATE_SNAPSHOT_INTERVAL == 0:
+            _write_snapshot(cur, portfolio_id, timestamp, transaction_id, balance, positions)
+            written += 1
+
+    if commit:
+        conn.commit()
+
+    return written
+
+def get_state_as_of(conn, portfolio_id, as_of):
+    """
+    Rebuild the holdings and balance of a portfolio as of a past time from the nearest
+    state snapshot plus a replay of the transactions after it.
+
+    :param as_of: timestamp string, transactions at or before it are included
+    :return: (balance, holdings) with holdings as (symbol, sector, shares, open lot cost) rows like get_holdings,
+             or None if the portfolio does not exist
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT initial_balance FROM portfolios WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    snapshot = _latest_snapshot(cur, portfolio_id, as_of)
+
+    if snapshot:
+        timestamp, transaction_id, balance = snapshot
+        positions = _load_positions(cur, '''
+                                    SELECT symbol, sector, shares, cost_basis, realized_pnl FROM state_snapshot_holdings
+                                    WHERE portfolio_id = ? AND timestamp = ? AND transaction_id = ?
+                                    ''', (portfolio_id, timestamp, transaction_id)
+        )
+    else:
+        timestamp, transaction_id, balance = '', 0, row[0]
+        positions = {}
+
+    cur.execute('''
+                SELECT timestamp, transaction_id, symbol, sector, operation, shares, price_per_share, total_price
+                FROM transactions
+                WHERE portfolio_id = ? AND (timestamp, transaction_id) > (?, ?) AND timestamp <= ?
+                ORDER BY timestamp, transaction_id
+                ''', (portfolio_id, timestamp, transaction_id, as_of)
+    )
+    trades = cur.fetchall()
+
+    # only symbols sold after the snapshot need their open lots
+    for symbol in {trade[2] for trade in trades if trade[4] == 'SELL'}:
+        position = positions.get(symbol)
+        if position and position[4] is None:
+            position[4] = _open_lots(cur, portfolio_id, symbol, position[1], timestamp, transaction_id)
+
+    for trade in trades:
+        balance = _apply_transaction(positions, balance, *trade)
+
+    holdings = [
+        (symbol, sector, shares, cost_basis)
+        for symbol, (sector, shares, cost_basis, _, _) in sorted(positions.items())
+        if shares > 0
+    ]
+
+    return balance, holdings
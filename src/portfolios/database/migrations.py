@@ -0,0 +1,360 @@
+# Versioned schema migrations for portfolios.db.
+# The applied version is stored in SQLite's `PRAGMA user_version`.
+
+import sqlite3 as sq
+
+# Each migration lists the statements to apply and EXPLAIN QUERY PLAN checks for the hot
+# queries in procedures.py that it is meant to speed up: (query, params, expected index).
+MIGRATIONS = [
+    {
+        'version': 1,
+        'description': 'Index transactions by (portfolio_id, symbol) and balances by (portfolio_id, balance_id)',
+        'statements': [
+            'CREATE INDEX IF NOT EXISTS idx_transactions_portfolio_symbol ON transactions (portfolio_id, symbol)',
+            'CREATE INDEX IF NOT EXISTS idx_balances_portfolio_balance ON balances (portfolio_id, balance_id)',
+        ],
+        'checks': [
+            (
+                'SELECT balance FROM balances WHERE portfolio_id = ? ORDER BY balance_id DESC LIMIT 1',
+                (1,),
+                'idx_balances_portfolio_balance',
+            ),
+            (
+                'SELECT symbol, price_per_share FROM transactions WHERE portfolio_id = ? GROUP BY symbol',
+                (1,),
+                'idx_transactions_portfolio_symbol',
+            ),
+            (
+                'SELECT portfolio_id, symbol, SUM(shares) FROM transactions WHERE portfolio_id = ? GROUP BY portfolio_id, symbol',
+                (1,),
+                'idx_transactions_portfolio_symbol',
+            ),
+            (
+                'SELECT symbol, sector, shares, cost_basis FROM holdings WHERE portfolio_id = ? AND shares > 0',
+                (1,),
+                'sqlite_autoindex_holdings_1',
+            ),
+        ],
+    },
+    {
+        'version': 2,
+        'description': 'Cache the current balance on portfolios and add daily balance rollups',
+        'statements': [
+            'ALTER TABLE portfolios ADD COLUMN current_balance REAL',
+            '''
+            UPDATE portfolios SET current_balance = COALESCE(
+                (SELECT balance FROM balances
+                 WHERE balances.portfolio_id = portfolios.portfolio_id
+                 ORDER BY balance_id DESC LIMIT 1),
+                initial_balance
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS balance_rollups (
+            portfolio_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            open_balance REAL NOT NULL,
+            high_balance REAL NOT NULL,
+            low_balance REAL NOT NULL,
+            close_balance REAL NOT NULL,
+            entries INTEGER NOT NULL,
+            PRIMARY KEY (portfolio_id, day),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_balances_timestamp ON balances (timestamp)',
+        ],
+        'checks': [
+            (
+                'SELECT current_balance FROM portfolios WHERE portfolio_id = ?',
+                (1,),
+                'INTEGER PRIMARY KEY',
+            ),
+            (
+                'SELECT portfolio_id, balance FROM balances WHERE timestamp < ?',
+                ('2000-01-01',),
+                'idx_balances_timestamp',
+            ),
+        ],
+    },
+    {
+        'version': 3,
+        'description': 'Add tiered portfolio value snapshots',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+            portfolio_id INTEGER NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            value REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            balance REAL NOT NULL,
+            holdings_value REAL NOT NULL,
+            PRIMARY KEY (portfolio_id, resolution, bucket),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            ) WITHOUT ROWID
+            ''',
+        ],
+        'checks': [
+            (
+                'SELECT bucket, value FROM portfolio_snapshots WHERE portfolio_id = ? AND resolution = ? AND bucket >= ? ORDER BY bucket',
+                (1, '1h', '2000-01-01'),
+                'PRIMARY KEY',
+            ),
+        ],
+    },
+    {
+        'version': 4,
+        'description': 'Add point-in-time holdings and balance snapshots',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS state_snapshots (
+            portfolio_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (portfolio_id, timestamp, transaction_id),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            ) WITHOUT ROWID
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS state_snapshot_holdings (
+            portfolio_id INTEGER NOT NULL,
+            timestamp TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            sector TEXT NOT NULL,
+            shares INTEGER NOT NULL,
+            cost_basis REAL NOT NULL,
+            PRIMARY KEY (portfolio_id, timestamp, transaction_id, symbol),
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            ) WITHOUT ROWID
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_transactions_portfolio_timestamp ON transactions (portfolio_id, timestamp, transaction_id)',
+        ],
+        'checks': [
+            (
+                'SELECT timestamp, transaction_id, balance FROM state_snapshots WHERE portfolio_id = ? AND timestamp <= ? ORDER BY timestamp DESC, transaction_id DESC LIMIT 1',
+                (1, '2000-01-01'),
+                'PRIMARY KEY',
+            ),
+            (
+                'SELECT symbol, operation FROM transactions WHERE portfolio_id = ? AND (timestamp, transaction_id) > (?, ?) AND timestamp <= ? ORDER BY timestamp, transaction_id',
+                (1, '2000-01-01', 0, '2000-02-01'),
+                'idx_transactions_portfolio_timestamp',
+            ),
+        ],
+    },
+    {
+        'version': 5,
+        'description': 'Add FIFO tax lots and realized P&L',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS lots (
+            lot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            portfolio_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            transaction_id INTEGER NOT NULL,
+            shares REAL NOT NULL,
+            price_per_share REAL NOT NULL,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            )
+            ''',
+            'CREATE INDEX IF NOT EXISTS idx_lots_portfolio_symbol ON lots (portfolio_id, symbol, timestamp, transaction_id)',
+            'ALTER TABLE holdings ADD COLUMN realized_pnl REAL NOT NULL DEFAULT 0',
+            'ALTER TABLE state_snapshot_holdings ADD COLUMN realized_pnl REAL NOT NULL DEFAULT 0',
+            'CREATE INDEX IF NOT EXISTS idx_transactions_portfolio_symbol_timestamp ON transactions (portfolio_id, symbol, timestamp, transaction_id)',
+        ],
+        'checks': [
+            (
+                'SELECT lot_id, shares, price_per_share FROM lots WHERE portfolio_id = ? AND symbol = ? ORDER BY timestamp, transaction_id',
+                (1, 'AAPL'),
+                'idx_lots_portfolio_symbol',
+            ),
+            (
+                "SELECT timestamp, transaction_id, shares, price_per_share FROM transactions WHERE portfolio_id = ? AND symbol = ? AND operation = 'BUY' AND (timestamp, transaction_id) <= (?, ?) ORDER BY timestamp DESC, transaction_id DESC",
+                (1, 'AAPL', '2000-01-01', 0),
+                'idx_transactions_portfolio_symbol_timestamp',
+            ),
+        ],
+    },
+    {
+        'version': 6,
+        'description': 'Register any number of portfolios for scheduled reports and alerts',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS registered_portfolios (
+            portfolio_id INTEGER PRIMARY KEY,
+            registered_at TEXT NOT NULL,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            )
+            ''',
+        ],
+        'checks': [
+            (
+                'SELECT h.portfolio_id, h.symbol FROM registered_portfolios r JOIN holdings h ON h.portfolio_id = r.portfolio_id WHERE h.shares > 0',
+                (),
+                'PRIMARY KEY',
+            ),
+        ],
+    },
+    {
+        'version': 7,
+        'description': 'Add conditional (limit, stop and take-profit) orders',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            portfolio_id INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            sector TEXT,
+            operation TEXT NOT NULL,
+            order_type TEXT NOT NULL,
+            trigger_price REAL NOT NULL,
+            shares REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'OPEN',
+            created_at TEXT NOT NULL,
+            filled_at TEXT,
+            fill_price REAL,
+            transaction_id INTEGER,
+            FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_orders_status_portfolio ON orders (status, portfolio_id)
+            ''',
+        ],
+        'checks': [
+            (
+                "SELECT order_id FROM orders WHERE status = 'OPEN' AND portfolio_id = ?",
+                (1,),
+                'idx_orders_status_portfolio',
+            ),
+        ],
+    },
+    {
+        'version': 8,
+        'description': 'Add a full-text index of fetched news articles',
+        'statements': [
+            '''
+            CREATE TABLE IF NOT EXISTS news_articles (
+            article_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL UNIQUE,
+            title TEXT NOT NULL,
+            description TEXT,
+            publisher TEXT,
+            published_at TEXT,
+            symbols TEXT NOT NULL DEFAULT '',
+            fetched_at TEXT NOT NULL
+            )
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_news_articles_published ON news_articles (published_at)
+            ''',
+            '''
+            CREATE VIRTUAL TABLE IF NOT EXISTS news_fts USING fts5 (
+            title, description, publisher, symbols,
+            content='news_articles', content_rowid='article_id'
+            )
+            ''',
+            # external content tables are kept in sync by triggers
+            '''
+            CREATE TRIGGER IF NOT EXISTS news_articles_ai AFTER INSERT ON news_articles BEGIN
+            INSERT INTO news_fts (rowid, title, description, publisher, symbols)
+            VALUES (new.article_id, new.title, new.description, new.publisher, new.symbols);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS news_articles_ad AFTER DELETE ON news_articles BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, description, publisher, symbols)
+            VALUES ('delete', old.article_id, old.title, old.description, old.publisher, old.symbols);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS news_articles_au AFTER UPDATE ON news_articles BEGIN
+            INSERT INTO news_fts (news_fts, rowid, title, description, publisher, symbols)
+            VALUES ('delete', old.article_id, old.title, old.description, old.publisher, old.symbols);
+            INSERT INTO news_fts (rowid, title, description, publisher, symbols)
+            VALUES (new.article_id, new.title, new.description, new.publisher, new.symbols);
+            END
+            ''',
+        ],
+        'checks': [
+            (
+                'DELETE FROM news_articles WHERE published_at < ?',
+                ('2000-01-01',),
+                'idx_news_articles_published',
+            ),
+        ],
+    },
+]
+
+def get_schema_version(conn):
+    """Get the migration version the database is currently at."""
+    cur = conn.cursor()
+    cur.execute('PRAGMA user_version')
+    return cur.fetchone()[0]
+
+def explain_query_plan(conn, query, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines of a query."""
+    cur = conn.cursor()
+    cur.execute(f'EXPLAIN QUERY PLAN {query}', params)
+    return [row[-1] for row in cur.fetchall()]
+
+def check_query_plans(conn, migrations=None):
+    """
+    Run the EXPLAIN QUERY PLAN checks of the given migrations (all by default).
+
+    :return: list of (query, plan) tuples for queries that do not use their expected index
+    """
+    failures = []
+
+    for migration in migrations or MIGRATIONS:
+        for query, params, index_name in migration['checks']:
+            plan = explain_query_plan(conn, query, params)
+
+            if not any(index_name in detail for detail in plan):
+                failures.append((query, plan))
+
+    return failures
+
+def apply_migrations(conn, verbose=True):
+    """
+    Apply every migration newer than the database's current version, each in its own transaction.
+
+    :param verbose: print each applied migration
+    :return: list of migration versions applied
+    """
+    current_version = get_schema_version(conn)
+    applied = []
+
+    for migration in MIGRATIONS:
+        if migration['version'] <= current_version:
+            continue
+
+        cur = conn.cursor()
+        try:
+            # explicit BEGIN so DDL statements are rolled back together with the rest of the migration
+            cur.execute('BEGIN')
+            for statement in migration['statements']:
+                cur.execute(statement)
+
+            # PRAGMA does not accept bound parameters
+            cur.execute(f"PRAGMA user_version = {int(migration['version'])}")
+            conn.commit()
+
+        except sq.Error as e:
+            conn.rollback()
+            print(f"MIGRATION {migration['version']} failed: {e}")
+            break
+
+        applied.append(migration['version'])
+        if verbose:
+            print(f"MIGRATION {migration['version']}: {migration['description']}")
+
+        for query, plan in check_query_plans(conn, [migration]):
+            print(f"MIGRATION {migration['version']} WARNING: query not using expected index:\n{query}\n{plan}")
+
+    return applied
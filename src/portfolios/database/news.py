@@ -0,0 +1,123 @@
+# Local full-text index of fetched news articles.
+# Articles are stored once per URL in news_articles, tagged with every symbol they were fetched for,
+# and mirrored into the news_fts FTS5 table by triggers, so searches never go back to Google News.
+
+import re
+import datetime as dt
+
+# days of articles kept in the index
+NEWS_KEEP_DAYS = 30
+
+PUBLISHED_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+def parse_published(value):
+    """Convert a Google News published date to a sortable 'YYYY-MM-DD HH:MM:SS' string, or None."""
+    try:
+        return dt.datetime.strptime(value, PUBLISHED_FORMAT).strftime('%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None
+
+def index_articles(conn, symbol, articles):
+    """
+    Add fetched articles of a symbol to the index, tagging articles already indexed with the symbol.
+
+    :param articles: article dicts as returned by GNews
+    :return: number of articles written
+    """
+    fetched_at = dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+
+    for article in articles:
+        if not article.get('url'):
+            continue
+
+        publisher = article.get('publisher')
+        if isinstance(publisher, dict):
+            publisher = publisher.get('title')
+
+        # articles without a readable date are dated by when they were fetched
+        rows.append((
+            article['url'], article.get('title', ''), article.get('description', ''), publisher,
+            parse_published(article.get('published date')) or fetched_at, symbol or '', fetched_at,
+        ))
+
+    cur = conn.cursor()
+    cur.executemany('''
+                    INSERT INTO news_articles (url, title, description, publisher, published_at, symbols, fetched_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (url) DO UPDATE SET
+                    symbols = trim(symbols || ' ' || excluded.symbols)
+                    WHERE excluded.symbols != '' AND instr(' ' || symbols || ' ', ' ' || excluded.symbols || ' ') = 0
+                    ''', rows
+    )
+
+    return len(rows)
+
+def refresh_news_index(conn, news, keep_days=NEWS_KEEP_DAYS):
+    """
+    Index the articles fetched for several symbols and prune expired ones, without committing.
+
+    :param news: dict of symbol to its list of fetched articles
+    :return: (articles written, articles pruned)
+    """
+    written = sum(index_articles(conn, symbol, articles) for symbol, articles in news.items())
+
+    return written, prune_news(conn, keep_days)
+
+def fts_query(text):
+    """Turn free text into an FTS5 query that matches every word, quoting each so user input is never parsed as syntax."""
+    words = re.findall(r'\w+', text)
+
+    return ' '.join(f'"{word}"' for word in words)
+
+def search_news(conn, text, limit=10, days=7):
+    """
+    Search indexed articles of the last `days` days, best match first.
+    A symbol matches the articles tagged with it as well as articles mentioning it.
+
+    :return: list of (title, description, url, publisher, published_at, symbols)
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+
+    since = (dt.datetime.now() - dt.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT a.title, a.description, a.url, a.publisher, a.published_at, a.symbols
+                FROM news_fts
+                JOIN news_articles a ON a.article_id = news_fts.rowid
+                WHERE news_fts MATCH ? AND a.published_at >= ?
+                ORDER BY bm25(news_fts, 2.0, 1.0, 0.5, 4.0), a.published_at DESC
+                LIMIT ?
+                ''', (query, since, limit)
+    )
+
+    return cur.fetchall()
+
+def prune_news(conn, keep_days=NEWS_KEEP_DAYS):
+    """
+    Delete articles published more than `keep_days` days ago, without committing.
+
+    :return: number of articles deleted
+    """
+    cutoff = (dt.datetime.now() - dt.timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+    cur = conn.cursor()
+    cur.execute('''
+                DELETE FROM news_articles WHERE published_at < ?
+                ''', (cutoff,)
+    )
+
+    return cur.rowcount
+
+def get_held_symbols(conn):
+    """Get every symbol held by any portfolio."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT DISTINCT symbol FROM holdings WHERE shares > 0
+                '''
+    )
+
+    return [row[0] for row in cur.fetchall()]
@@ -6,6 +6,8 @@ import datetime as dt
 import pandas as pd
 import yfinance as yf
 
+from src.portfolios.database.history import maybe_snapshot_state, _apply_transaction
+
 def get_portfolio(conn, name):
     """Get portfolio details from table."""
     cur = conn.cursor()
@@ -28,45 +30,96 @@ def get_portfolio_id(conn, name):
 
 
 def get_portfolio_balance(conn, portfolio_id):
-    """Get portfolio balance from table."""
+    """Get current portfolio balance, cached on the portfolios row."""
     cur = conn.cursor()
     cur.execute('''
-                SELECT balance FROM balances WHERE portfolio_id = ? 
-                ORDER BY balance_id DESC LIMIT 1
+                SELECT current_balance FROM portfolios WHERE portfolio_id = ?
                 ''', (portfolio_id,)
     )
 
     result = cur.fetchone()
     return result[0] if result else None
 
+def _log_balance(cur, portfolio_id, balance, timestamp):
+    """Append a balance history row and update the cached current balance, without committing."""
+    cur.execute('''
+                INSERT INTO balances (portfolio_id, balance, timestamp)
+                VALUES (?, ?, ?)
+                ''', (portfolio_id, balance, timestamp)
+    )
+    cur.execute('''
+                UPDATE portfolios SET current_balance = ? WHERE portfolio_id = ?
+                ''', (balance, portfolio_id)
+    )
+
 def update_portfolio_balance(conn, portfolio_id, new_balance, timestamp):
     """Log portfolio balance into Balances table."""
     try:
         cur = conn.cursor()
-        cur.execute('''
-                    INSERT INTO balances 
-                    (portfolio_id, balance, timestamp)
-                    VALUES (?, ?, ?)
-                    ''', (portfolio_id, new_balance, timestamp)
-        )
+        _log_balance(cur, portfolio_id, new_balance, timestamp)
         conn.commit()
             
     except sq.IntegrityError as e:
         print(f'update_portfolio_balance() error: {e}')
 
+def compact_balance_history(conn, keep_days=30):
+    """
+    Fold balance history older than `keep_days` into one open/high/low/close row per portfolio
+    per day in balance_rollups, and delete the folded rows from balances.
+
+    :return: number of balance rows compacted
+    """
+    cutoff = (dt.datetime.now() - dt.timedelta(days=keep_days)).strftime('%Y-%m-%d')
+
+    cur = conn.cursor()
+    cur.execute('''
+                INSERT INTO balance_rollups
+                (portfolio_id, day, open_balance, high_balance, low_balance, close_balance, entries)
+                SELECT portfolio_id, day, MAX(open_balance), MAX(balance), MIN(balance), MAX(close_balance), COUNT(*)
+                FROM (
+                    SELECT
+                    portfolio_id,
+                    substr(timestamp, 1, 10) AS day,
+                    balance,
+                    FIRST_VALUE(balance) OVER day_window AS open_balance,
+                    LAST_VALUE(balance) OVER day_window AS close_balance
+                    FROM balances
+                    WHERE timestamp < ?
+                    WINDOW day_window AS (
+                        PARTITION BY portfolio_id, substr(timestamp, 1, 10)
+                        ORDER BY balance_id
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                    )
+                )
+                GROUP BY portfolio_id, day
+                ON CONFLICT (portfolio_id, day) DO UPDATE SET
+                high_balance = MAX(high_balance, excluded.high_balance),
+                low_balance = MIN(low_balance, excluded.low_balance),
+                close_balance = excluded.close_balance,
+                entries = entries + excluded.entries
+                ''', (cutoff,)
+    )
+    cur.execute('''
+                DELETE FROM balances WHERE timestamp < ?
+                ''', (cutoff,)
+    )
+    compacted = cur.rowcount
+    conn.commit()
+
+    return compacted
 
 def create_portfolio(conn, name, initial_balance):
     """Create a new portfolio."""
 
-    created_at = dt.now()
+    created_at = dt.datetime.now()
     timestamp_str = created_at.strftime('%Y-%m-%d %H:%M:%S')
 
     cur = conn.cursor()
     try:
         cur.execute('''
-                    INSERT INTO portfolios (name, initial_balance, created_at)
-                    VALUES (?, ?, ?)
-                    ''', (name, initial_balance, timestamp_str)
+                    INSERT INTO portfolios (name, initial_balance, created_at, current_balance)
+                    VALUES (?, ?, ?, ?)
+                    ''', (name, initial_balance, timestamp_str, initial_balance)
         )
 
         portfolio_id = cur.lastrowid
@@ -122,32 +175,242 @@ def delete_portfolio(conn, name):
                 DELETE FROM balances WHERE portfolio_id = ?
                 ''', (portfolio_id,)
     )
+    cur.execute('''
+                DELETE FROM balance_rollups WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM holdings WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM portfolio_snapshots WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM state_snapshots WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM state_snapshot_holdings WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM lots WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM registered_portfolios WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    cur.execute('''
+                DELETE FROM orders WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
     conn.commit()
 
     return 1
 
 
+def register_portfolio(conn, portfolio_id):
+    """
+    Register a portfolio for scheduled reports and alerts.
+
+    :return: True if it was not registered before
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                INSERT OR IGNORE INTO registered_portfolios (portfolio_id, registered_at)
+                VALUES (?, ?)
+                ''', (portfolio_id, dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    )
+    conn.commit()
+
+    return cur.rowcount > 0
+
+def unregister_portfolio(conn, portfolio_id):
+    """
+    Stop scheduled reports and alerts for a portfolio.
+
+    :return: True if it was registered
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                DELETE FROM registered_portfolios WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    conn.commit()
+
+    return cur.rowcount > 0
+
+def get_registered_portfolios(conn):
+    """Get (portfolio_id, name, current_balance) of every registered portfolio."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT p.portfolio_id, p.name, p.current_balance
+                FROM registered_portfolios r
+                JOIN portfolios p ON p.portfolio_id = r.portfolio_id
+                ORDER BY p.name
+                '''
+    )
+
+    return cur.fetchall()
+
+def get_registered_holdings(conn):
+    """Get (portfolio_id, symbol, sector, shares, cost_basis) of every registered portfolio's holdings in one query."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT h.portfolio_id, h.symbol, h.sector, h.shares, h.cost_basis
+                FROM registered_portfolios r
+                JOIN holdings h ON h.portfolio_id = r.portfolio_id
+                WHERE h.shares > 0
+                '''
+    )
+
+    return cur.fetchall()
+
 def get_holdings(conn, portfolio_id):
-    """Get portfolio holdings from table."""
+    """Get portfolio holdings from the materialized holdings table."""
     cur = conn.cursor()
 
-    # get all holdings when first bought and previous sold as initial_value to compare to the total value
+    # initial_price is the cost of the open FIFO lots, maintained by insert_transaction
     cur.execute('''
-                SELECT 
-                symbol,
-                sector,
-                SUM(CASE WHEN operation = 'BUY' THEN shares ELSE -shares END) AS total_shares,
-                SUM(CASE WHEN operation = 'BUY' THEN shares * price_per_share ELSE -(shares * price_per_share) END) AS initial_price
-                FROM transactions
-                WHERE portfolio_id = ?
-                GROUP BY symbol
-                HAVING total_shares > 0
+                SELECT symbol, sector, shares AS total_shares, cost_basis AS initial_price
+                FROM holdings
+                WHERE portfolio_id = ? AND shares > 0
                 ''', (portfolio_id,)
     )
 
     results = cur.fetchall()
     return results
 
+def get_realized_pnl(conn, portfolio_id):
+    """Get realized P&L per symbol of a portfolio, including symbols that are no longer held."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT symbol, realized_pnl FROM holdings WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+
+    return dict(cur.fetchall())
+
+def _replay_holdings(conn, portfolio_id=None):
+    """
+    Replay the transaction log in time order through FIFO lots.
+
+    :return: {portfolio_id: positions} with positions as built by history._apply_transaction
+    """
+    cur = conn.cursor()
+
+    where = 'WHERE portfolio_id = ?' if portfolio_id is not None else ''
+    params = (portfolio_id,) if portfolio_id is not None else ()
+
+    cur.execute(f'''
+                SELECT portfolio_id, timestamp, transaction_id, symbol, sector, operation, shares, price_per_share, total_price
+                FROM transactions
+                {where}
+                ORDER BY portfolio_id, timestamp, transaction_id
+                ''', params
+    )
+
+    portfolios = {}
+    for pid, *trade in cur:
+        # the balance is rebuilt separately by rebuild_balance
+        _apply_transaction(portfolios.setdefault(pid, {}), 0.0, *trade)
+
+    return portfolios
+
+def rebuild_holdings(conn, portfolio_id=None, commit=True):
+    """
+    Rebuild the holdings and lots tables from the transaction log.
+
+    :param portfolio_id: portfolio to rebuild, or None to rebuild every portfolio
+    :return: number of holdings rows written
+    """
+    portfolios = _replay_holdings(conn, portfolio_id)
+
+    cur = conn.cursor()
+    if portfolio_id is not None:
+        cur.execute('DELETE FROM holdings WHERE portfolio_id = ?', (portfolio_id,))
+        cur.execute('DELETE FROM lots WHERE portfolio_id = ?', (portfolio_id,))
+    else:
+        cur.execute('DELETE FROM holdings')
+        cur.execute('DELETE FROM lots')
+
+    rows = [
+        (pid, symbol, sector, shares, cost_basis, realized_pnl)
+        for pid, positions in portfolios.items()
+        for symbol, (sector, shares, cost_basis, realized_pnl, _) in positions.items()
+    ]
+    cur.executemany('''
+                    INSERT INTO holdings (portfolio_id, symbol, sector, shares, cost_basis, realized_pnl)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''', rows
+    )
+    cur.executemany('''
+                    INSERT INTO lots (portfolio_id, symbol, timestamp, transaction_id, shares, price_per_share)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(pid, symbol, *lot)
+                          for pid, positions in portfolios.items()
+                          for symbol, position in positions.items()
+                          for lot in position[4]]
+    )
+    if commit:
+        conn.commit()
+
+    return len(rows)
+
+def rebuild_balance(conn, portfolio_id, timestamp, commit=True):
+    """
+    Recompute the current balance of a portfolio from its initial balance and
+    the cash flows of its transaction log, and log it as a new balance entry.
+
+    :return: the rebuilt balance
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT
+                p.initial_balance + COALESCE(SUM(CASE WHEN t.operation = 'BUY' THEN -t.total_price ELSE t.total_price END), 0)
+                FROM portfolios p
+                LEFT JOIN transactions t ON t.portfolio_id = p.portfolio_id
+                WHERE p.portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    balance = cur.fetchone()[0]
+
+    _log_balance(cur, portfolio_id, balance, timestamp)
+    if commit:
+        conn.commit()
+
+    return balance
+
+def verify_holdings(conn, portfolio_id, tolerance=1e-6):
+    """
+    Check the holdings table of a portfolio against a FIFO replay of the transaction log.
+
+    :return: list of (symbol, expected_shares, actual_shares, expected_cost, actual_cost, expected_realized, actual_realized)
+             for every symbol that does not match. An empty list means the table is consistent.
+    """
+    positions = _replay_holdings(conn, portfolio_id).get(portfolio_id, {})
+    expected = {symbol: (shares, cost_basis, realized_pnl) for symbol, (_, shares, cost_basis, realized_pnl, _) in positions.items()}
+
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT symbol, shares, cost_basis, realized_pnl FROM holdings WHERE portfolio_id = ?
+                ''', (portfolio_id,)
+    )
+    actual = {symbol: (shares, cost_basis, realized_pnl) for symbol, shares, cost_basis, realized_pnl in cur.fetchall()}
+
+    mismatches = []
+    for symbol in sorted(set(expected) | set(actual)):
+        expected_values = expected.get(symbol, (0, 0.0, 0.0))
+        actual_values = actual.get(symbol, (0, 0.0, 0.0))
+
+        if any(abs(e - a) > tolerance for e, a in zip(expected_values, actual_values)):
+            mismatches.append((symbol, *(value for pair in zip(expected_values, actual_values) for value in pair)))
+
+    return mismatches
+
 def get_symbols(conn, portfolio_id):
     """Get a list of all symbols in a portfolio."""
     cur = conn.cursor()
@@ -161,12 +424,203 @@ def get_symbols(conn, portfolio_id):
     results = cur.fetchall()
     return results
 
-def insert_transaction(conn, portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp):
-    """Insert a new transaction into transaction table."""
+def insert_transaction(conn, portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp, commit=True):
+    """
+    Insert a new transaction into transaction table and apply it to the holdings and lots tables in the same commit.
+    Buys open a lot, sells consume the oldest open lots first and realize their P&L.
+
+    :return: the transaction_id of the new transaction
+    """
+    symbol = symbol.upper()
+    shares = float(shares)
+
     cur = conn.cursor()
     cur.execute('''
                 INSERT INTO transactions (portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (portfolio_id, symbol.upper(), sector, operation, shares, price_per_share, total_price, timestamp)
+                ''', (portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp)
+    )
+    transaction_id = cur.lastrowid
+
+    if operation == 'BUY':
+        cur.execute('''
+                    INSERT INTO lots (portfolio_id, symbol, timestamp, transaction_id, shares, price_per_share)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (portfolio_id, symbol, timestamp, transaction_id, shares, price_per_share)
+        )
+        shares_delta = shares
+        cost_delta = shares * price_per_share
+        realized_delta = 0.0
+    else:
+        cur.execute('''
+                    SELECT lot_id, shares, price_per_share FROM lots
+                    WHERE portfolio_id = ? AND symbol = ?
+                    ORDER BY timestamp, transaction_id
+                    ''', (portfolio_id, symbol)
+        )
+
+        remaining = shares
+        cost_removed = 0.0
+        for lot_id, lot_shares, lot_price in cur.fetchall():
+            if remaining <= 0:
+                break
+
+            used = min(lot_shares, remaining)
+            cost_removed += used * lot_price
+            remaining -= used
+
+            if used < lot_shares:
+                cur.execute('UPDATE lots SET shares = shares - ? WHERE lot_id = ?', (used, lot_id))
+            else:
+                cur.execute('DELETE FROM lots WHERE lot_id = ?', (lot_id,))
+
+        shares_delta = -shares
+        cost_delta = -cost_removed
+        # shares sold beyond the open lots have no cost basis to realize against
+        realized_delta = (shares - remaining) * price_per_share - cost_removed
+
+    cur.execute('''
+                INSERT INTO holdings (portfolio_id, symbol, sector, shares, cost_basis, realized_pnl)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (portfolio_id, symbol) DO UPDATE SET
+                shares = shares + excluded.shares,
+                cost_basis = cost_basis + excluded.cost_basis,
+                realized_pnl = realized_pnl + excluded.realized_pnl
+                ''', (portfolio_id, symbol, sector, shares_delta, cost_delta, realized_delta)
+    )
+    if commit:
+        conn.commit()
+
+    return transaction_id
+
+def record_trade(conn, portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp):
+    """
+    Apply a trade to the transaction log, holdings and balance without committing,
+    so the caller can commit it atomically (alone or together with other trades).
+
+    :return: the new portfolio balance
+    """
+    transaction_id = insert_transaction(conn, portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp, commit=False)
+
+    balance = get_portfolio_balance(conn, portfolio_id)
+    new_balance = balance - total_price if operation == 'BUY' else balance + total_price
+
+    _log_balance(conn.cursor(), portfolio_id, new_balance, timestamp)
+    maybe_snapshot_state(conn, portfolio_id, timestamp, transaction_id)
+
+    return new_balance
+
+def create_order(conn, portfolio_id, symbol, sector, operation, order_type, trigger_price, shares):
+    """
+    Place an open conditional order.
+
+    :return: the order row as returned by get_open_orders
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                INSERT INTO orders (portfolio_id, symbol, sector, operation, order_type, trigger_price, shares, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (portfolio_id, symbol, sector, operation, order_type, trigger_price, shares, dt.datetime.now().strftime('%Y-%m-%d %H:%M'))
     )
     conn.commit()
+
+    return (cur.lastrowid, portfolio_id, symbol, operation, order_type, trigger_price, shares)
+
+def cancel_order(conn, portfolio_id, order_id):
+    """
+    Cancel an open order of a portfolio.
+
+    :return: True if the order was open
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                UPDATE orders SET status = 'CANCELLED'
+                WHERE order_id = ? AND portfolio_id = ? AND status = 'OPEN'
+                ''', (order_id, portfolio_id)
+    )
+    conn.commit()
+
+    return cur.rowcount > 0
+
+def reject_order(conn, order_id, timestamp):
+    """
+    Reject an open order that could not be filled, without committing.
+
+    :return: True if the order was open
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                UPDATE orders SET status = 'REJECTED', filled_at = ?
+                WHERE order_id = ? AND status = 'OPEN'
+                ''', (timestamp, order_id)
+    )
+
+    return cur.rowcount > 0
+
+def get_open_orders(conn, portfolio_id=None):
+    """Get (order_id, portfolio_id, symbol, operation, order_type, trigger_price, shares) of the open orders of one or every portfolio."""
+    cur = conn.cursor()
+
+    if portfolio_id is None:
+        cur.execute('''
+                    SELECT order_id, portfolio_id, symbol, operation, order_type, trigger_price, shares
+                    FROM orders WHERE status = 'OPEN'
+                    '''
+        )
+    else:
+        cur.execute('''
+                    SELECT order_id, portfolio_id, symbol, operation, order_type, trigger_price, shares
+                    FROM orders WHERE status = 'OPEN' AND portfolio_id = ?
+                    ORDER BY order_id
+                    ''', (portfolio_id,)
+        )
+
+    return cur.fetchall()
+
+def fill_order(conn, order_id, price, timestamp):
+    """
+    Fill a triggered order at the given price through record_trade, without committing.
+    Buys the balance cannot cover and sells of more shares than held are rejected.
+
+    :return: the new portfolio balance, or an error message string if the order was not filled
+    """
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT portfolio_id, symbol, sector, operation, shares FROM orders
+                WHERE order_id = ? AND status = 'OPEN'
+                ''', (order_id,)
+    )
+    row = cur.fetchone()
+    if not row:
+        return f'Order {order_id} is no longer open.'
+
+    portfolio_id, symbol, sector, operation, shares = row
+    total_price = shares * price
+
+    if operation == 'BUY':
+        rejected = get_portfolio_balance(conn, portfolio_id) < total_price
+    else:
+        cur.execute('''
+                    SELECT shares FROM holdings WHERE portfolio_id = ? AND symbol = ?
+                    ''', (portfolio_id, symbol)
+        )
+        held = cur.fetchone()
+        rejected = not held or held[0] < shares
+
+    if rejected:
+        cur.execute('''
+                    UPDATE orders SET status = 'REJECTED', filled_at = ? WHERE order_id = ?
+                    ''', (timestamp, order_id)
+        )
+        return f"Order {order_id} rejected: {'insufficient balance' if operation == 'BUY' else 'not enough shares held'}."
+
+    new_balance = record_trade(conn, portfolio_id, symbol, sector, operation, shares, price, total_price, timestamp)
+
+    cur.execute('''
+                UPDATE orders SET status = 'FILLED', filled_at = ?, fill_price = ?,
+                transaction_id = (SELECT MAX(transaction_id) FROM transactions WHERE portfolio_id = ?)
+                WHERE order_id = ?
+                ''', (timestamp, price, portfolio_id, order_id)
+    )
+
+    return new_balance
@@ -1,6 +1,13 @@
 import sqlite3 as sq
 
-def create_database_schema(conn):
+from src.portfolios.database.procedures import rebuild_holdings
+from src.portfolios.database.history import rebuild_state_snapshots
+from src.portfolios.database.migrations import apply_migrations
+
+# migration version that added FIFO lots
+LOTS_MIGRATION = 5
+
+def create_database_schema(conn, verbose=True):
     cur = conn.cursor()
 
     try:
@@ -44,6 +51,20 @@ def create_database_schema(conn):
 
         cur.execute(balance_schema)
 
+        holdings_schema = '''
+                    CREATE TABLE IF NOT EXISTS holdings (
+                    portfolio_id INTEGER NOT NULL,
+                    symbol TEXT NOT NULL,
+                    sector TEXT NOT NULL,
+                    shares INTEGER NOT NULL DEFAULT 0,
+                    cost_basis REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (portfolio_id, symbol),
+                    FOREIGN KEY (portfolio_id) REFERENCES portfolios(portfolio_id)
+                    )
+                '''
+
+        cur.execute(holdings_schema)
+
         conn.commit()
     except sq.Error as e:
         return f'Error creating database schema: {e}'
@@ -52,3 +73,12 @@ def create_database_schema(conn):
 
     cur.close()
 
+    # bring indexes and later schema changes up to date
+    applied = apply_migrations(conn, verbose=verbose)
+
+    # backfill holdings, FIFO lots and state snapshots for databases created before lots existed
+    if LOTS_MIGRATION in applied:
+        rebuild_holdings(conn)
+
+        for (portfolio_id,) in conn.execute('SELECT portfolio_id FROM portfolios').fetchall():
+            rebuild_state_snapshots(conn, portfolio_id)
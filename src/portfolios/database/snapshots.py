@@ -0,0 +1,160 @@
+# Portfolio value snapshots stored at three resolutions.
+# Raw 5-minute snapshots are rolled up into hourly and daily rows, and each tier is pruned
+# after its retention period, so long ranges are always read from a coarse tier.
+
+import datetime as dt
+
+# resolution, bucket length and how long rows of the tier are kept (None keeps them forever)
+SNAPSHOT_TIERS = [
+    ('5m', dt.timedelta(minutes=5), dt.timedelta(days=2)),
+    ('1h', dt.timedelta(hours=1), dt.timedelta(days=90)),
+    ('1d', dt.timedelta(days=1), None),
+]
+
+# days covered by each !performance range
+PERFORMANCE_RANGES = {
+    '1d': 1,
+    '5d': 5,
+    '1mo': 30,
+    '3mo': 90,
+    '6mo': 180,
+    '1y': 365,
+    '5y': 365 * 5,
+    'max': None,
+}
+
+BUCKET_FORMAT = '%Y-%m-%d %H:%M'
+
+# coarse buckets touched within this window are re-aggregated on every rollup,
+# so a rollup schedule gap shorter than this loses nothing
+ROLLUP_LOOKBACK = dt.timedelta(days=1)
+
+def snapshot_bucket(timestamp, resolution):
+    """Floor a datetime to the start of its bucket at the given resolution."""
+    if resolution == '5m':
+        timestamp = timestamp.replace(minute=timestamp.minute - timestamp.minute % 5, second=0, microsecond=0)
+    elif resolution == '1h':
+        timestamp = timestamp.replace(minute=0, second=0, microsecond=0)
+    elif resolution == '1d':
+        timestamp = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    else:
+        raise ValueError(f'Invalid snapshot resolution {resolution}.')
+
+    return timestamp.strftime(BUCKET_FORMAT)
+
+def record_snapshot(conn, portfolio_id, timestamp, balance, holdings_value):
+    """Write the 5-minute snapshot of a portfolio's value, replacing one already in the same bucket."""
+    value = balance + holdings_value
+
+    cur = conn.cursor()
+    cur.execute('''
+                INSERT INTO portfolio_snapshots
+                (portfolio_id, resolution, bucket, value, high, low, balance, holdings_value)
+                VALUES (?, '5m', ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (portfolio_id, resolution, bucket) DO UPDATE SET
+                value = excluded.value,
+                high = MAX(high, excluded.value),
+                low = MIN(low, excluded.value),
+                balance = excluded.balance,
+                holdings_value = excluded.holdings_value
+                ''', (portfolio_id, snapshot_bucket(timestamp, '5m'), value, value, value, balance, holdings_value)
+    )
+
+def _rollup_tier(cur, source, target, since):
+    """Aggregate `source` rows from `since` onward into `target` buckets, keeping the last value of each bucket."""
+    if target == '1h':
+        bucket_expr = "substr(bucket, 1, 13) || ':00'"
+    else:
+        bucket_expr = "substr(bucket, 1, 10) || ' 00:00'"
+
+    cur.execute(f'''
+                INSERT INTO portfolio_snapshots
+                (portfolio_id, resolution, bucket, value, high, low, balance, holdings_value)
+                SELECT portfolio_id, ?, target_bucket, MAX(close_value), MAX(high), MIN(low), MAX(close_balance), MAX(close_holdings)
+                FROM (
+                    SELECT
+                    portfolio_id,
+                    {bucket_expr} AS target_bucket,
+                    high,
+                    low,
+                    LAST_VALUE(value) OVER target_window AS close_value,
+                    LAST_VALUE(balance) OVER target_window AS close_balance,
+                    LAST_VALUE(holdings_value) OVER target_window AS close_holdings
+                    FROM portfolio_snapshots
+                    WHERE resolution = ? AND bucket >= ?
+                    WINDOW target_window AS (
+                        PARTITION BY portfolio_id, {bucket_expr}
+                        ORDER BY bucket
+                        ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                    )
+                )
+                GROUP BY portfolio_id, target_bucket
+                ON CONFLICT (portfolio_id, resolution, bucket) DO UPDATE SET
+                value = excluded.value,
+                high = excluded.high,
+                low = excluded.low,
+                balance = excluded.balance,
+                holdings_value = excluded.holdings_value
+                ''', (target, source, since)
+    )
+
+def rollup_snapshots(conn, now=None):
+    """
+    Roll 5-minute snapshots up into hourly rows and hourly into daily rows, then prune
+    every tier past its retention.
+
+    Only coarse buckets within ROLLUP_LOOKBACK are re-aggregated on each run,
+    so the cost does not grow with history.
+
+    :return: number of expired rows deleted
+    """
+    now = now or dt.datetime.now()
+    cur = conn.cursor()
+
+    for (source, _, _), (target, _, _) in zip(SNAPSHOT_TIERS, SNAPSHOT_TIERS[1:]):
+        since = snapshot_bucket(now - ROLLUP_LOOKBACK, target)
+        _rollup_tier(cur, source, target, since)
+
+    deleted = 0
+    for resolution, _, retention in SNAPSHOT_TIERS:
+        if retention is None:
+            continue
+
+        cutoff = (now - retention).strftime(BUCKET_FORMAT)
+        cur.execute('''
+                    DELETE FROM portfolio_snapshots WHERE resolution = ? AND bucket < ?
+                    ''', (resolution, cutoff)
+        )
+        deleted += cur.rowcount
+
+    conn.commit()
+
+    return deleted
+
+def choose_resolution(days):
+    """Pick the finest tier that still holds `days` of history (None means all history)."""
+    for resolution, _, retention in SNAPSHOT_TIERS:
+        if retention is None:
+            return resolution
+        if days is not None and dt.timedelta(days=days) <= retention:
+            return resolution
+
+def get_snapshots(conn, portfolio_id, days=None, now=None):
+    """
+    Get (bucket, value) rows of a portfolio for the last `days` days from the tier that fits the range.
+
+    :return: (resolution, rows)
+    """
+    now = now or dt.datetime.now()
+    resolution = choose_resolution(days)
+    since = (now - dt.timedelta(days=days)).strftime(BUCKET_FORMAT) if days is not None else ''
+
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT bucket, value FROM portfolio_snapshots
+                WHERE portfolio_id = ? AND resolution = ? AND bucket >= ?
+                ORDER BY bucket
+                ''', (portfolio_id, resolution, since)
+    )
+
+    return resolution, cur.fetchall()
@@ -0,0 +1,148 @@
+# Dedicated SQLite writer thread for portfolio writes.
+# Writes are queued from the event loop and applied by one thread through the pool's writer connection.
+# Each write runs inside its own savepoint, and all writes waiting in the queue share one commit.
+
+import queue
+import threading
+import sqlite3 as sq
+from concurrent.futures import Future
+
+_STOP = object()
+
+class PortfolioWriter:
+    """
+    Group-commit writer for portfolios.db.
+
+    `submit(func, *args)` queues `func(conn, *args)` and returns a Future that resolves
+    with its return value once the batch containing it has been committed.
+    """
+
+    def __init__(self, pool, max_batch=256):
+        """
+        :param pool: ConnectionPool whose writer connection the batches are applied through
+        :param max_batch: maximum number of writes committed together
+        """
+        self._pool = pool
+        self._max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+        self.stats = {
+            'writes': 0,
+            'failed': 0,
+            'commits': 0,
+            'largest_batch': 0,
+        }
+
+    def start(self):
+        """Start the writer thread if it is not already running."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._thread = threading.Thread(target=self._run, name='portfolio-writer', daemon=True)
+        self._thread.start()
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue a write.
+
+        :param func: function called as func(conn, *args, **kwargs) on the writer thread. It must not commit.
+        :return: concurrent.futures.Future with the function's return value, use
+                 `await asyncio.wrap_future(future)` from async code
+        """
+        future = Future()
+        self._queue.put((func, args, kwargs, future))
+
+        return future
+
+    def stop(self, timeout=None):
+        """Commit every queued write and stop the writer thread."""
+        if not self.is_running():
+            return
+
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _next_batch(self):
+        """Block for one write, then drain whatever else is already queued."""
+        item = self._queue.get()
+        if item is _STOP:
+            return None, True
+
+        batch = [item]
+        stop = False
+
+        while len(batch) < self._max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+
+        return batch, stop
+
+    def _apply_batch(self, conn, batch):
+        """Apply a batch in one transaction, isolating each write in a savepoint."""
+        cur = conn.cursor()
+        cur.execute('BEGIN')
+
+        results = []
+        for func, args, kwargs, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            cur.execute('SAVEPOINT write')
+            try:
+                result = func(conn, *args, **kwargs)
+                cur.execute('RELEASE write')
+                results.append((future, result, None))
+
+            except Exception as e:
+                cur.execute('ROLLBACK TO write')
+                cur.execute('RELEASE write')
+                results.append((future, None, e))
+
+        try:
+            conn.commit()
+            self.stats['commits'] += 1
+
+        except sq.Error as e:
+            conn.rollback()
+            results = [(future, None, e) for future, _, _ in results]
+
+        # futures only resolve once their write is durable
+        for future, result, error in results:
+            if error is not None:
+                self.stats['failed'] += 1
+                future.set_exception(error)
+            else:
+                self.stats['writes'] += 1
+                future.set_result(result)
+
+        self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+
+            if batch:
+                # hold the pool's writer for the whole batch so other writers cannot interleave
+                with self._pool.write() as conn:
+                    try:
+                        self._apply_batch(conn, batch)
+                    except Exception as e:
+                        print(f'PORTFOLIO WRITER: Error applying batch: {e}')
+                        conn.rollback()
+                        for _, _, _, future in batch:
+                            if not future.done():
+                                future.set_exception(e)
+
+            if stop:
+                break
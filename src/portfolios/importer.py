@@ -0,0 +1,178 @@
+# Bulk import of historical trades from CSV.
+#
+# Expected columns (header row required, order does not matter):
+#   symbol, operation (BUY/SELL), shares, price_per_share, timestamp, [sector], [total_price]
+#
+# Usage:
+#   python -m src.portfolios.importer <portfolio_name> <trades.csv> [--batch-size N]
+
+import csv
+import time
+import argparse
+import itertools
+import datetime as dt
+
+from src.portfolios.database.procedures import get_portfolio_id, rebuild_holdings, rebuild_balance
+from src.portfolios.database.history import rebuild_state_snapshots
+
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']
+REQUIRED_COLUMNS = {'symbol', 'operation', 'shares', 'price_per_share', 'timestamp'}
+MAX_REPORTED_ERRORS = 10
+
+def parse_timestamp(value):
+    """Normalize a CSV timestamp to the '%Y-%m-%d %H:%M' format used for trades."""
+    value = value.strip()
+    try:
+        # fast path for ISO dates, strptime is the bottleneck on large files
+        return dt.datetime.fromisoformat(value).replace(tzinfo=None).isoformat(' ', 'minutes')
+    except ValueError:
+        pass
+
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return dt.datetime.strptime(value, fmt).strftime('%Y-%m-%d %H:%M')
+        except ValueError:
+            continue
+
+    raise ValueError(f'invalid timestamp {value!r}')
+
+def validate_batch(portfolio_id, batch):
+    """
+    Validate a batch of (line_number, row) pairs.
+
+    :return: (rows ready for executemany, list of (line_number, error) tuples)
+    """
+    valid = []
+    errors = []
+
+    for line_number, row in batch:
+        try:
+            symbol = row['symbol'].strip().upper()
+            if not symbol:
+                raise ValueError('missing symbol')
+
+            operation = row['operation'].strip().upper()
+            if operation not in ('BUY', 'SELL'):
+                raise ValueError(f'invalid operation {operation!r}')
+
+            shares = float(row['shares'])
+            price_per_share = float(row['price_per_share'])
+            if shares <= 0 or price_per_share <= 0:
+                raise ValueError('shares and price_per_share must be positive')
+
+            total_price = float(row['total_price']) if row.get('total_price') else shares * price_per_share
+            sector = (row.get('sector') or '').strip() or 'Unknown'
+            timestamp = parse_timestamp(row['timestamp'])
+
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append((line_number, str(e)))
+            continue
+
+        valid.append((portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp))
+
+    return valid, errors
+
+def import_trades(conn, portfolio_name, stream, batch_size=10000):
+    """
+    Stream trades from a CSV file object into a portfolio in one transaction.
+
+    Rows are validated and inserted in batches with executemany, invalid rows are skipped.
+    Holdings, state snapshots and the balance are rebuilt once after the last batch.
+
+    :param stream: text file object positioned at the CSV header
+    :return: dict summary of the import, or an error message string
+    """
+    portfolio_id = get_portfolio_id(conn, portfolio_name)
+    if not portfolio_id:
+        return f'Portfolio {portfolio_name} not found.'
+
+    reader = csv.DictReader(stream)
+    columns = {name.strip().lower() for name in reader.fieldnames or []}
+    missing = REQUIRED_COLUMNS - columns
+    if missing:
+        return f"Missing CSV columns: {', '.join(sorted(missing))}"
+
+    # normalize header names so ' Symbol' and 'symbol' both work
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+
+    start = time.perf_counter()
+    imported = 0
+    errors = []
+    error_count = 0
+
+    rows = enumerate(reader, start=2)
+    cur = conn.cursor()
+
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+
+            valid, batch_errors = validate_batch(portfolio_id, batch)
+
+            cur.executemany('''
+                            INSERT INTO transactions (portfolio_id, symbol, sector, operation, shares, price_per_share, total_price, timestamp)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                            ''', valid
+            )
+
+            imported += len(valid)
+            error_count += len(batch_errors)
+            errors.extend(batch_errors[:MAX_REPORTED_ERRORS - len(errors)])
+
+        timestamp = dt.datetime.now().strftime('%Y-%m-%d %H:%M')
+        rebuild_holdings(conn, portfolio_id, commit=False)
+        # imported rows may predate existing trades, so snapshots after them are stale
+        rebuild_state_snapshots(conn, portfolio_id, commit=False)
+        new_balance = rebuild_balance(conn, portfolio_id, timestamp, commit=False)
+
+        conn.commit()
+
+    except Exception:
+        conn.rollback()
+        raise
+
+    seconds = time.perf_counter() - start
+
+    return {
+        'portfolio_name': portfolio_name,
+        'imported': imported,
+        'skipped': error_count,
+        'errors': errors,
+        'new_balance': new_balance,
+        'seconds': seconds,
+        'rows_per_second': imported / seconds if seconds else 0.0,
+    }
+
+def main():
+    from src.portfolios.database.connection import get_portfolio_connection
+    from src.portfolios.database.schema import create_database_schema
+
+    parser = argparse.ArgumentParser(description='Bulk import historical trades into a portfolio.')
+    parser.add_argument('portfolio_name')
+    parser.add_argument('csv_path')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    conn = get_portfolio_connection()
+    create_database_schema(conn)
+
+    try:
+        with open(args.csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+            result = import_trades(conn, args.portfolio_name, f, batch_size=args.batch_size)
+    finally:
+        conn.close()
+
+    if isinstance(result, str):
+        print(result)
+        return
+
+    print(f"Imported {result['imported']:,} trades into {result['portfolio_name']} "
+          f"in {result['seconds']:.2f}s ({result['rows_per_second']:,.0f} rows/s).")
+    print(f"Skipped {result['skipped']:,} invalid rows. New balance: ${result['new_balance']:,.2f}")
+    for line_number, error in result['errors']:
+        print(f'  line {line_number}: {error}')
+
+if __name__ == '__main__':
+    main()
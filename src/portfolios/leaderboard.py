@@ -0,0 +1,120 @@
+# Cross-portfolio leaderboard.
+# Every portfolio is valued in one pass: one query for all balances and holdings, one price fetch
+# for the union of held symbols and a NumPy valuation that sums holding values per portfolio.
+# Drawdowns come from the daily value snapshots with a single window-function query.
+
+import numpy as np
+
+from src.stock_data import get_batch_prices
+
+LEADERBOARD_SORTS = {
+    'return': ('total_return', True),
+    'value': ('total_value', True),
+    'drawdown': ('max_drawdown', True),
+}
+
+def _load_positions(conn):
+    """Get (portfolio_id, name, initial_balance, current_balance, symbol, shares) rows for every portfolio, one per holding."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT p.portfolio_id, p.name, p.initial_balance, p.current_balance, h.symbol, h.shares
+                FROM portfolios p
+                LEFT JOIN holdings h ON h.portfolio_id = p.portfolio_id AND h.shares > 0
+                ORDER BY p.portfolio_id
+                ''')
+
+    return cur.fetchall()
+
+def get_max_drawdowns(conn):
+    """Largest peak-to-trough fall of each portfolio's daily value snapshots. Returns {portfolio_id: drawdown}."""
+    cur = conn.cursor()
+    cur.execute('''
+                SELECT portfolio_id, MIN(low / peak - 1)
+                FROM (
+                    SELECT
+                    portfolio_id,
+                    low,
+                    MAX(high) OVER (PARTITION BY portfolio_id ORDER BY bucket ROWS UNBOUNDED PRECEDING) AS peak
+                    FROM portfolio_snapshots
+                    WHERE resolution = '1d'
+                )
+                WHERE peak > 0
+                GROUP BY portfolio_id
+                ''')
+
+    return dict(cur.fetchall())
+
+def value_all_portfolios(rows, prices):
+    """
+    Value every portfolio from its position rows and one price map.
+
+    :param rows: rows from _load_positions
+    :param prices: dict of symbol to price
+    :return: (portfolio_ids, names, initial_balances, balances, holdings_values) as aligned arrays
+    """
+    portfolio_ids = []
+    names = []
+    initial_balances = []
+    balances = []
+    row_portfolio = np.empty(len(rows), dtype=np.int64)
+
+    for i, (portfolio_id, name, initial_balance, balance, _, _) in enumerate(rows):
+        if not portfolio_ids or portfolio_ids[-1] != portfolio_id:
+            portfolio_ids.append(portfolio_id)
+            names.append(name)
+            initial_balances.append(initial_balance)
+            balances.append(balance)
+        row_portfolio[i] = len(portfolio_ids) - 1
+
+    shares = np.array([row[5] or 0 for row in rows], dtype=float)
+    row_prices = np.array([prices.get(row[4], 0) if row[4] else 0 for row in rows], dtype=float)
+
+    holdings_values = np.bincount(row_portfolio, weights=shares * row_prices, minlength=len(portfolio_ids))
+
+    return portfolio_ids, names, np.array(initial_balances, dtype=float), np.array(balances, dtype=float), holdings_values
+
+def portfolio_leaderboard(conn, sort_by='return', prices=None):
+    """
+    Rank every portfolio by total return, total value or max drawdown.
+    Portfolios without daily snapshots have a max_drawdown of None and rank last by drawdown.
+
+    :param prices: optional dict of symbol to price, fetched for the union of held symbols when not provided
+    :return: list of dicts ordered best first, or an error message string
+    """
+    if sort_by not in LEADERBOARD_SORTS:
+        return f"Invalid sort. Valid sorts are: {', '.join(LEADERBOARD_SORTS)}"
+
+    rows = _load_positions(conn)
+    if not rows:
+        return 'No portfolios found.'
+
+    if prices is None:
+        symbols = sorted({row[4] for row in rows if row[4]})
+        prices = get_batch_prices(symbols) if symbols else {}
+
+    portfolio_ids, names, initial_balances, balances, holdings_values = value_all_portfolios(rows, prices)
+
+    total_values = balances + holdings_values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_returns = np.where(initial_balances > 0, total_values / initial_balances - 1, 0.0)
+
+    drawdowns = get_max_drawdowns(conn)
+
+    leaderboard = [
+        {
+            'name': name,
+            'total_value': float(total_value),
+            'holdings_value': float(holdings_value),
+            'total_return': float(total_return),
+            # None without daily snapshots, e.g. portfolios never registered with the scheduler
+            'max_drawdown': float(drawdowns[portfolio_id]) if portfolio_id in drawdowns else None,
+        }
+        for portfolio_id, name, total_value, holdings_value, total_return
+        in zip(portfolio_ids, names, total_values, holdings_values, total_returns)
+    ]
+
+    key, descending = LEADERBOARD_SORTS[sort_by]
+    ranked = sorted((entry for entry in leaderboard if entry[key] is not None), key=lambda entry: entry[key], reverse=descending)
+
+    # portfolios without a value for the sort rank last
+    return ranked + [entry for entry in leaderboard if entry[key] is None]
@@ -0,0 +1,139 @@
+# Incremental mark-to-market of the registered portfolios.
+# The engine keeps every holding marked at its last price with per-portfolio running totals,
+# and an index of which portfolios hold each symbol. A price tick only revalues the holdings of
+# symbols whose price changed and adjusts their portfolio totals by the difference, so reading a
+# portfolio's value or P&L is O(1) no matter how many holdings it has.
+# Each tick returns the per-portfolio value changes to the scheduler, which sends alerts from them.
+
+import threading
+from collections import defaultdict
+
+class MarkToMarketEngine:
+    """Marked holdings and running totals of a set of portfolios, safe to use from worker threads."""
+
+    def __init__(self):
+        self._prices = {}
+        # portfolio_id -> {symbol: [shares, cost_basis, value]}, in holdings order
+        self._holdings = {}
+        # portfolio_id -> [balance, holdings_value, cost_basis]
+        self._totals = {}
+        # symbol -> ids of the portfolios holding it
+        self._holders = defaultdict(set)
+        # (balance, holdings rows) each portfolio was loaded from, so unchanged portfolios are skipped on sync
+        self._sources = {}
+        self._lock = threading.Lock()
+
+    def _drop(self, portfolio_id):
+        for symbol in self._holdings.pop(portfolio_id, {}):
+            holders = self._holders[symbol]
+            holders.discard(portfolio_id)
+            if not holders:
+                del self._holders[symbol]
+
+        self._totals.pop(portfolio_id, None)
+        self._sources.pop(portfolio_id, None)
+
+    def _load(self, portfolio_id, balance, rows):
+        self._drop(portfolio_id)
+
+        marks = {}
+        for symbol, _, shares, cost_basis in rows:
+            marks[symbol] = [shares, cost_basis, shares * self._prices.get(symbol, 0)]
+            self._holders[symbol].add(portfolio_id)
+
+        self._holdings[portfolio_id] = marks
+        self._totals[portfolio_id] = [
+            balance,
+            sum(mark[2] for mark in marks.values()),
+            sum(mark[1] for mark in marks.values()),
+        ]
+
+    def sync(self, portfolios, holdings):
+        """
+        Bring the engine in line with the current portfolios, re-marking only the ones whose
+        balance or holdings changed (e.g. after a trade) and dropping the ones no longer present.
+
+        :param portfolios: {portfolio_id: (name, balance)}
+        :param holdings: {portfolio_id: [(symbol, sector, shares, cost_basis)]}
+        :return: number of portfolios reloaded
+        """
+        reloaded = 0
+
+        with self._lock:
+            for portfolio_id in set(self._holdings) - set(portfolios):
+                self._drop(portfolio_id)
+
+            for portfolio_id, (_, balance) in portfolios.items():
+                rows = holdings.get(portfolio_id, [])
+                source = (balance, tuple(rows))
+
+                if self._sources.get(portfolio_id) != source:
+                    self._load(portfolio_id, balance, rows)
+                    self._sources[portfolio_id] = source
+                    reloaded += 1
+
+        return reloaded
+
+    def update_prices(self, prices):
+        """
+        Re-mark the holdings of every symbol whose price changed.
+
+        :param prices: dict of symbol to price, symbols with an unchanged price are skipped
+        :return: {portfolio_id: change in holdings value} of the portfolios affected by the tick
+        """
+        deltas = defaultdict(float)
+
+        with self._lock:
+            changed = {symbol: price for symbol, price in prices.items() if self._prices.get(symbol) != price}
+
+            for symbol, price in changed.items():
+                self._prices[symbol] = price
+
+                for portfolio_id in self._holders.get(symbol, ()):
+                    mark = self._holdings[portfolio_id][symbol]
+                    value = mark[0] * price
+                    delta = value - mark[2]
+
+                    mark[2] = value
+                    self._totals[portfolio_id][1] += delta
+                    deltas[portfolio_id] += delta
+
+        return dict(deltas)
+
+    def totals(self, portfolio_id):
+        """Current (balance, holdings_value, unrealized_pnl) of a portfolio, or None if it is not marked."""
+        with self._lock:
+            totals = self._totals.get(portfolio_id)
+            if totals is None:
+                return None
+
+            balance, holdings_value, cost_basis = totals
+            return balance, holdings_value, holdings_value - cost_basis
+
+    def values(self):
+        """Current {portfolio_id: (balance, holdings_value)} of every marked portfolio."""
+        with self._lock:
+            return {portfolio_id: (totals[0], totals[1]) for portfolio_id, totals in self._totals.items()}
+
+    def holdings(self, portfolio_id, symbols=None):
+        """
+        Marked holdings of a portfolio, optionally only the given symbols.
+
+        :return: list of (symbol, shares, cost_basis, price, value) with price None if the symbol has no price yet
+        """
+        with self._lock:
+            marks = self._holdings.get(portfolio_id, {})
+            if symbols is not None:
+                marks = {symbol: marks[symbol] for symbol in marks if symbol in symbols}
+
+            return [
+                (symbol, shares, cost_basis, self._prices.get(symbol), value)
+                for symbol, (shares, cost_basis, value) in marks.items()
+            ]
+
+    def price(self, symbol):
+        """Last marked price of a symbol, or None."""
+        with self._lock:
+            return self._prices.get(symbol)
+
+mark_engine = MarkToMarketEngine()
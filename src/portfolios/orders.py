@@ -0,0 +1,151 @@
+# Conditional orders (limit, stop and take-profit) matched against price ticks.
+# Open orders live in the orders table and are mirrored into an in-memory book that keeps two
+# sorted trigger arrays per symbol: orders that trigger when the price falls to their level and
+# orders that trigger when it rises to it. Each array is keyed so its triggered orders are always
+# a suffix, so a tick finds and removes them with one bisect in O(log n + k) without scanning.
+#
+# Fills go through fill_order, which writes them with record_trade like market orders.
+
+import threading
+from bisect import bisect_left, insort
+
+from src.portfolios.database.procedures import create_order
+
+ORDER_TYPES = {
+    'limit': 'LIMIT',
+    'stop': 'STOP',
+    'takeprofit': 'TAKE_PROFIT',
+}
+
+# (operation, order_type) -> whether the order triggers when the price falls to its level ('below')
+# or rises to it ('above')
+TRIGGERS = {
+    ('BUY', 'LIMIT'): 'below',
+    ('SELL', 'LIMIT'): 'above',
+    ('BUY', 'STOP'): 'above',
+    ('SELL', 'STOP'): 'below',
+    ('SELL', 'TAKE_PROFIT'): 'above',
+}
+
+def _key(side, price):
+    # 'above' orders are keyed by the negated level so their triggered orders are a suffix too
+    return price if side == 'below' else -price
+
+class OrderBook:
+    """Open orders indexed per symbol by trigger level, safe to use from worker threads."""
+
+    def __init__(self):
+        # symbol -> {side: sorted [(key, order_id)]}
+        self._levels = {}
+        # order_id -> order row (order_id, portfolio_id, symbol, operation, order_type, trigger_price, shares)
+        self._orders = {}
+        self._lock = threading.Lock()
+
+    def _insert(self, order):
+        order_id, _, symbol, operation, order_type, trigger_price, _ = order
+        side = TRIGGERS[(operation, order_type)]
+
+        levels = self._levels.setdefault(symbol, {'below': [], 'above': []})
+        insort(levels[side], (_key(side, trigger_price), order_id))
+        self._orders[order_id] = order
+
+    def load(self, orders):
+        """Replace the book with the given open order rows, e.g. from get_open_orders."""
+        with self._lock:
+            self._levels = {}
+            self._orders = {}
+
+            for order in orders:
+                self._insert(order)
+
+    def add(self, order):
+        with self._lock:
+            self._insert(order)
+
+    def remove(self, order_id):
+        """Drop an order from the book, e.g. after it was cancelled. Returns True if it was in the book."""
+        with self._lock:
+            order = self._orders.pop(order_id, None)
+            if order is None:
+                return False
+
+            _, _, symbol, operation, order_type, trigger_price, _ = order
+            side = TRIGGERS[(operation, order_type)]
+            levels = self._levels[symbol][side]
+
+            entry = (_key(side, trigger_price), order_id)
+            i = bisect_left(levels, entry)
+            if i < len(levels) and levels[i] == entry:
+                del levels[i]
+
+            return True
+
+    def symbols(self):
+        """Symbols with open orders, whose prices the scheduler has to fetch."""
+        with self._lock:
+            return [symbol for symbol, levels in self._levels.items() if levels['below'] or levels['above']]
+
+    def match(self, prices):
+        """
+        Take every order triggered by the given prices out of the book.
+
+        :param prices: dict of symbol to price
+        :return: list of (order, price) for the triggered orders
+        """
+        triggered = []
+
+        with self._lock:
+            for symbol, price in prices.items():
+                levels = self._levels.get(symbol)
+                if not levels or not price:
+                    continue
+
+                for side, entries in levels.items():
+                    # (key,) sorts before every (key, order_id), so this is the first triggered entry
+                    start = bisect_left(entries, (_key(side, price),))
+
+                    for _, order_id in entries[start:]:
+                        triggered.append((self._orders.pop(order_id), price))
+                    del entries[start:]
+
+        return triggered
+
+    def __len__(self):
+        return len(self._orders)
+
+order_book = OrderBook()
+
+def validate_order(operation, order_type, shares, trigger_price):
+    """
+    Check the parameters of a conditional order before it is quoted.
+
+    :param operation: 'BUY' or 'SELL'
+    :param order_type: 'limit', 'stop' or 'takeprofit'
+    :return: an error message string, or None if the order is valid
+    """
+    if order_type.lower() not in ORDER_TYPES:
+        return f"Invalid order type. Valid types are: {', '.join(ORDER_TYPES)}"
+
+    if (operation, ORDER_TYPES[order_type.lower()]) not in TRIGGERS:
+        return f'{order_type} orders can only sell.'
+
+    if shares <= 0 or trigger_price <= 0:
+        return 'Shares and trigger price must be positive.'
+
+    return None
+
+def place_order(conn, trade, order_type, trigger_price):
+    """
+    Store a validated conditional order and add it to the order book.
+
+    :param trade: trade dict from quote_trade, which supplies the symbol's sector for the fill
+    :param order_type: 'limit', 'stop' or 'takeprofit'
+    :return: the order row
+    """
+    order = create_order(
+        conn, trade['portfolio_id'], trade['symbol'], trade['sector'], trade['operation'],
+        ORDER_TYPES[order_type.lower()], trigger_price, float(trade['shares'])
+    )
+    order_book.add(order)
+
+    return order
@@ -1,17 +1,40 @@
+import io
+import asyncio
+import datetime as dt
 import discord
 from discord.ext import commands, tasks
 import sqlite3 as sq
 
-from src.config.storage import load_portfolio, save_portfolio
 from src.portfolios.database.procedures import *
 from src.portfolios.portfolio_logic import *
-from src.config.utils import is_market_open, is_weekend, stock_changes
-from src.news import embed_format, get_news_update
+from src.portfolios.importer import import_trades
+from src.portfolios.analytics import portfolio_risk
+from src.portfolios.simulation import MAX_HORIZON, portfolio_var, get_simulation_pool
+from src.portfolios.database.history import get_state_as_of, rebuild_state_snapshots
+from src.portfolios.database.snapshots import PERFORMANCE_RANGES, get_snapshots, rollup_snapshots
+from src.portfolios.correlation import portfolio_correlation
+from src.portfolios.backtest import STRATEGIES, backtest
+from src.portfolios.leaderboard import LEADERBOARD_SORTS, portfolio_leaderboard
+from src.portfolios.views import view_cache
+from src.portfolios.orders import validate_order, place_order, order_book
+from src.stock_data import get_batch_prices
+from src.discord.pagination import LazyPaginator
+from src.charts import create_performance_graph, create_correlation_heatmap, create_equity_curve_graph
+from src.config.utils import is_market_open, is_weekend
+
+# holdings per page, so a page with a sector header for every holding stays within Discord's 25 fields
+HOLDINGS_PAGE_SIZE = 12
+
+def setup_portfolio_commands(bot, pool, writer):
+    """
+    Setup portfolio commands.
 
-ACTIVE_TASKS = {}
+    Reads run on worker threads through the pool's read-only connections,
+    trades go through the writer thread and other writes through the pool's writer.
 
-def setup_portfolio_commands(bot, conn):
-    """Setup portfolio commands."""
+    :param pool: ConnectionPool for the portfolio database
+    :param writer: PortfolioWriter that applies trades off the event loop
+    """
 
     @bot.command()
     async def create(ctx, portfolio_name: str, initial_balance: float):
@@ -23,7 +46,7 @@ def setup_portfolio_commands(bot, conn):
         """
 
         try:
-            portfolio = create_portfolio(conn, portfolio_name, initial_balance)
+            portfolio = await asyncio.to_thread(pool.run_write, create_portfolio, portfolio_name, initial_balance)
 
             if portfolio is None:
                 await ctx.send(f'portfolio {portfolio_name} already exists')
@@ -43,7 +66,7 @@ def setup_portfolio_commands(bot, conn):
         !balance <portfolio_name>
         """
         try:
-            balance = portfolio_balance(conn, portfolio_name)
+            balance = await asyncio.to_thread(pool.run_read, portfolio_balance, portfolio_name)
 
             await ctx.send(f'Portfolio {portfolio_name} balance: {balance["balance"]}')
         
@@ -59,7 +82,8 @@ def setup_portfolio_commands(bot, conn):
         !rename <old_name> <new_name>
         """
         try:
-            result = update_portfolio_name(conn, old_name, new_name)
+            result = await asyncio.to_thread(pool.run_write, update_portfolio_name, old_name, new_name)
+            view_cache.invalidate(old_name, new_name)
 
             await ctx.send(result)
 
@@ -76,7 +100,10 @@ def setup_portfolio_commands(bot, conn):
             """
 
             try:
-                deleted_rows = delete_portfolio(conn, portfolio_name)
+                deleted_rows = await asyncio.to_thread(pool.run_write, delete_portfolio, portfolio_name)
+                view_cache.invalidate(portfolio_name)
+                # the portfolio's open orders were deleted with it
+                order_book.load(await asyncio.to_thread(pool.run_read, get_open_orders))
 
                 if deleted_rows == 0:
                     await ctx.send(f'Portfolio {portfolio_name} does not exist.')
@@ -89,59 +116,125 @@ def setup_portfolio_commands(bot, conn):
                 await ctx.send(f'Error deleting portfolio')
                 print(e)
 
+    def holdings_paginator(ctx, portfolio_name, state, title, show_realized=False, describe=None):
+        """
+        Paginate a portfolio's holdings, pricing only the symbols of the page being rendered.
+
+        :param state: dict from portfolio_holdings
+        """
+
+        async def render_page(rows, page, pages):
+            # a fresh cached view already has every price, otherwise fetch this page's
+            view = view_cache.peek(portfolio_name)
+            if view is not None:
+                prices = view['prices']
+            else:
+                prices = await asyncio.to_thread(get_batch_prices, [row[0].upper() for row in rows])
+
+            page_data = build_portfolio_data(portfolio_name, state['balance'], rows, state['realized'], prices)
+
+            embed = discord.Embed(
+                title=title,
+                color=discord.Color.blue()
+            )
+
+            for sector, holdings_list in page_data['current_holdings'].items():
+
+                embed.add_field(
+                    name=f'Sector: {sector}',
+                    value='\u200b',
+                    inline=False
+                )
+                for holdings in holdings_list:
+                    if 'total_value' not in holdings:
+                        embed.add_field(
+                            name=holdings['symbol'],
+                            value=f'''
+                            Shares: {holdings["shares"]}
+                            Initial Value: {holdings["initial_value"]}
+                            (Current price unavailable.)
+                            ''',
+                            inline=True
+                        )
+                    else:
+                        realized = f"Realized: {holdings['realized_returns']}" if show_realized else ''
+                        embed.add_field(
+                            name=holdings['symbol'],
+                            value=f'''
+                            Price: {holdings["price"]}
+                            Shares: {holdings["shares"]}
+                            Initial Value: {holdings["initial_value"]}
+                            Total Value: {holdings['total_value']}
+                            Returns: {holdings['returns']}
+                            {realized}
+                            ''',
+                            inline=True
+                        )
+
+            return embed
+
+        return LazyPaginator(ctx.author.id, state['holdings'], render_page, page_size=HOLDINGS_PAGE_SIZE, describe=describe)
+
     @bot.command()
     async def summary(ctx, portfolio_name: str):
         """
         View portfolio details.
 
+        The first page of holdings is sent as soon as its prices are fetched. The portfolio
+        totals need every price, so unless a cached valuation is fresh they are filled in
+        once the whole portfolio has been valued in the background.
+
         Command:
         !summary <portfolio_name>
         """
 
-        summary_data = portfolio_data(conn, portfolio_name)
-        
-        
-        embed = discord.Embed(
-            title=f'Portfolio Summary: {summary_data["name"]}',
-            description=f'''
+        state = await asyncio.to_thread(pool.run_read, portfolio_holdings, portfolio_name)
+
+        if isinstance(state, str):
+            await ctx.send(state)
+            return
+
+        view = view_cache.peek(portfolio_name)
+        totals = {'data': view['data'] if view is not None else None}
+
+        def describe():
+            summary_data = totals['data']
+            if summary_data is None:
+                return f'''
+            Current Balance: ${state['balance']:,.2f}
+            Realized P&L: ${sum(state['realized'].values()):,.2f}
+            (Valuing holdings...)
+            '''
+
+            return f'''
             Current Balance: {summary_data['balance']}
             Total Holdings Value: {summary_data['total_holdings_value']}
             Total Portfolio Value: {summary_data['total_value']}
             Total Returns: {summary_data['total_returns']}
-            ''',
-            color = discord.Color.blue()
+            Unrealized P&L: {summary_data['unrealized_returns']}
+            Realized P&L: {summary_data['realized_returns']}
+            '''
+
+        paginator = holdings_paginator(
+            ctx, portfolio_name, state, f'Portfolio Summary: {portfolio_name}', show_realized=True, describe=describe
         )
 
-        embed.add_field(name='\u200b', value='\u200b', inline=False)
-        embed.add_field(name='Holdings:', value='\u200b', inline=False)
+        async def value_portfolio():
+            summary_data = await asyncio.to_thread(pool.run_read, view_cache.portfolio_data, portfolio_name)
+            if isinstance(summary_data, str):
+                return
 
-        for sector, holdings_list in summary_data['current_holdings'].items():
+            totals['data'] = summary_data
+            await paginator.redraw()
 
-            embed.add_field(
-                name=f'Sector: {sector}',
-                value='\u200b',
-                inline=False
-            )
-            for holdings in holdings_list:
-                if 'total_value' not in holdings:
-                    embed.add_field(
-                        name=holdings['symbol'],
-                        value=f'''
-                        Shares: {holdings["shares"]}
-                        Initial Value: {holdings["initial_value"]}
-                        (Current price unavailable.)
-                    ''', inline=True)
-                else:  
-                    embed.add_field(
-                        name=holdings['symbol'],
-                        value=f'''
-                        Price: {holdings["price"]}
-                        Shares: {holdings["shares"]}
-                        Initial Value: {holdings["initial_value"]}
-                        Total Value: {holdings['total_value']}
-                        Returns: {holdings['returns']}''', inline=True)
+        if totals['data'] is None:
+            # runs alongside the first page's fetch, the totals are patched into the sent message
+            paginator.run_in_background(value_portfolio())
 
-        await ctx.send(embed=embed)
+        try:
+            await paginator.send(ctx)
+        except Exception as e:
+            await ctx.send(f'Error retrieving summary for {portfolio_name}: {e}')
 
     @bot.command()
     async def assets(ctx, portfolio_name: str):
@@ -151,7 +244,11 @@ def setup_portfolio_commands(bot, conn):
         Command: !assets <portfolio_name>
         """
         try:
-            asset_metrics = get_asset_weights(conn, portfolio_name)
+            asset_metrics = await asyncio.to_thread(pool.run_read, view_cache.asset_weights, portfolio_name)
+
+            if isinstance(asset_metrics, str):
+                await ctx.send(asset_metrics)
+                return
 
             description = f''
             for asset_name, metrics in asset_metrics.items():
@@ -174,54 +271,81 @@ def setup_portfolio_commands(bot, conn):
             await ctx.send(f'Error retrieving asset data for {portfolio_name}: {e}')
 
     @bot.command()
-    async def holdings(ctx, portfolio_name: str):
+    async def holdings(ctx, portfolio_name: str, *options):
         """
-        View portfolio holdings
-        
-        :param ctx: Description
-        :param portfolio_name: Description
-        :type portfolio_name: str
+        View portfolio holdings, or the holdings and balance it had at a past date.
+
+        Command:
+        !holdings <portfolio_name> [--as-of <YYYY-MM-DD> [HH:MM]]
         """
+        if options:
+            if options[0] != '--as-of' or len(options) < 2:
+                await ctx.send('Usage: !holdings <portfolio_name> [--as-of <YYYY-MM-DD> [HH:MM]]')
+                return
 
-        holdings_data = portfolio_data(conn, portfolio_name)
+            await holdings_as_of(ctx, portfolio_name, ' '.join(options[1:3]))
+            return
 
-        embed = discord.Embed(
-            title=f'Portfolio Holdings: {portfolio_name}',
-            color=discord.Color.blue()
-        )
+        state = await asyncio.to_thread(pool.run_read, portfolio_holdings, portfolio_name)
 
-        for sector, holdings_list in holdings_data['current_holdings'].items():
-            
-            embed.add_field(
-                name=f'Sector: {sector}',
-                value='\u200b',
-                inline=False
+        if isinstance(state, str):
+            await ctx.send(state)
+            return
+
+        try:
+            await holdings_paginator(ctx, portfolio_name, state, f'Portfolio Holdings: {portfolio_name}').send(ctx)
+        except Exception as e:
+            await ctx.send(f'Error retrieving holdings for {portfolio_name}: {e}')
+
+    async def holdings_as_of(ctx, portfolio_name, date_text):
+        """Send the holdings and balance of a portfolio at the end of a past date, or at a past minute."""
+        try:
+            if len(date_text) <= 10:
+                as_of = dt.datetime.strptime(date_text, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
+            else:
+                as_of = dt.datetime.strptime(date_text, '%Y-%m-%d %H:%M').replace(second=59)
+        except ValueError:
+            await ctx.send('Invalid date. Use YYYY-MM-DD or YYYY-MM-DD HH:MM.')
+            return
+
+        portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+        if not portfolio_id:
+            await ctx.send(f"Portfolio '{portfolio_name}' not found.")
+            return
+
+        try:
+            balance, holdings = await asyncio.to_thread(
+                pool.run_read, get_state_as_of, portfolio_id, as_of.strftime('%Y-%m-%d %H:%M:%S')
             )
-            for holdings in holdings_list:
-                if 'total_value' not in holdings:
-                    embed.add_field(
-                        name=holdings['symbol'],
-                        value=f'''
-                        Shares: {holdings["shares"]}
-                        Initial Value: {holdings["initial_value"]}
-                        (Current price unavailable.)
-                        ''',
-                        inline=True
-                    )
-                else:  
-                    embed.add_field(
-                        name=holdings['symbol'],
-                        value=f'''
-                        Price: {holdings["price"]}
-                        Shares: {holdings["shares"]}
-                        Initial Value: {holdings["initial_value"]}
-                        Total Value: {holdings['total_value']}
-                        Returns: {holdings['returns']} 
-                        ''',
-                        inline=True
-                    )
-        
-        await ctx.send(embed=embed)
+
+            embed = discord.Embed(
+                title=f'Portfolio Holdings: {portfolio_name}',
+                description=f'''
+                As of: {as_of:%Y-%m-%d %H:%M}
+                Balance: ${balance:,.2f}
+                Cost Basis: ${sum(row[3] for row in holdings):,.2f}
+                ''',
+                color=discord.Color.blue()
+            )
+
+            if not holdings:
+                embed.add_field(name='No holdings', value='\u200b', inline=False)
+
+            for symbol, sector, shares, cost_basis in holdings[:25]:
+                embed.add_field(
+                    name=symbol,
+                    value=f'''
+                    Sector: {sector}
+                    Shares: {shares:g}
+                    Initial Value: ${cost_basis:,.2f}
+                    ''',
+                    inline=True
+                )
+
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error reconstructing holdings for {portfolio_name}: {e}')
 
     @bot.command()
     async def buy(ctx, portfolio_name: str, symbol, shares):
@@ -241,7 +365,19 @@ def setup_portfolio_commands(bot, conn):
             await ctx.send(f'Market is closed. Cannot execute buy order for {symbol}.')
             return
 
-        details = buy_stock(conn, portfolio_name, symbol, shares)
+        trade = await asyncio.to_thread(pool.run_read, quote_trade, portfolio_name, symbol, shares, 'BUY')
+        if isinstance(trade, str):
+            await ctx.send(trade)
+            return
+
+        try:
+            new_balance = await asyncio.wrap_future(writer.submit(execute_trade, trade))
+            view_cache.invalidate(portfolio_name)
+        except Exception as e:
+            await ctx.send(f'Error executing buy order for {symbol}: {e}')
+            return
+
+        details = trade_result(trade, new_balance)
 
         embed = discord.Embed(
             title=f'Bought {shares} shares of {symbol} for portfolio: {portfolio_name}\nAsset Type: {details["asset_type"]}',
@@ -273,7 +409,19 @@ def setup_portfolio_commands(bot, conn):
             await ctx.send(f'Market is closed. Cannot execute sell order for {symbol} {is_market_open(symbol)}.')
             return
         
-        details = sell_stock(conn, portfolio_name, symbol, shares)
+        trade = await asyncio.to_thread(pool.run_read, quote_trade, portfolio_name, symbol, shares, 'SELL')
+        if isinstance(trade, str):
+            await ctx.send(trade)
+            return
+
+        try:
+            new_balance = await asyncio.wrap_future(writer.submit(execute_trade, trade))
+            view_cache.invalidate(portfolio_name)
+        except Exception as e:
+            await ctx.send(f'Error executing sell order for {symbol}: {e}')
+            return
+
+        details = trade_result(trade, new_balance)
 
         embed = discord.Embed(
             title=f'Sold {shares} shares of {symbol} for portfolio: {portfolio_name}\nAsset Type: {details["asset_type"]}',
@@ -291,307 +439,535 @@ def setup_portfolio_commands(bot, conn):
         await ctx.send(embed=embed)
 
     @bot.command()
-    async def tasks(ctx, portfolio_name: str):
+    async def order(ctx, portfolio_name: str, operation: str, symbol: str, shares: float, order_type: str, trigger_price: float):
         """
-        Register a portfolio for periodic reports and alerts.
+        Place a conditional order that fills once a scheduler price tick reaches its trigger price.
+        Limit orders buy at or below / sell at or above the price, stop orders buy at or above /
+        sell at or below it and take-profit orders sell at or above it.
 
         Command:
-        !tasks <portfolio_name>
+        !order <portfolio_name> <buy|sell> <stock_symbol> <amount_of_shares> <limit|stop|takeprofit> <trigger_price>
         """
+        operation = operation.upper()
+        if operation not in ('BUY', 'SELL'):
+            await ctx.send('Operation must be buy or sell.')
+            return
 
-        if not get_portfolio_id(conn, portfolio_name):
-            await ctx.send(f'Portfolio {portfolio_name} not found. Please create the portfolio before registering for tasks.')
+        error = validate_order(operation, order_type, shares, trigger_price)
+        if error:
+            await ctx.send(error)
             return
-        
-        registered = load_portfolio()
-        if registered == portfolio_name:
-            await ctx.send(f'Portfolio {portfolio_name} is already registered for tasks.')
+
+        trade = await asyncio.to_thread(pool.run_read, quote_trade, portfolio_name, symbol, shares, operation)
+        if isinstance(trade, str):
+            await ctx.send(trade)
             return
-        
+
         try:
-            task_funcs = setup_portfolio_tasks(bot, conn, portfolio_name)
-            task_funcs['portfolio_market_open_report'].start()
-            task_funcs['portfolio_changes'].start()
+            order_id, *_ = await asyncio.to_thread(pool.run_write, place_order, trade, order_type, trigger_price)
+        except Exception as e:
+            await ctx.send(f'Error placing order for {symbol}: {e}')
+            return
 
-            ACTIVE_TASKS[portfolio_name] = task_funcs
+        embed = discord.Embed(
+            title=f'Order {order_id} placed for portfolio: {portfolio_name}',
+            description=f'''
+            Operation: {operation}
+            Symbol: {trade['symbol']}
+            Shares: {shares:g}
+            Type: {order_type.lower()} at ${trigger_price:,.2f}
+            Current Price: ${trade['price_per_share']:,.2f}
+            ''',
+            color=discord.Color.blue()
+        )
 
-            save_portfolio(portfolio_name)
+        await ctx.send(embed=embed)
 
-            if task_funcs:
-                await ctx.send(f'Portfolio {portfolio_name} registered for periodic reports and alerts.')
-            else:
-                await ctx.send(f'Internal error setting up tasks for portfolio {portfolio_name}.')
+    @bot.command()
+    async def orders(ctx, portfolio_name: str):
+        """
+        List the open conditional orders of a portfolio.
 
-        except Exception as e:
-            await ctx.send(f'Error setting up tasks for portfolio {portfolio_name}.')
-            print(f"Error starting tasks for portfolio '{portfolio_name}': {e}")
-
-def setup_portfolio_tasks(bot, conn, portfolio_name):
-    """Setup portfolio-related background tasks."""
-    
-    from src.config.config import CHANNEL_ID, TIMEZONE
-    from src.stock_data import check_price_changes, get_batch_prices
-    from datetime import datetime as dt
-
-    if not portfolio_name:
-        print('No portfolio name provided for task setup.')
-        return None
-    
-    @tasks.loop(hours=24)
-    async def portfolio_market_open_report():
+        Command:
+        !orders <portfolio_name>
         """
-        Send a market open report for a specific portfolio.
-        
-        :param portfolio_name: Description
+        portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+        if not portfolio_id:
+            await ctx.send(f'Portfolio {portfolio_name} not found.')
+            return
+
+        open_orders = await asyncio.to_thread(pool.run_read, get_open_orders, portfolio_id)
+        if not open_orders:
+            await ctx.send(f'Portfolio {portfolio_name} has no open orders.')
+            return
+
+        embed = discord.Embed(
+            title=f'Open Orders for {portfolio_name}',
+            color=discord.Color.blue()
+        )
+
+        for order_id, _, symbol, operation, order_type, trigger_price, shares in open_orders[:25]:
+            embed.add_field(
+                name=f'{order_id}: {operation} {shares:g} {symbol}',
+                value=f'{order_type} at ${trigger_price:,.2f}',
+                inline=True
+            )
+
+        if len(open_orders) > 25:
+            embed.set_footer(text=f'Showing 25 of {len(open_orders)} orders')
+
+        await ctx.send(embed=embed)
+
+    @bot.command()
+    async def cancel(ctx, portfolio_name: str, order_id: int):
         """
+        Cancel an open conditional order.
 
-        await bot.wait_until_ready()
+        Command:
+        !cancel <portfolio_name> <order_id>
+        """
+        portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+        if not portfolio_id:
+            await ctx.send(f'Portfolio {portfolio_name} not found.')
+            return
 
-        time_now = dt.now(TIMEZONE)
-        
-        if time_now.hour != 9 or (time_now.hour == 9 and (time_now.minute < 30 and time_now.minute >=40)):
+        if await asyncio.to_thread(pool.run_write, cancel_order, portfolio_id, order_id):
+            order_book.remove(order_id)
+            await ctx.send(f'Order {order_id} cancelled.')
+        else:
+            await ctx.send(f'Portfolio {portfolio_name} has no open order {order_id}.')
+
+    @bot.command()
+    async def verify(ctx, portfolio_name: str, action: str = None):
+        """
+        Check the holdings table of a portfolio against its transaction log.
+        Pass 'rebuild' to rebuild the holdings from the transaction log first.
+
+        Command:
+        !verify <portfolio_name> [rebuild]
+        """
+        portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+        if not portfolio_id:
+            await ctx.send(f'Portfolio {portfolio_name} not found.')
             return
 
-        print(f"[{time_now}] PORTFOLIO - {portfolio_name}: Sending market open report...")
+        try:
+            if action == 'rebuild':
+                rows = await asyncio.to_thread(pool.run_write, rebuild_holdings, portfolio_id)
+                view_cache.invalidate(portfolio_name)
+                await asyncio.to_thread(pool.run_write, rebuild_state_snapshots, portfolio_id)
+                await ctx.send(f'Rebuilt {rows} holdings for portfolio {portfolio_name} from the transaction log.')
+
+            mismatches = await asyncio.to_thread(pool.run_read, verify_holdings, portfolio_id)
+
+            if not mismatches:
+                await ctx.send(f'Holdings for portfolio {portfolio_name} match the transaction log.')
+                return
+
+            embed = discord.Embed(
+                title=f'Holdings Mismatch: {portfolio_name}',
+                description=f'Use !verify {portfolio_name} rebuild to rebuild holdings from the transaction log.',
+                color=discord.Color.red()
+            )
+            for symbol, expected_shares, actual_shares, expected_cost, actual_cost, expected_realized, actual_realized in mismatches[:25]:
+                embed.add_field(
+                    name=symbol,
+                    value=f'''
+                    Shares: {actual_shares} (expected {expected_shares})
+                    Cost Basis: ${actual_cost:,.2f} (expected ${expected_cost:,.2f})
+                    Realized P&L: ${actual_realized:,.2f} (expected ${expected_realized:,.2f})
+                    ''',
+                    inline=True
+                )
+
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error verifying holdings for {portfolio_name}: {e}')
 
-        channel = bot.get_channel(CHANNEL_ID)
-        if not channel:
-            print(f'Channel {CHANNEL_ID} not found')
+    @bot.command(name='import')
+    async def import_csv(ctx, portfolio_name: str):
+        """
+        Bulk import historical trades from an attached CSV file.
+        Columns: symbol, operation, shares, price_per_share, timestamp, [sector], [total_price]
+
+        Command:
+        !import <portfolio_name> (with a .csv attachment)
+        """
+        if not ctx.message.attachments:
+            await ctx.send('Please attach a CSV file of trades to import.')
             return
-        
-        portfolio_id = get_portfolio_id(conn, portfolio_name)
-        holdings = get_holdings(conn, portfolio_id)
 
-        if not holdings:
-            await channel.send(f'No holdings found for portfolio {portfolio_name}.')
+        attachment = ctx.message.attachments[0]
+        await ctx.send(f'Importing trades from {attachment.filename} into {portfolio_name}...')
+
+        try:
+            data = await attachment.read()
+            stream = io.TextIOWrapper(io.BytesIO(data), encoding='utf-8-sig', newline='')
+
+            result = await asyncio.to_thread(pool.run_write, import_trades, portfolio_name, stream)
+            view_cache.invalidate(portfolio_name)
+
+            if isinstance(result, str):
+                await ctx.send(result)
+                return
+
+            errors = '\n'.join(f'Line {line}: {error}' for line, error in result['errors'])
+
+            embed = discord.Embed(
+                title=f'Imported Trades: {portfolio_name}',
+                description=f'''
+                Imported: {result['imported']:,} trades
+                Skipped: {result['skipped']:,} invalid rows
+                New Balance: ${result['new_balance']:,.2f}
+                Time: {result['seconds']:.2f}s ({result['rows_per_second']:,.0f} rows/s)
+                ''',
+                color=discord.Color.green()
+            )
+            if errors:
+                embed.add_field(name='Errors', value=errors[:1024], inline=False)
+
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error importing trades for {portfolio_name}: {e}')
+
+    @bot.command()
+    async def performance(ctx, portfolio_name: str, time_range: str = '1mo'):
+        """
+        Chart the total value of a portfolio over a range.
+        Valid ranges: 1d, 5d, 1mo, 3mo, 6mo, 1y, 5y, max
+
+        Command:
+        !performance <portfolio_name> [range]
+        """
+        if time_range not in PERFORMANCE_RANGES:
+            await ctx.send(f'Valid ranges are: {", ".join(PERFORMANCE_RANGES)}')
             return
 
-        symbols = [row[0] for row in holdings]
-        total_shares = [row[2] for row in holdings]
-        initial_values = [row[3] for row in holdings]
+        portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+        if not portfolio_id:
+            await ctx.send(f'Portfolio {portfolio_name} not found.')
+            return
 
-        prices = get_batch_prices(symbols, price_change=False)
+        try:
+            resolution, snapshots = await asyncio.to_thread(pool.run_read, get_snapshots, portfolio_id, PERFORMANCE_RANGES[time_range])
 
-        stock_data = []
-        for i, symbol in enumerate(symbols):
-            if symbol in prices:
-                current_price = prices[symbol]
-                current_value = current_price * total_shares[i]
-                percentage_change = (current_value - initial_values[i]) / initial_values[i] * 100 if initial_values[i] != 0 else 0
+            graph = create_performance_graph(portfolio_name, snapshots, time_range, resolution)
 
-                stock_data.append({
-                    'symbol': symbol,
-                    'current_price': current_price,
-                    'percentage_change': percentage_change,
-                })
+            if graph:
+                file = discord.File(graph, filename=f'{portfolio_name}_performance_{time_range}.png')
+                await ctx.send(file=file)
             else:
-                print(f'WARNING: No price data available for {symbol}. Skipping in market open report.')
-                continue
-
-        if stock_data:
-            if is_weekend():
-                embed = discord.Embed(
-                    title=f'PORTFOLIO - {portfolio_name} Weekend Market Report',
-                    description='Market is closed on weekends.',
-                    color=discord.Color.green(),
-                    timestamp=time_now
-                )
-            else: 
-                embed = discord.Embed(
-                    title=f'PORTFOLIO - {portfolio_name} Market Open Report',
-                    color=discord.Color.green(),
-                    timestamp=time_now
-                )
-            for stock in stock_data:
-                star, emoji, sign = stock_changes(percentage_change)
+                await ctx.send(f'No value history for portfolio {portfolio_name} over {time_range} yet. Register it with !tasks to record snapshots.')
+
+        except Exception as e:
+            await ctx.send(f'Error generating performance chart for {portfolio_name}: {e}')
+
+    @bot.command()
+    async def risk(ctx, portfolio_name: str):
+        """
+        View risk metrics of a portfolio's current holdings over the last year.
+        Results are cached until the next daily close.
 
+        Command:
+        !risk <portfolio_name>
+        """
+        try:
+            metrics = await asyncio.to_thread(pool.run_read, portfolio_risk, portfolio_name)
+
+            if isinstance(metrics, str):
+                await ctx.send(metrics)
+                return
+
+            embed = discord.Embed(
+                title=f'Portfolio Risk: {portfolio_name}',
+                description=f'''
+                Period: {metrics['start']} to {metrics['end']} ({metrics['days']} days)
+                Annual Return: {metrics['annual_return']:.2%}
+                Annual Volatility: {metrics['annual_volatility']:.2%}
+                Sharpe Ratio: {metrics['sharpe']:.2f}
+                Sortino Ratio: {metrics['sortino']:.2f}
+                Max Drawdown: {metrics['max_drawdown']:.2%}
+                Beta (SPY): {metrics['beta']:.2f}
+                ''',
+                color=discord.Color.blue()
+            )
 
+            for holding in metrics['holdings'][:25]:
                 embed.add_field(
-                        name=f"{star}{emoji} {stock['symbol']}",
-                        value=f"${stock['current_price']:.2f}\nPortfolio Change: {sign}{stock['percentage_change']:.2f}%",
-                        inline=True
+                    name=holding['symbol'],
+                    value=f'''
+                    Weight: {holding['weight']:.2%}
+                    Volatility: {holding['volatility']:.2%}
+                    ''',
+                    inline=True
                 )
-            await channel.send(embed=embed)
-        else:
-            await channel.send('Could not get stock prices/data.')
 
-    @tasks.loop(minutes=5)
-    async def portfolio_changes():
-        """ 
-        Detect large price changes for stocks in portfolios and send alerts to discord channel. 
-        Includes a 5-minute check, 1 hour check, and daily check for significant price changes to capture after-hours movements.
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error computing risk for {portfolio_name}: {e}')
+
+    @bot.command()
+    async def var(ctx, portfolio_name: str, horizon: int = 1, confidence: float = 0.95):
         """
-        await bot.wait_until_ready()
+        Estimate Value-at-Risk and CVaR of a portfolio by Monte Carlo simulation
+        of correlated holding returns.
 
-        time_now = dt.now(TIMEZONE)
-        
-        if time_now.weekday() >= 5:
-            return
-        if time_now.hour < 9 or (time_now.hour == 9 and time_now.minute < 30) or time_now.hour > 16:
+        Command:
+        !var <portfolio_name> [horizon_days] [confidence]
+        """
+        # accept both 0.95 and 95
+        if confidence > 1:
+            confidence /= 100
+
+        if not 1 <= horizon <= MAX_HORIZON or not 0 < confidence < 1:
+            await ctx.send(f'Horizon must be between 1 and {MAX_HORIZON} days and confidence between 0 and 1.')
             return
 
-        print(f"[{time_now}] PORTFOLIO - {portfolio_name}: Checking for big changes...")
+        await ctx.send(f'Simulating VaR for {portfolio_name}...')
 
-        channel = bot.get_channel(CHANNEL_ID)
-        if not channel:
-            print(f'Channel {CHANNEL_ID} not found')
-            return
+        try:
+            result = await asyncio.to_thread(
+                pool.run_read, portfolio_var, portfolio_name, horizon, confidence,
+                executor=get_simulation_pool()
+            )
 
-        portfolio_id = get_portfolio_id(conn, portfolio_name)
-        holdings = get_holdings(conn, portfolio_id)
+            if isinstance(result, str):
+                await ctx.send(result)
+                return
 
-        symbols = [row[0] for row in holdings]
-        total_shares = [row[2] for row in holdings]
-        initial_values = [row[3] for row in holdings]
+            embed = discord.Embed(
+                title=f'Value-at-Risk: {portfolio_name}',
+                description=f'''
+                Holdings Value: ${result['value']:,.2f}
+                Horizon: {result['horizon']} day(s)
+                Confidence: {result['confidence']:.1%}
+                VaR: ${result['var']:,.2f} ({result['var'] / result['value']:.2%})
+                CVaR: ${result['cvar']:,.2f} ({result['cvar'] / result['value']:.2%})
+                Simulations: {result['simulations']:,}
+                ''',
+                color=discord.Color.red()
+            )
+            embed.set_footer(text=f"Holdings: {', '.join(result['symbols'])}")
 
-        # Initialize price tracking with initial prices per share for new symbols
-        from src.stock_data import last_checked_prices
-        
-        for i, symbol in enumerate(symbols):
-            if symbol not in last_checked_prices:
-                initial_price_per_share = initial_values[i] / total_shares[i] if total_shares[i] > 0 else 0
-                last_checked_prices[symbol] = initial_price_per_share
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error simulating VaR for {portfolio_name}: {e}')
+
+    @bot.command()
+    async def correlation(ctx, portfolio_name: str):
+        """
+        Send a heatmap of the correlation between the daily returns of a portfolio's holdings.
+
+        Command:
+        !correlation <portfolio_name>
+        """
+        try:
+            result = await asyncio.to_thread(pool.run_read, portfolio_correlation, portfolio_name)
+
+            if isinstance(result, str):
+                await ctx.send(result)
+                return
+
+            symbols, matrix = result
+            graph = create_correlation_heatmap(portfolio_name, symbols, matrix)
+
+            if graph:
+                file = discord.File(graph, filename=f'{portfolio_name}_correlation.png')
+                await ctx.send(file=file)
+            else:
+                await ctx.send(f'Could not generate correlation heatmap for {portfolio_name}.')
+
+        except Exception as e:
+            await ctx.send(f'Error generating correlation heatmap for {portfolio_name}: {e}')
+
+    @bot.command()
+    async def leaderboard(ctx, sort_by: str = 'return', limit: int = 10):
+        """
+        Rank every portfolio by total return, total value or max drawdown.
+
+        Command:
+        !leaderboard [return|value|drawdown] [limit]
+        """
+        if sort_by not in LEADERBOARD_SORTS:
+            await ctx.send(f"Invalid sort. Valid sorts are: {', '.join(LEADERBOARD_SORTS)}")
+            return
 
-        # compare current price to last checked price for the stock to detect significant changes since last check
-        big_changes = check_price_changes(symbols, percent_threshold=1, initial_prices=None)
+        try:
+            ranking = await asyncio.to_thread(pool.run_read, portfolio_leaderboard, sort_by)
 
-        if big_changes:
-            print(f"PORTFOLIO - {portfolio_name}: Big price changes found.")
+            if isinstance(ranking, str):
+                await ctx.send(ranking)
+                return
 
             embed = discord.Embed(
-                title=f"ALERT: Big Price Movement for {', '.join(big_changes.keys())} in Portfolio {portfolio_name}",
-                color=discord.Color.red(),
-                timestamp=time_now,
+                title=f'Portfolio Leaderboard by {sort_by.title()}',
+                description=f'{len(ranking)} portfolios ranked.',
+                color=discord.Color.gold()
+            )
+
+            for rank, entry in enumerate(ranking[:max(1, min(limit, 25))], start=1):
+                drawdown = 'n/a' if entry['max_drawdown'] is None else f"{entry['max_drawdown']:.2%}"
+                embed.add_field(
+                    name=f"#{rank} {entry['name']}",
+                    value=f'''
+                    Total Value: ${entry['total_value']:,.2f}
+                    Total Return: {entry['total_return']:.2%}
+                    Max Drawdown: {drawdown}
+                    ''',
+                    inline=False
                 )
-            
-            for i, symbol in enumerate(symbols):
-                if symbol in big_changes:
-                    stock = big_changes[symbol]
-                    
-                    current_value = stock['current_price'] * total_shares[i]
-                    percentage_change = (current_value - initial_values[i]) / initial_values[i] * 100 if initial_values[i] != 0 else 0
-
-                    star, emoji, sign = stock_changes(percentage_change)
-
-                    embed.add_field(
-                        name=f"{star} {emoji} {stock['symbol']}",
-                        value=f"${stock['current_price']:.2f}\nPortfolio Change: {sign}{percentage_change:.2f}%", 
-                        inline=True
-                    )
-            await channel.send(embed=embed)
-        else:
-            print(f"PORTFOLIO - {portfolio_name}: Big price changes not found.")
 
-    @tasks.loop(hours=6)
-    async def portfolio_news():
+            await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error building leaderboard: {e}')
+
+    @bot.command(name='backtest')
+    async def backtest_command(ctx, symbol: str, strategy: str = 'sma', period: str = '2y', interval: str = '1d'):
         """
-        Check for news related to stocks in the portfolio and send updates to discord channel.
-        Runs every 6 hours before 8pm EST.
+        Backtest a strategy on a symbol's bar history and compare it to buying and holding.
+
+        Command:
+        !backtest <symbol> [strategy] [period] [interval]
         """
-        await bot.wait_until_ready()
+        symbol = symbol.upper()
 
-        time_now = dt.now(TIMEZONE)
-        
-        # Only run before 8pm EST (20:00)
-        if time_now.hour >= 20:
-            return
-        
-        # Skip on weekends
-        if time_now.weekday() >= 5:
+        if strategy not in STRATEGIES:
+            await ctx.send(f"Invalid strategy. Valid strategies are: {', '.join(STRATEGIES)}")
             return
 
-        print(f"[{time_now}] PORTFOLIO - {portfolio_name}: Checking for news...")
+        await ctx.send(f'Backtesting {strategy} on {symbol}...')
 
-        channel = bot.get_channel(CHANNEL_ID)
-        if not channel:
-            print(f'Channel {CHANNEL_ID} not found')
-            return
+        try:
+            result = await asyncio.to_thread(backtest, symbol, strategy, period, interval)
 
-        portfolio_id = get_portfolio_id(conn, portfolio_name)
-        holdings = get_holdings(conn, portfolio_id)
+            if isinstance(result, str):
+                await ctx.send(result)
+                return
 
-        if not holdings:
-            print(f'No holdings found for portfolio {portfolio_name}.')
-            return
+            embed = discord.Embed(
+                title=f'Backtest: {symbol} ({strategy})',
+                description=f'''
+                Period: {result['dates'][0]:%Y-%m-%d} to {result['dates'][-1]:%Y-%m-%d} ({result['bars']} bars, {interval})
+                Strategy Return: {result['total_return']:.2%}
+                Buy & Hold Return: {result['buy_and_hold_return']:.2%}
+                Max Drawdown: {result['max_drawdown']:.2%}
+                Trades: {result['trades']}
+                Final Value: ${result['final_value']:,.2f}
+                Replay: {result['bars_per_second']:,.0f} bars/sec
+                ''',
+                color=discord.Color.green() if result['total_return'] >= result['buy_and_hold_return'] else discord.Color.red()
+            )
+
+            graph = create_equity_curve_graph(symbol, strategy, result['dates'], result['equity'], result['benchmark'])
 
-        symbols = [row[0] for row in holdings]
+            if graph:
+                file = discord.File(graph, filename=f'{symbol}_{strategy}_backtest.png')
+                embed.set_image(url=f'attachment://{symbol}_{strategy}_backtest.png')
+                await ctx.send(embed=embed, file=file)
+            else:
+                await ctx.send(embed=embed)
+
+        except Exception as e:
+            await ctx.send(f'Error backtesting {strategy} on {symbol}: {e}')
+
+    @bot.command()
+    async def dbstats(ctx):
+        """
+        View portfolio database connection and writer metrics.
+
+        Command:
+        !dbstats
+        """
+        metrics = pool.get_metrics()
 
         embed = discord.Embed(
-            title=f'{time_now.hour}:{time_now.minute} {'AM' if time_now.hour < 12 else 'PM'} - News Update: {', '.join(symbols)}',
-            color=discord.Color.blue(),
-            timestamp=time_now
+            title='Portfolio Database Metrics',
+            description=f'''
+            Read Connections: {metrics['readers_open']}
+            Read Checkouts: {metrics['read_checkouts']}
+            Write Checkouts: {metrics['write_checkouts']}
+            Write Wait: {metrics['write_wait_avg_ms']:.2f}ms avg / {metrics['write_wait_max_ms']:.2f}ms max
+            Write Hold: {metrics['write_hold_avg_ms']:.2f}ms avg
+            Trades Written: {writer.stats['writes']} ({writer.stats['failed']} failed)
+            Commits: {writer.stats['commits']} (largest batch {writer.stats['largest_batch']})
+            ''',
+            color=discord.Color.blue()
         )
-        for symbol in symbols:
-            try:
-                news_article = get_news_update(symbol, query='')
-                
-                if not news_article:
-                    continue
-
-                # Limit to top article
-                news_article = news_article[:1]
-                
-                embed_articles = embed_format(news_article)
-                    
-                for article in embed_articles:
-                    embed.add_field(
-                        name=article['title'],
-                        value=article['description'],
-                        inline=False
-                    )
-                
-                embed.set_footer(text=f'Portfolio: {portfolio_name}')
-
-            except Exception as e:
-                print(f'Error fetching news for {symbol}: {e}')
-                continue
 
-        await channel.send(embed=embed)
+        await ctx.send(embed=embed)
 
-    return {
-        'portfolio_market_open_report': portfolio_market_open_report,
-        'portfolio_changes': portfolio_changes,
-        'portfolio_news': portfolio_news
-    }
+    @bot.command()
+    async def tasks(ctx, portfolio_name: str = None, action: str = None):
+        """
+        Register a portfolio for periodic reports and alerts, or list registered portfolios.
+        Pass 'remove' to stop reports and alerts for the portfolio.
 
-def start_portfolio_tasks(bot, conn):
-    """
-    Start portfolio-related background tasks for the registered portfolio.
-    
-    :param bot: bot connection to start tasks for setup portfolio tasks
-    :param conn: connection to portfolio database to start tasks for setup portfolio tasks
-    """
+        Command:
+        !tasks [portfolio_name] [remove]
+        """
+        try:
+            if portfolio_name is None:
+                registered = await asyncio.to_thread(pool.run_read, get_registered_portfolios)
 
-    registered_portfolio = load_portfolio()
+                if registered:
+                    await ctx.send(f"Registered portfolios: {', '.join(name for _, name, _ in registered)}")
+                else:
+                    await ctx.send('No portfolios are registered for tasks.')
+                return
 
-    if not registered_portfolio:
-        print('TASK SETUP: No registered portfolio found to start tasks for.')
-        return
-    try:
-        if get_portfolio_id(conn, registered_portfolio):
-            task_funcs = setup_portfolio_tasks(bot, conn, registered_portfolio)
+            portfolio_id = await asyncio.to_thread(pool.run_read, get_portfolio_id, portfolio_name)
+            if not portfolio_id:
+                await ctx.send(f'Portfolio {portfolio_name} not found. Please create the portfolio before registering for tasks.')
+                return
 
-            if not task_funcs:
-                print(f'TASK SETUP: Failed to set up tasks for portfolio {registered_portfolio}.')
+            if action == 'remove':
+                if await asyncio.to_thread(pool.run_write, unregister_portfolio, portfolio_id):
+                    await ctx.send(f'Portfolio {portfolio_name} removed from periodic reports and alerts.')
+                else:
+                    await ctx.send(f'Portfolio {portfolio_name} is not registered for tasks.')
                 return
-            
-            if not task_funcs['portfolio_market_open_report'].is_running():
-                task_funcs['portfolio_market_open_report'].start()
-                print(f'PORTFOLIO TASKS: Started market open report task for portfolio {registered_portfolio}.')
 
-            if not task_funcs['portfolio_changes'].is_running():
-                task_funcs['portfolio_changes'].start()
-                print(f'PORTFOLIO TASKS: Started price change alert task for portfolio {registered_portfolio}.')
+            if await asyncio.to_thread(pool.run_write, register_portfolio, portfolio_id):
+                await ctx.send(f'Portfolio {portfolio_name} registered for periodic reports and alerts.')
+            else:
+                await ctx.send(f'Portfolio {portfolio_name} is already registered for tasks.')
 
-            if not task_funcs['portfolio_news'].is_running():
-                task_funcs['portfolio_news'].start()
-                print(f'PORTFOLIO TASKS: Started news update task for portfolio {registered_portfolio}.')
+        except Exception as e:
+            await ctx.send(f'Error setting up tasks for portfolio {portfolio_name}.')
+            print(f"Error registering portfolio '{portfolio_name}' for tasks: {e}")
 
+def setup_maintenance_tasks(pool, keep_days=30):
+    """
+    Setup portfolio database maintenance tasks.
 
-            ACTIVE_TASKS[registered_portfolio] = task_funcs
+    :param pool: connection pool for the portfolio database
+    :param keep_days: days of raw balance history to keep before compacting into daily rollups
+    """
 
-            print(f'Tasks started for portfolio: {registered_portfolio}')
-        else:
-            print(f'TASK SETUP: Registered portfolio {registered_portfolio} not found in database. Cannot start tasks.')
-    except Exception as e:
-        print(f'Error starting tasks for portfolio {registered_portfolio}: {e}')
\ No newline at end of file
+    @tasks.loop(hours=24)
+    async def balance_compaction():
+        """Fold old balance history into daily rollups so the balances table stays bounded."""
+        try:
+            compacted = await asyncio.to_thread(pool.run_write, compact_balance_history, keep_days)
+            print(f'MAINTENANCE: Compacted {compacted} balance history rows into daily rollups.')
+        except Exception as e:
+            print(f'MAINTENANCE: Error compacting balance history: {e}')
+
+    @tasks.loop(hours=1)
+    async def snapshot_rollup():
+        """Roll value snapshots up into hourly and daily tiers and prune expired rows."""
+        try:
+            deleted = await asyncio.to_thread(pool.run_write, rollup_snapshots)
+            print(f'MAINTENANCE: Rolled up value snapshots, pruned {deleted} expired rows.')
+        except Exception as e:
+            print(f'MAINTENANCE: Error rolling up value snapshots: {e}')
+
+    return {
+        'balance_compaction': balance_compaction,
+        'snapshot_rollup': snapshot_rollup,
+    }
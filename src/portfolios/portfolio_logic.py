@@ -7,16 +7,28 @@ import datetime as dt
 
 from collections import defaultdict
 
-from src.portfolios.database.procedures import get_portfolio_id, get_portfolio_balance, update_portfolio_balance, insert_transaction, get_holdings
+from src.portfolios.database.procedures import get_portfolio_id, get_portfolio_balance, record_trade, get_holdings, get_realized_pnl
 from src.stock_data import get_batch_prices
 from src.stock_data import get_asset_type
 
-def buy_stock(conn, portfolio_name, symbol, shares):
-    """Buy stock shares"""
+def quote_trade(conn, portfolio_name, symbol, shares, operation):
+    """
+    Price a market order at the current price without writing it.
+
+    :return: trade dict to pass to execute_trade, or an error message string
+    """
+    # shares arrive as command text
+    try:
+        shares = float(shares)
+    except (TypeError, ValueError):
+        return f'Invalid number of shares: {shares}.'
+    if shares <= 0:
+        return 'Number of shares must be positive.'
+
     portfolio_id = get_portfolio_id(conn, portfolio_name)
     if not portfolio_id:
         return f'portfolio {portfolio_name} not found.'
-    
+
     symbol = symbol.upper()
 
     ticker = yf.Ticker(symbol)
@@ -28,62 +40,61 @@ def buy_stock(conn, portfolio_name, symbol, shares):
     if not current_price:
         return f'Error retrieving current price for {symbol}.'
 
-    total_price = current_price * float(shares)
-    current_time = dt.datetime.now().strftime('%Y-%m-%d %H:%M')
-    operation = 'BUY'
-
-    insert_transaction(conn, portfolio_id, symbol, sector,operation, shares, current_price, total_price, current_time)
-
-    new_balance = get_portfolio_balance(conn, portfolio_id) - total_price
-    update_portfolio_balance(conn, portfolio_id, new_balance, current_time)
-
-    result = {
+    return {
+        'portfolio_id': portfolio_id,
         'portfolio_name': portfolio_name,
         'asset_type': asset_type,
         'symbol': symbol,
-        'shares': shares,
+        'sector': sector,
         'operation': operation,
-        'price_per_share': f'${current_price:,.2f}',
-        'total_price': f'${total_price:,.2f}',
-        'new_balance': f'${new_balance:,.2f}',
-        'timestamp': current_time
+        'shares': shares,
+        'price_per_share': current_price,
+        'total_price': current_price * shares,
+        'timestamp': dt.datetime.now().strftime('%Y-%m-%d %H:%M'),
     }
-    return result
 
-def sell_stock(conn, portfolio_name, symbol, shares):
-    """Sell stock shares"""
-    portfolio_id = get_portfolio_id(conn, portfolio_name)
-    if not portfolio_id:
-        return f'portfolio {portfolio_name} not found.'
+def execute_trade(conn, trade):
+    """Write a quoted trade without committing. Returns the new balance."""
+    return record_trade(
+        conn, trade['portfolio_id'], trade['symbol'], trade['sector'], trade['operation'],
+        trade['shares'], trade['price_per_share'], trade['total_price'], trade['timestamp']
+    )
+
+def trade_result(trade, new_balance):
+    """Format an executed trade for display."""
+    return {
+        'portfolio_name': trade['portfolio_name'],
+        'asset_type': trade['asset_type'],
+        'symbol': trade['symbol'],
+        'shares': trade['shares'],
+        'operation': trade['operation'],
+        'price_per_share': f"${trade['price_per_share']:,.2f}",
+        'total_price': f"${trade['total_price']:,.2f}",
+        'new_balance': f'${new_balance:,.2f}',
+        'timestamp': trade['timestamp']
+    }
 
-    symbol = symbol.upper()
+def buy_stock(conn, portfolio_name, symbol, shares):
+    """Buy stock shares"""
+    trade = quote_trade(conn, portfolio_name, symbol, shares, 'BUY')
+    if isinstance(trade, str):
+        return trade
 
-    ticker = yf.Ticker(symbol)
+    new_balance = execute_trade(conn, trade)
+    conn.commit()
 
-    asset_type = get_asset_type(symbol).capitalize()
-    sector = ticker.info.get('sector') if 'sector' in ticker.info else asset_type
+    return trade_result(trade, new_balance)
 
-    current_price = ticker.fast_info.last_price
-    total_price = current_price * float(shares)
-    current_time = dt.datetime.now().strftime('%Y-%m-%d %H:%M')
-    operation = 'SELL'
-    insert_transaction(conn, portfolio_id, symbol, sector, operation, shares, current_price, total_price, current_time)
+def sell_stock(conn, portfolio_name, symbol, shares):
+    """Sell stock shares"""
+    trade = quote_trade(conn, portfolio_name, symbol, shares, 'SELL')
+    if isinstance(trade, str):
+        return trade
 
-    new_balance = get_portfolio_balance(conn, portfolio_id) + total_price
-    update_portfolio_balance(conn, portfolio_id, new_balance, current_time)
+    new_balance = execute_trade(conn, trade)
+    conn.commit()
 
-
-    result = {
-        'portfolio_name': portfolio_name,
-        'asset_type': asset_type,
-        'symbol': symbol,
-        'shares': shares,
-        'price_per_share': f'${current_price:.2f}',
-        'total_price': f'${total_price:.2f}',
-        'new_balance': f'${new_balance:.2f}',
-        'timestamp': current_time
-    }
-    return result
+    return trade_result(trade, new_balance)
 
 def portfolio_data(conn, name):
     """View current data of a portfolio."""
@@ -94,23 +105,54 @@ def portfolio_data(conn, name):
     
     balance = get_portfolio_balance(conn, portfolio_id)
     holdings = get_holdings(conn, portfolio_id)
+    realized_by_symbol = get_realized_pnl(conn, portfolio_id)
 
     symbols = [row[0].upper() for row in holdings]
     current_prices = get_batch_prices(symbols)
 
+    return build_portfolio_data(name, balance, holdings, realized_by_symbol, current_prices)
+
+def portfolio_holdings(conn, name):
+    """
+    Load a portfolio's balance, holdings and realized P&L without pricing them, for paginated views.
+
+    :return: dict with portfolio_id, balance, holdings sorted by sector and symbol, and realized P&L per symbol,
+             or an error message string
+    """
+    portfolio_id = get_portfolio_id(conn, name)
+    if not portfolio_id:
+        return f"Portfolio '{name}' not found."
+
+    holdings = get_holdings(conn, portfolio_id)
+    if not holdings:
+        return f'No holdings for portfolio: {name}.'
+
+    return {
+        'portfolio_id': portfolio_id,
+        'balance': get_portfolio_balance(conn, portfolio_id),
+        'holdings': sorted(holdings, key=lambda row: (row[1] or '', row[0])),
+        'realized': get_realized_pnl(conn, portfolio_id),
+    }
+
+def build_portfolio_data(name, balance, holdings, realized_by_symbol, current_prices):
+    """Render the portfolio_data view of a portfolio from already loaded holdings and prices."""
+
     holdings_by_sector = defaultdict(list)
     holdings_value = 0
-    total_returns = 0
+    unrealized_returns = 0
+    realized_returns = sum(realized_by_symbol.values())
 
     if holdings:
         for symbol, sector, shares, initial_value in holdings:
 
+            realized = realized_by_symbol.get(symbol, 0.0)
             price = current_prices.get(symbol, 0)
             if price:
                 stock_value = price * shares
                 holdings_value += stock_value
+                # initial_value is the cost of the open FIFO lots, so this is unrealized P&L
                 returns = stock_value - initial_value
-                total_returns += returns
+                unrealized_returns += returns
                 returns_pc = (returns / initial_value) * 100
                 change_sign = '+' if returns >= 0 else ''
 
@@ -121,6 +163,7 @@ def portfolio_data(conn, name):
                     'initial_value': f'${initial_value:.2f}',
                     'total_value': f'${stock_value:.2f}',
                     'returns': f'${returns:.2f} ({change_sign}{returns_pc:.2f}%)',
+                    'realized_returns': f'${realized:.2f}',
                 }
 
             else:
@@ -128,12 +171,15 @@ def portfolio_data(conn, name):
                     'symbol': symbol,
                     'shares': shares, 
                     'initial_value': f'${initial_value:.2f}',
+                    'realized_returns': f'${realized:.2f}',
                 }
 
             holdings_by_sector[sector].append(stock_data)
     else:
         return f'No holdings for portfolio: {name}.'
 
+    total_returns = unrealized_returns + realized_returns
+    # realized gains are already in the balance, so this is the capital put in
     total_returns_pc = (total_returns / (balance + holdings_value - total_returns)) * 100
 
     result = {
@@ -142,11 +188,31 @@ def portfolio_data(conn, name):
         'total_holdings_value': f'${holdings_value:,.2f}',
         'total_value': f'${balance + holdings_value:,.2f}',
         'total_returns': f'${total_returns:,.2f} ({total_returns_pc:.2f}%)',
+        'unrealized_returns': f'${unrealized_returns:,.2f}',
+        'realized_returns': f'${realized_returns:,.2f}',
         'current_holdings': dict(holdings_by_sector)
     }
     
     return result
 
+def portfolio_value(conn, portfolio_id, prices=None):
+    """
+    Mark a portfolio to market.
+
+    :param prices: optional dict of symbol to price, fetched when not provided
+    :return: (balance, holdings_value)
+    """
+    balance = get_portfolio_balance(conn, portfolio_id)
+    holdings = get_holdings(conn, portfolio_id)
+
+    if prices is None:
+        symbols = [row[0] for row in holdings]
+        prices = get_batch_prices(symbols) if symbols else {}
+
+    holdings_value = sum(prices.get(symbol, 0) * shares for symbol, sector, shares, initial_value in holdings)
+
+    return balance, holdings_value
+
 def portfolio_balance(conn, name):
     """Get current balance of a portfolio."""
 
@@ -172,9 +238,19 @@ def get_asset_weights(conn, name):
     
     holdings = get_holdings(conn, portfolio_id)
     
-    asset_weights = {}
     symbols = [row[0].upper() for row in holdings]
     current_prices = get_batch_prices(symbols)
+    asset_types = {symbol: get_asset_type(symbol).capitalize() for symbol in symbols}
+
+    return build_asset_weights(holdings, current_prices, asset_types)
+
+def build_asset_weights(holdings, current_prices, asset_types):
+    """
+    Render asset type weights of a portfolio from already loaded holdings, prices and asset types.
+
+    :param asset_types: dict of symbol to capitalized asset type
+    """
+    asset_weights = {}
 
     total_shares = 0
     total_initial_value = 0
@@ -189,7 +265,8 @@ def get_asset_weights(conn, name):
         total_shares += shares
 
     for symbol, sector, shares, initial_value in holdings:
-        asset_type = get_asset_type(symbol).capitalize()
+        asset_type = asset_types[symbol]
+        current_value = current_prices.get(symbol, 0) * shares
 
         if asset_type not in asset_weights:
             asset_weights[asset_type] = {
@@ -202,4 +279,4 @@ def get_asset_weights(conn, name):
         asset_weights[asset_type]['current_value_weight'] += current_value / total_current_value if total_current_value else 0
         asset_weights[asset_type]['initial_value_weight'] += initial_value / total_initial_value if total_initial_value else 0
 
-    return asset_weights
\ No newline at end of file
+    return asset_weights
@@ -0,0 +1,383 @@
+# Central scheduler for registered portfolios.
+# One loop serves every portfolio in registered_portfolios: each tick reads all registered holdings
+# in one query, fetches prices once for the union of their symbols, feeds them to the mark-to-market
+# engine, which revalues only the holdings whose price changed, and then dispatches value snapshots,
+# price alerts, open reports and news per portfolio from the engine's marks.
+# During market hours the same prices are matched against the conditional order book.
+# Messages go through the outbox, which merges the tick's alerts and rate limits sends.
+# News is marked seen only once the outbox has sent it.
+
+import asyncio
+import functools
+import datetime as dt
+from collections import defaultdict
+
+import discord
+from discord.ext import tasks
+
+from src.config.config import CHANNEL_ID, TIMEZONE
+from src.config.storage import load_portfolio, save_portfolio
+from src.config.utils import percent_change, stock_changes
+from src.stock_data import get_batch_prices
+from src.news import embed_format, news_service, NearDuplicateIndex, article_words
+from src.portfolios.database.procedures import get_portfolio_id, register_portfolio, get_registered_portfolios, get_registered_holdings, get_open_orders, fill_order, reject_order
+from src.portfolios.database.snapshots import record_snapshot
+from src.portfolios.views import view_cache
+from src.portfolios.marking import mark_engine
+from src.portfolios.orders import order_book
+from src.discord.outbox import outbox, PRIORITY_FILL, PRIORITY_ALERT, PRIORITY_REPORT, PRIORITY_NEWS
+
+TICK_MINUTES = 5
+# percent move of a symbol between ticks that triggers an alert
+ALERT_THRESHOLD = 1
+NEWS_INTERVAL = dt.timedelta(hours=6)
+# ticks a triggered order is retried after its fill raised before it is rejected
+MAX_FILL_ATTEMPTS = 3
+
+def migrate_registered_portfolio(pool):
+    """Move the portfolio registered in portfolio.json (single registration) into registered_portfolios."""
+    portfolio_name = load_portfolio()
+    if not portfolio_name:
+        return
+
+    portfolio_id = pool.run_read(get_portfolio_id, portfolio_name)
+    if portfolio_id:
+        pool.run_write(register_portfolio, portfolio_id)
+        print(f'TASK SETUP: Migrated registered portfolio {portfolio_name} from portfolio.json.')
+
+    save_portfolio(None)
+
+def load_scheduler_state(conn):
+    """
+    Read every registered portfolio and its holdings.
+
+    :return: (portfolios, holdings) with portfolios as {portfolio_id: (name, balance)}
+             and holdings as {portfolio_id: [(symbol, sector, shares, cost_basis)]}
+    """
+    portfolios = {portfolio_id: (name, balance) for portfolio_id, name, balance in get_registered_portfolios(conn)}
+
+    holdings = defaultdict(list)
+    for portfolio_id, *row in get_registered_holdings(conn):
+        holdings[portfolio_id].append(tuple(row))
+
+    return portfolios, holdings
+
+def record_snapshots(conn, timestamp, values):
+    """Write the 5-minute value snapshot of every portfolio in one transaction."""
+    for portfolio_id, (balance, holdings_value) in values.items():
+        record_snapshot(conn, portfolio_id, timestamp, balance, holdings_value)
+
+def fetch_news(symbols):
+    """
+    Fetch the newest not yet posted story of each symbol, searching batches of symbols concurrently.
+    Near-duplicate articles (one story syndicated by several publishers) are clustered across
+    all symbols in one pass and each story is posted once, under the first symbol that has it.
+    The index is seeded with recently posted stories, so a copy of one of them is not posted again.
+
+    :return: ({symbol: [article formatted for embeds]}, {symbol: [raw articles to mark as seen once its news is posted]})
+    """
+    fetched = news_service.fetch_symbols(symbols, batched=True)
+    candidates = [(symbol, article) for symbol, articles in fetched.items() for article in news_service.unseen(articles)]
+
+    index = NearDuplicateIndex()
+    # added first, so a cluster containing an earlier story is keyed by it
+    for j, words in enumerate(news_service.posted_stories()):
+        index.add(('posted', j), words)
+    for i, (_, article) in enumerate(candidates):
+        index.add(i, article_words(article))
+
+    news = {}
+    # cluster -> symbol its story is posted under
+    posted_clusters = {}
+    for i, (symbol, article) in enumerate(candidates):
+        cluster = index.cluster(i)
+        if symbol in news or cluster in posted_clusters or isinstance(cluster, tuple):
+            continue
+
+        news[symbol] = embed_format([article])
+        posted_clusters[cluster] = symbol
+
+    # every copy of a posted story is marked seen with it so it is not posted from another publisher later
+    posted = defaultdict(list)
+    for i, (_, article) in enumerate(candidates):
+        cluster = index.cluster(i)
+        if cluster in posted_clusters:
+            posted[posted_clusters[cluster]].append(article)
+
+    return news, dict(posted)
+
+def holding_change(value, cost_basis):
+    """Percent change of a holding's value against its cost basis."""
+    return (value - cost_basis) / cost_basis * 100 if cost_basis else 0
+
+def open_report_embed(name, marks, time_now):
+    """
+    Market open report of one portfolio, or None if no holding has a price.
+
+    :param marks: marked holdings from mark_engine.holdings
+    """
+    marks = [mark for mark in marks if mark[3] is not None]
+    if not marks:
+        return None
+
+    if time_now.weekday() >= 5:
+        embed = discord.Embed(
+            title=f'PORTFOLIO - {name} Weekend Market Report',
+            description='Market is closed on weekends.',
+            color=discord.Color.green(),
+            timestamp=time_now
+        )
+    else:
+        embed = discord.Embed(
+            title=f'PORTFOLIO - {name} Market Open Report',
+            color=discord.Color.green(),
+            timestamp=time_now
+        )
+
+    for symbol, _, cost_basis, price, value in marks[:25]:
+        percentage_change = holding_change(value, cost_basis)
+        star, emoji, sign = stock_changes(percentage_change)
+
+        embed.add_field(
+            name=f'{star}{emoji} {symbol}',
+            value=f'${price:.2f}\nPortfolio Change: {sign}{percentage_change:.2f}%',
+            inline=True
+        )
+
+    return embed
+
+def alert_embed(name, moved_marks, totals, delta, time_now):
+    """
+    Big price movement alert of one portfolio, or None if none of its holdings moved.
+
+    :param moved_marks: marked holdings of the moved symbols from mark_engine.holdings
+    :param totals: (balance, holdings_value, unrealized_pnl) from mark_engine.totals
+    :param delta: change in the portfolio's holdings value this tick
+    """
+    if not moved_marks:
+        return None
+
+    balance, holdings_value, unrealized_pnl = totals
+
+    embed = discord.Embed(
+        title=f"ALERT: Big Price Movement for {', '.join(mark[0] for mark in moved_marks)} in Portfolio {name}",
+        description=(
+            f'Total Value: ${balance + holdings_value:,.2f} ({delta:+,.2f} this tick)\n'
+            f'Unrealized P&L: ${unrealized_pnl:,.2f}'
+        ),
+        color=discord.Color.red(),
+        timestamp=time_now,
+    )
+
+    for symbol, _, cost_basis, price, value in moved_marks[:25]:
+        percentage_change = holding_change(value, cost_basis)
+        star, emoji, sign = stock_changes(percentage_change)
+
+        embed.add_field(
+            name=f'{star} {emoji} {symbol}',
+            value=f'${price:.2f}\nPortfolio Change: {sign}{percentage_change:.2f}%',
+            inline=True
+        )
+
+    return embed
+
+def news_embed(name, holdings, news, time_now):
+    """
+    News update of one portfolio.
+
+    :return: (embed, symbols whose news it shows), or (None, []) if there is no news for its holdings
+    """
+    symbols = [row[0] for row in holdings]
+    if not any(symbol in news for symbol in symbols):
+        return None, []
+
+    embed = discord.Embed(
+        title=f"{time_now:%I:%M %p} - News Update: {', '.join(symbols)}",
+        color=discord.Color.blue(),
+        timestamp=time_now
+    )
+
+    shown = []
+    for symbol in symbols:
+        for article in news.get(symbol, []):
+            if len(embed.fields) >= 25:
+                break
+
+            embed.add_field(
+                name=article['title'],
+                value=article['description'],
+                inline=False
+            )
+            if symbol not in shown:
+                shown.append(symbol)
+
+    embed.set_footer(text=f'Portfolio: {name}')
+
+    return embed, shown
+
+def fill_embed(order, price, result, time_now):
+    """Fill or rejection notice of a triggered conditional order."""
+    order_id, _, symbol, operation, order_type, trigger_price, shares = order
+    filled = not isinstance(result, str)
+
+    embed = discord.Embed(
+        title=f"ORDER {order_id} {'FILLED' if filled else 'NOT FILLED'}: {operation} {shares:g} {symbol}",
+        description=(
+            f'Type: {order_type} at ${trigger_price:,.2f}\n'
+            f'Fill Price: ${price:,.2f}\n'
+            + (f'New Balance: ${result:,.2f}' if filled else result)
+        ),
+        color=discord.Color.green() if filled else discord.Color.red(),
+        timestamp=time_now,
+    )
+
+    return embed
+
+def setup_portfolio_scheduler(bot, pool, writer):
+    """
+    Setup the scheduler task that serves every registered portfolio and fills conditional orders.
+
+    :param bot: bot to send reports and alerts with
+    :param pool: connection pool for the portfolio database
+    :param writer: PortfolioWriter that order fills are written through
+    """
+    order_book.load(pool.run_read(get_open_orders))
+
+    # prices of the previous tick for alerts, failed fill attempts per order id, and when reports and news last went out
+    state = {
+        'last_prices': {},
+        'fill_failures': {},
+        'report_date': None,
+        'news_at': None,
+    }
+
+    @tasks.loop(minutes=TICK_MINUTES)
+    async def portfolio_scheduler():
+        """
+        Every five minutes mark all registered portfolios to market from one batched price fetch, record their
+        value snapshots and send price alerts during market hours, the market open report
+        once a day and news every six hours before 8pm on weekdays.
+        """
+        await bot.wait_until_ready()
+
+        time_now = dt.datetime.now(TIMEZONE)
+
+        try:
+            portfolios, holdings = await asyncio.to_thread(pool.run_read, load_scheduler_state)
+            mark_engine.sync(portfolios, holdings)
+            if not portfolios and not order_book:
+                return
+
+            symbols = sorted({row[0] for rows in holdings.values() for row in rows} | set(order_book.symbols()))
+            prices = await asyncio.to_thread(get_batch_prices, symbols) if symbols else {}
+
+            deltas = await asyncio.to_thread(mark_engine.update_prices, prices)
+            view_cache.update_prices(prices)
+            await asyncio.to_thread(pool.run_write, record_snapshots, dt.datetime.now(), mark_engine.values())
+
+        except Exception as e:
+            print(f'SCHEDULER: Error valuing registered portfolios: {e}')
+            return
+
+        # resolved before orders are matched and news is fetched, so neither is lost when it is missing
+        channel = bot.get_channel(CHANNEL_ID)
+        if not channel:
+            print(f'Channel {CHANNEL_ID} not found')
+            return
+
+        last_prices = state['last_prices']
+        moved = {
+            symbol for symbol, price in prices.items()
+            if symbol in last_prices and abs(percent_change(price, last_prices[symbol])) >= ALERT_THRESHOLD
+        }
+        last_prices.update(prices)
+
+        weekday = time_now.weekday() < 5
+        market_hours = weekday and (9, 30) <= (time_now.hour, time_now.minute) <= (16, 0)
+
+        # outside market hours the prices are stale closes, so orders only trigger while it is open
+        fills = []
+        if market_hours:
+            timestamp = time_now.strftime('%Y-%m-%d %H:%M')
+
+            failures = state['fill_failures']
+            for order, price in order_book.match(prices):
+                order_id = order[0]
+                try:
+                    result = await asyncio.wrap_future(writer.submit(fill_order, order_id, price, timestamp))
+                except Exception as e:
+                    print(f'SCHEDULER: Error filling order {order_id}: {e}')
+                    failures[order_id] = failures.get(order_id, 0) + 1
+
+                    # the order is still open in the database, so it goes back in the book to trigger again
+                    # until it has failed MAX_FILL_ATTEMPTS times
+                    if failures[order_id] < MAX_FILL_ATTEMPTS:
+                        order_book.add(order)
+                        continue
+
+                    try:
+                        await asyncio.wrap_future(writer.submit(reject_order, order_id, timestamp))
+                    except Exception as e:
+                        print(f'SCHEDULER: Error rejecting order {order_id}: {e}')
+                        continue
+
+                    result = f'Order {order_id} rejected after {MAX_FILL_ATTEMPTS} failed fill attempts.'
+
+                failures.pop(order_id, None)
+                fills.append(fill_embed(order, price, result, time_now))
+
+            if fills:
+                # fills are rare, so drop every cached view rather than look up the portfolio names
+                view_cache.invalidate()
+        report_due = (9, 30) <= (time_now.hour, time_now.minute) < (9, 40) and state['report_date'] != time_now.date()
+        news_due = weekday and time_now.hour < 20 and (state['news_at'] is None or time_now - state['news_at'] >= NEWS_INTERVAL)
+
+        news, posted = {}, {}
+        held = sorted({row[0] for rows in holdings.values() for row in rows})
+        if news_due and held:
+            news, posted = await asyncio.to_thread(fetch_news, held)
+            state['news_at'] = time_now
+
+        for embed in fills:
+            outbox.post(channel, embed=embed, priority=PRIORITY_FILL)
+
+        for portfolio_id, (name, _) in portfolios.items():
+            portfolio_holdings = holdings.get(portfolio_id, [])
+
+            if report_due:
+                embed = open_report_embed(name, mark_engine.holdings(portfolio_id), time_now)
+                if embed:
+                    outbox.post(channel, embed=embed, priority=PRIORITY_REPORT)
+
+            if market_hours and moved:
+                embed = alert_embed(
+                    name, mark_engine.holdings(portfolio_id, moved), mark_engine.totals(portfolio_id),
+                    deltas.get(portfolio_id, 0.0), time_now
+                )
+                # the alerts of every portfolio on this tick are merged into few messages
+                if embed:
+                    outbox.post(channel, embed=embed, priority=PRIORITY_ALERT, coalesce=True, label=f'Portfolio {name}')
+
+            if news:
+                embed, shown = news_embed(name, portfolio_holdings, news, time_now)
+                if embed:
+                    # stories are only marked seen once the outbox has sent them, so a failed send is retried next run
+                    articles = [article for symbol in shown for article in posted.get(symbol, [])]
+                    outbox.post(
+                        channel, embed=embed, priority=PRIORITY_NEWS,
+                        on_sent=functools.partial(asyncio.to_thread, news_service.mark_seen, articles)
+                    )
+
+        if report_due:
+            state['report_date'] = time_now.date()
+
+        print(f'[{time_now}] SCHEDULER: Marked {len(portfolios)} portfolios over {len(symbols)} symbols, {len(deltas)} revalued.')
+
+    @portfolio_scheduler.before_loop
+    async def before_portfolio_scheduler():
+        """Move a portfolio.json registration into registered_portfolios before the first tick."""
+        await asyncio.to_thread(migrate_registered_portfolio, pool)
+
+    return {
+        'portfolio_scheduler': portfolio_scheduler,
+    }
@@ -0,0 +1,172 @@
+# Monte Carlo Value-at-Risk for portfolio holdings.
+# Correlated daily returns are drawn from a multivariate normal fitted to the holdings' history.
+# Simulations are split into chunks that run as vectorized NumPy paths across a process pool.
+#
+# Benchmark worker scaling:
+#   python -m src.portfolios.simulation --simulations 400000 --holdings 30 --horizon 10
+
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# simulated paths per chunk, bounds the (paths x holdings) matrix each worker allocates
+CHUNK_SIZE = 25000
+# longest holding period in trading days, one year
+MAX_HORIZON = 252
+
+_simulation_pool = None
+
+def get_simulation_pool(workers=None):
+    """Shared process pool for simulations, created on first use so commands do not pay process startup."""
+    global _simulation_pool
+
+    if _simulation_pool is None:
+        _simulation_pool = ProcessPoolExecutor(max_workers=workers)
+
+    return _simulation_pool
+
+def _simulate_chunk(args):
+    """Simulate portfolio P&L for one chunk of paths. Runs in a worker process."""
+    seed, paths, mean, cholesky, weights, value, horizon = args
+    rng = np.random.default_rng(seed)
+
+    # the sum of `horizon` iid N(mean, cov) daily returns is exactly N(horizon * mean, horizon * cov),
+    # so each path draws its horizon return directly in (paths, holdings) memory at any horizon
+    shocks = rng.standard_normal((paths, len(mean))) @ cholesky.T
+    holding_returns = np.expm1(shocks * np.sqrt(horizon) + horizon * mean)
+
+    return value * (holding_returns @ weights)
+
+def _chunks(simulations, seed, mean, cholesky, weights, value, horizon):
+    """Split the simulations into independently seeded chunks."""
+    counts = [CHUNK_SIZE] * (simulations // CHUNK_SIZE)
+    if simulations % CHUNK_SIZE:
+        counts.append(simulations % CHUNK_SIZE)
+
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+
+    return [(s, count, mean, cholesky, weights, value, horizon) for s, count in zip(seeds, counts)]
+
+def simulate_var(mean, cov, weights, value, horizon=1, confidence=0.95, simulations=100000, workers=None, seed=None, executor=None):
+    """
+    Estimate Value-at-Risk and Conditional VaR (expected shortfall) by simulation.
+
+    :param mean: array (holdings,) of mean daily log returns
+    :param cov: array (holdings, holdings) covariance of daily log returns
+    :param weights: array (holdings,) of value weights
+    :param value: current market value of the holdings
+    :param horizon: holding period in trading days
+    :param confidence: confidence level, e.g. 0.95
+    :param simulations: number of simulated paths
+    :param workers: worker processes, 1 runs in-process
+    :param executor: optional existing process pool to reuse
+    :return: dict with 'var' and 'cvar' as positive dollar losses
+    """
+    mean = np.asarray(mean, dtype=float)
+    cov = np.atleast_2d(cov)
+
+    # small ridge keeps Cholesky stable when holdings are perfectly correlated
+    cholesky = np.linalg.cholesky(cov + np.eye(len(mean)) * 1e-12)
+
+    chunks = _chunks(simulations, seed, mean, cholesky, np.asarray(weights, dtype=float), value, horizon)
+
+    if executor is not None:
+        pnl = np.concatenate(list(executor.map(_simulate_chunk, chunks)))
+    elif workers == 1:
+        pnl = np.concatenate([_simulate_chunk(chunk) for chunk in chunks])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pnl = np.concatenate(list(pool.map(_simulate_chunk, chunks)))
+
+    cutoff = np.quantile(pnl, 1 - confidence)
+    tail = pnl[pnl <= cutoff]
+
+    return {
+        'var': float(-cutoff),
+        'cvar': float(-tail.mean()) if tail.size else float(-cutoff),
+        'simulations': int(pnl.size),
+        'horizon': horizon,
+        'confidence': confidence,
+        'value': value,
+    }
+
+def monte_carlo_var(returns, weights, value, **kwargs):
+    """
+    Simulate VaR from a (days, holdings) array of historical daily log returns.
+    Keyword arguments are passed to simulate_var.
+    """
+    return simulate_var(returns.mean(axis=0), np.cov(returns, rowvar=False), weights, value, **kwargs)
+
+def portfolio_var(conn, name, horizon=1, confidence=0.95, simulations=100000, workers=None, executor=None):
+    """
+    Monte Carlo VaR of a portfolio's current holdings using the return covariance
+    maintained by the correlation service.
+
+    :return: dict of results, or an error message string
+    """
+    from src.portfolios.correlation import correlation_service
+    from src.portfolios.database.procedures import get_portfolio_id, get_holdings
+
+    portfolio_id = get_portfolio_id(conn, name)
+    if not portfolio_id:
+        return f"Portfolio '{name}' not found."
+
+    holdings = get_holdings(conn, portfolio_id)
+    if not holdings:
+        return f'No holdings for portfolio: {name}.'
+
+    shares_by_symbol = {symbol: shares for symbol, _, shares, _ in holdings}
+    tracker = correlation_service.get_tracker(list(shares_by_symbol))
+
+    if tracker is None or tracker.count < 30:
+        return f'Not enough price history to simulate VaR for portfolio: {name}.'
+
+    shares = np.array([shares_by_symbol[symbol] for symbol in tracker.symbols], dtype=float)
+    values = tracker.last_prices * shares
+
+    result = simulate_var(
+        tracker.mean(), tracker.covariance(), values / values.sum(), float(values.sum()),
+        horizon=horizon, confidence=confidence, simulations=simulations, workers=workers, executor=executor
+    )
+    result['name'] = name
+    result['symbols'] = tracker.symbols
+
+    return result
+
+def benchmark(simulations=400000, holdings=30, horizon=10, max_workers=None, seed=0):
+    """Time monte_carlo_var on synthetic returns for 1, 2, 4, ... workers and print the speedup."""
+    import os
+
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.01, (252, 3))
+    returns = factors @ rng.normal(0, 1, (3, holdings)) + rng.normal(0, 0.005, (252, holdings))
+    weights = np.full(holdings, 1 / holdings)
+
+    max_workers = max_workers or os.cpu_count() or 1
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= max_workers:
+        worker_counts.append(worker_counts[-1] * 2)
+
+    print(f'{simulations:,} simulations, {holdings} holdings, {horizon}-day horizon')
+
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        result = monte_carlo_var(returns, weights, 1_000_000, horizon=horizon, simulations=simulations, workers=workers, seed=seed)
+        seconds = time.perf_counter() - start
+
+        baseline = baseline or seconds
+        print(f"workers={workers:<3} {seconds:7.2f}s  speedup {baseline / seconds:4.2f}x  "
+              f"VaR ${result['var']:,.0f}  CVaR ${result['cvar']:,.0f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Monte Carlo VaR worker scaling.')
+    parser.add_argument('--simulations', type=int, default=400000)
+    parser.add_argument('--holdings', type=int, default=30)
+    parser.add_argument('--horizon', type=int, default=10)
+    parser.add_argument('--max-workers', type=int, default=None)
+    args = parser.parse_args()
+
+    benchmark(args.simulations, args.holdings, args.horizon, args.max_workers)
@@ -0,0 +1,125 @@
+# Cached per-portfolio valuation views for !summary, !holdings and !assets.
+# A view holds the portfolio's holdings, prices and asset types with the rendered portfolio_data
+# and asset weights. Trades invalidate the view of their portfolio, scheduler price ticks re-render
+# views in place, so repeated commands do no SQL or network work.
+
+import time
+import threading
+
+from src.stock_data import get_batch_prices, get_asset_type
+from src.portfolios.database.procedures import get_portfolio_id, get_portfolio_balance, get_holdings, get_realized_pnl
+from src.portfolios.portfolio_logic import build_portfolio_data, build_asset_weights
+
+# seconds before a view's prices are refetched when no price tick has refreshed them
+PRICE_TTL = 300
+
+class PortfolioViewCache:
+    """Valuation views keyed by portfolio name, safe to use from worker threads."""
+
+    def __init__(self, price_ttl=PRICE_TTL):
+        self._price_ttl = price_ttl
+        self._views = {}
+        # bumped on invalidation so a view built from data read before a trade is not stored
+        self._generations = {}
+        # asset types never change, so they are kept across invalidations
+        self._asset_types = {}
+        self._lock = threading.Lock()
+
+    def _asset_types_for(self, symbols):
+        missing = [symbol for symbol in symbols if symbol not in self._asset_types]
+        for symbol in missing:
+            self._asset_types[symbol] = get_asset_type(symbol).capitalize()
+
+        return {symbol: self._asset_types[symbol] for symbol in symbols}
+
+    def _render(self, view):
+        view['data'] = build_portfolio_data(view['name'], view['balance'], view['holdings'], view['realized'], view['prices'])
+        view['weights'] = build_asset_weights(view['holdings'], view['prices'], view['asset_types'])
+
+    def get(self, conn, name):
+        """
+        Get the view of a portfolio, building it on a miss and refetching prices once they are stale.
+
+        :return: view dict, or an error message string
+        """
+        with self._lock:
+            view = self._views.get(name)
+            generation = self._generations.get(name, 0)
+
+        if view is not None:
+            if time.monotonic() - view['priced_at'] < self._price_ttl:
+                return view
+
+            view = dict(view, prices=get_batch_prices(view['symbols']) if view['symbols'] else {}, priced_at=time.monotonic())
+        else:
+            portfolio_id = get_portfolio_id(conn, name)
+            if not portfolio_id:
+                return f"Portfolio '{name}' not found."
+
+            holdings = get_holdings(conn, portfolio_id)
+            symbols = [row[0].upper() for row in holdings]
+
+            view = {
+                'portfolio_id': portfolio_id,
+                'name': name,
+                'balance': get_portfolio_balance(conn, portfolio_id),
+                'holdings': holdings,
+                'realized': get_realized_pnl(conn, portfolio_id),
+                'symbols': symbols,
+                'prices': get_batch_prices(symbols) if symbols else {},
+                'priced_at': time.monotonic(),
+                'asset_types': self._asset_types_for(symbols),
+            }
+
+        self._render(view)
+
+        with self._lock:
+            if self._generations.get(name, 0) == generation:
+                self._views[name] = view
+
+        return view
+
+    def peek(self, name):
+        """The view of a portfolio if it is cached with fresh prices, without building or repricing it."""
+        with self._lock:
+            view = self._views.get(name)
+
+        if view is not None and time.monotonic() - view['priced_at'] < self._price_ttl:
+            return view
+
+        return None
+
+    def portfolio_data(self, conn, name):
+        """Cached equivalent of portfolio_logic.portfolio_data."""
+        view = self.get(conn, name)
+        return view if isinstance(view, str) else view['data']
+
+    def asset_weights(self, conn, name):
+        """Cached equivalent of portfolio_logic.get_asset_weights."""
+        view = self.get(conn, name)
+        return view if isinstance(view, str) else view['weights']
+
+    def invalidate(self, *names):
+        """Drop the views of the named portfolios, e.g. after a trade. No names drops every view."""
+        with self._lock:
+            for name in names or list(self._views):
+                self._views.pop(name, None)
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+    def update_prices(self, prices):
+        """Re-render the views holding any of the ticked symbols with the new prices."""
+        ticked = set(prices)
+
+        with self._lock:
+            for name, view in list(self._views.items()):
+                if ticked.isdisjoint(view['symbols']):
+                    continue
+
+                # only a tick covering every held symbol makes the view's prices fresh again
+                priced_at = time.monotonic() if ticked.issuperset(view['symbols']) else view['priced_at']
+
+                view = dict(view, prices={**view['prices'], **prices}, priced_at=priced_at)
+                self._render(view)
+                self._views[name] = view
+
+view_cache = PortfolioViewCache()
@@ -1,3 +1,5 @@
+import io
+import csv
 import requests
 import pandas as pd
 import yfinance as yf
@@ -7,7 +9,35 @@ from src.config.config import last_checked_prices, sp500_last_checked_prices
 from src.config.storage import STOCK_SYMBOLS
 from src.config.utils import clean_symbol, percent_change, stock_change
 
+SP500_CONSTITUENTS_URL = 'https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv'
+
 sp500_cycle = None
+sp500_company_names = None
+
+def get_company_names(symbols):
+    """
+    Look up company names of symbols in the S&P 500 constituents list, which is fetched once.
+
+    Args:
+        symbols (list): Ticker symbols to look up.
+
+    Returns:
+        dict: Symbol to company name (e.g. 'Apple Inc.') for the symbols that are constituents.
+    """
+    global sp500_company_names
+
+    if sp500_company_names is None:
+        try:
+            response = requests.get(SP500_CONSTITUENTS_URL, timeout=10)
+            response.raise_for_status()
+
+            sp500_company_names = {row['Symbol']: row['Security'] for row in csv.DictReader(io.StringIO(response.text))}
+        except Exception as e:
+            print(f'Error loading S&P 500 constituents: {e}')
+            return {}
+
+    return {symbol: sp500_company_names[symbol] for symbol in symbols if symbol in sp500_company_names}
+
 def get_sp500_movers(percent_threshold=2, batch_size=25):
     """
     Check a rotating batch of S&P 500 constituents and return symbols that
@@ -29,9 +59,7 @@ def get_sp500_movers(percent_threshold=2, batch_size=25):
     global sp500_cycle
 
     try:
-        csv_url = 'https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv'
-        
-        response = requests.get(csv_url)
+        response = requests.get(SP500_CONSTITUENTS_URL)
         response.raise_for_status()
 
         lines = response.text.strip().split('\n')